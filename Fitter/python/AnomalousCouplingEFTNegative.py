@@ -64,6 +64,9 @@ class AnaliticAnomalousCouplingEFTNegative(PhysicsModel):
         self.modelBuilder.doVar("r[1,-10,10]")
         self.poiNames = "r"
         self.quadFactors = []
+        self.mixedExpressions = {}
+        self.binTemplates = {}      # {(bin,sig): (lins,quads,pairs)} of the templates in the datacard
+        self.templateConfigs = {}   # Index of each set of pruned templates, to name (and share) their functions
 
         for operator in self.alloperators:
             self.modelBuilder.doVar(operator + "[0,-200,200]")
@@ -171,22 +174,111 @@ class AnaliticAnomalousCouplingEFTNegative(PhysicsModel):
                             op1=sgnl_ops[i],
                             op2=sgnl_ops[j]
                         )
-                        if self.verbose:
-                            print("Mixed expr: {}".format(expression))
-                        self.modelBuilder.factory_(expression)
+                        # Only made once a process actually uses it (see getMixedFunction), so the mixed terms
+                        # pruned from the datacard don't end up in the workspace
+                        self.mixedExpressions[func_name] = expression
         print(" parameters of interest = {}".format(self.poiNames))
         print(" self.numOperators = {}".format(self.numOperators))
         self.modelBuilder.doSet("POI",self.poiNames)
 
 
+    def getMixedFunction(self,name):
+        """ Make the function for a mixed term, if it wasn't made yet."""
+        if not self.modelBuilder.out.function(name):
+            expression = self.mixedExpressions[name]
+            if self.verbose:
+                print("Mixed expr: {}".format(expression))
+            self.modelBuilder.factory_(expression)
+        return name
+
+
+    def getTemplates(self,bin,sig):
+        """ The WCs with a lin and with a quad template, and the pairs with a mixed template, of a signal in a datacard bin."""
+        if (bin,sig) not in self.binTemplates:
+            lins,quads,pairs = set(),set(),set()
+            for process in self.DC.exp[bin]:
+                match = self.mixed_re.search(process)
+                if match:
+                    if match.group('proc') == sig: pairs.add(frozenset([match.group('c1'),match.group('c2')]))
+                    continue
+                match = self.lin_re.search(process)
+                if match:
+                    if match.group('proc') == sig: lins.add(match.group('c1'))
+                    continue
+                match = self.quad_re.search(process)
+                if match and match.group('proc') == sig: quads.add(match.group('c1'))
+            self.binTemplates[(bin,sig)] = (frozenset(lins),frozenset(quads),frozenset(pairs))
+        return self.binTemplates[(bin,sig)]
+
+
+    def makeFunction(self,name,formula,ops):
+        """ Make expr::name(formula, ops), if it wasn't made yet."""
+        if not self.modelBuilder.out.function(name):
+            expression = "expr::{name}(\"{formula}\", {ops})".format(name=name,formula=formula,ops=",".join(ops))
+            if self.verbose:
+                print("Pruned expr: {}".format(expression))
+            self.modelBuilder.factory_(expression)
+        return name
+
+
+    def getPrunedFunction(self,bin,sig,kind,op=None):
+        """ Yield scale of a signal template in a bin where some of its templates were pruned (see HistoReader.pruneTemplates).
+
+        With A the WCs with a S+L_i+Q_i template and P the pairs with a mixed template, the yield
+            S + sum_i (L_i x_i + Q_i x_i^2) + sum_P M_ij x_i x_j
+        is made of the templates with the scales
+            S:         1 - sum_A x_i + sum_P c_ij x_i x_j, with c_ij = 1 - [i not in A] - [j not in A]
+            S+L_i+Q_i: x_i (1 - sum_{j paired with i} x_j)
+            Q_i:       x_i^2 - x_i, or x_i^2 if i is not in A
+            mixed_ij:  x_i x_j
+        which is the same as the standard functions when no template is missing.
+        """
+        lins,quads,pairs = self.getTemplates(bin,sig)
+        if kind == 'quad':
+            if op in lins:
+                return "func_{p}_quadratic_{op}".format(p=sig,op=op)
+            return self.makeFunction("func_{p}_quadratic_only_{op}".format(p=sig,op=op),"@0*@0",[op])
+        key = (sig,lins,pairs)
+        if key not in self.templateConfigs:
+            self.templateConfigs[key] = len(self.templateConfigs)
+        suffix = "pruned{}".format(self.templateConfigs[key])
+        if kind == 'sm':
+            ops = sorted(lins | set(op for pair in pairs for op in pair))
+            if not ops:
+                return 1
+            idx = dict((x,i) for i,x in enumerate(ops))
+            formula = "1" + "".join("-@{}".format(idx[x]) for x in sorted(lins))
+            for pair in sorted(pairs,key=sorted):
+                c1,c2 = sorted(pair)
+                factor = 1 - (c1 not in lins) - (c2 not in lins)
+                if factor:
+                    formula += "{}@{}*@{}".format('+' if factor > 0 else '-',idx[c1],idx[c2])
+            return self.makeFunction("func_{p}_sm_{s}".format(p=sig,s=suffix),formula,ops)
+        partners = sorted(x for pair in pairs if op in pair for x in pair if x != op)
+        formula = "@0*(1" + "".join("-@{}".format(i+1) for i in range(len(partners))) + ")"
+        return self.makeFunction("func_{p}_sm_linear_quadratic_{op}_{s}".format(p=sig,op=op,s=suffix),formula,[op]+partners)
+
+
+    def isPruned(self,bin,sig):
+        """ Whether any lin or mixed template of a signal is missing from a datacard bin."""
+        lins,quads,pairs = self.getTemplates(bin,sig)
+        ops = self.Operators[sig]
+        all_pairs = set(frozenset([ops[i],ops[j]]) for i in range(len(ops)) for j in range(i+1,len(ops)))
+        return lins != set(ops) or pairs != all_pairs
+
+
     def getYieldScale(self,bin,process):
         """ Define how the yields change."""
         if any( process.startswith(x) for x in self.sgnl_known):
             if self.sm_re.search(process):
                 match = self.sm_re.search(process)
+                if self.isPruned(bin,match.group('proc')):
+                    return self.getPrunedFunction(bin,match.group('proc'),'sm')
                 return "func_{p}_sm".format(p=match.group('proc'))
             elif self.lin_re.search(process): 
                 match = self.lin_re.search(process)
+                if self.isPruned(bin,match.group('proc')):
+                    return self.getPrunedFunction(bin,match.group('proc'),'lin',match.group('c1'))
                 return "func_{p}_sm_linear_quadratic_{c1}".format(p=match.group('proc'),c1=match.group('c1'))
             elif self.mixed_re.search(process):
                 match = self.mixed_re.search(process)
@@ -195,13 +287,15 @@ class AnaliticAnomalousCouplingEFTNegative(PhysicsModel):
                 proc = match.group('proc')
                 name = "func_{p}_sm_linear_quadratic_mixed_{c1}_{c2}".format(p=proc,c1=c1,c2=c2)
                 if name in self.quadFactors:
-                    return "func_{p}_sm_linear_quadratic_mixed_{c1}_{c2}".format(p=proc,c1=c1,c2=c2)
+                    return self.getMixedFunction("func_{p}_sm_linear_quadratic_mixed_{c1}_{c2}".format(p=proc,c1=c1,c2=c2))
                 else:
-                    return "func_{p}_sm_linear_quadratic_mixed_{c2}_{c1}".format(p=proc,c1=c1,c2=c2)
+                    return self.getMixedFunction("func_{p}_sm_linear_quadratic_mixed_{c2}_{c1}".format(p=proc,c1=c1,c2=c2))
             elif self.quad_re.search(process):
                 match = self.quad_re.search(process)
                 c1 = match.group('c1')
                 proc = match.group('proc')
+                if self.isPruned(bin,proc):
+                    return self.getPrunedFunction(bin,proc,'quad',c1)
                 return "func_{p}_quadratic_{c1}".format(p=proc,c1=c1)
             else:
                 #raise RuntimeError("Undefined process %s"%process)
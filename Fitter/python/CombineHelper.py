@@ -2,6 +2,7 @@ import os
 import logging
 import shutil
 import copy
+import json
 import random
 
 import consts as CONST
@@ -11,6 +12,9 @@ from DatacardReader import DatacardReader
 from LvlFormatter import LvlFormatter
 from utils import regex_match,run_command,CombineMethod,FitAlgo,WorkspaceType,BatchType
 from options import HelperOptions
+from local_batch import run_local_scan
+from workspace_cache import WorkspaceCache, get_model_files
+from combine_steps import CombineStep,run_steps
 
 class CombineHelper(object):
     '''
@@ -34,6 +38,10 @@ class CombineHelper(object):
 
         self.dc_maker = DatacardMaker()
         self.dc_reader = DatacardReader()
+        self.ws_cache = WorkspaceCache()
+
+        self.steps = []         # The combine steps declared with addStep
+        self.recorded = None    # While not None, runCommand records the commands instead of running them
 
         self.ops = HelperOptions()
         if not preset is None: self.setOptions(preset=preset)
@@ -43,6 +51,7 @@ class CombineHelper(object):
         self.ops = HelperOptions()
         self.dc_maker  = DatacardMaker()
         self.dc_reader = DatacardReader()
+        self.steps = []
 
     # Note: 'name' is relative to the 'test' directory of 'EFTFit/Fitter'
     def setOutputDirectory(self,name):
@@ -245,6 +254,48 @@ class CombineHelper(object):
         if not overwrite:
             self.setOptions(preset=orig_ops)
 
+    # Run a shell command, or record it while the commands of the combine steps are being collected
+    #   - If the 'command_log_dir' option is set, the output is also written to {command_log_dir}/{name}.log
+    def runCommand(self,args):
+        if self.recorded is not None:
+            self.recorded.append(list(args))
+            return
+        log_file = None
+        log_dir = self.ops.getOption('command_log_dir')
+        if log_dir:
+            if not os.path.exists(log_dir):
+                os.makedirs(log_dir)
+            log_file = os.path.join(log_dir,'{}.log'.format(self.ops.getOption('name').lstrip('.')))
+        run_command(args,log_file=log_file)
+
+    # Declare a combine step, which is run by runSteps as soon as the steps it depends on have finished
+    #   name: Unique name of the step, also used as the combine output name (-n) and for its log file
+    #   depends: Names of the steps which have to finish first
+    #   extend,kwargs: Options to adjust for this step only (as in runCombine)
+    def addStep(self,name,depends=[],extend=False,**kwargs):
+        if name in [step[0] for step in self.steps]:
+            self.logger.error("Combine step %s was already added",name)
+            raise RuntimeError
+        self.steps.append((name,list(depends),extend,kwargs))
+
+    # Run the declared combine steps, with independent steps running at the same time
+    #   nworkers: Max number of steps to run at the same time, defaults to the number of cores
+    #   Returns {step: wall time}, the declared steps are cleared afterwards
+    def runSteps(self,nworkers=None,log_dir='logs_steps'):
+        to_run = []
+        # The commands are built up front in this thread, using the options of each step, so the workers
+        #   only have to run them and never touch the (shared) helper options
+        try:
+            for name,depends,extend,kwargs in self.steps:
+                self.recorded = []
+                self.runCombine(overwrite=False,extend=extend,name=name,**kwargs)
+                to_run.append(CombineStep(name,self.recorded,depends=depends))
+        finally:
+            self.recorded = None
+        self.steps = []
+        self.chdir(self.getOutputDirectory())
+        return run_steps(to_run,nworkers=nworkers,log_dir=log_dir,cwd=self.getOutputDirectory())
+
     # Call DatacardMaker() to create the initial datacard text file
     def make_datacard(self,remove_bkgds=[]):
         card_file = self.ops.getOption('datacard_file')
@@ -276,8 +327,23 @@ class CombineHelper(object):
         script_path = os.path.join(CONST.EFTFIT_TEST_DIR,'../scripts/FitConversionEFT.py')
         args  = ['python',script_path,fpath]
 
+        # Skip the conversion if the parameterization was already made from this exact histogram file
+        out_path = os.path.join(CONST.EFTFIT_HIST_DIR,self.ops.getOption('conversion_file'))
+        stamp_path = out_path + '.stamp'
+        stamp = None
+        if os.path.exists(fpath):
+            stamp = [os.path.abspath(fpath),os.path.getsize(fpath),os.path.getmtime(fpath)]
+            if os.path.exists(out_path) and os.path.exists(stamp_path):
+                with open(stamp_path) as f:
+                    if json.load(f) == stamp:
+                        self.logger.info("Parameterization file %s is up to date",out_path)
+                        return
+
         self.logger.info("FitConversion command: %s",' '.join(args))
         run_command(args)
+        if stamp is not None:
+            with open(stamp_path,'w') as f:
+                json.dump(stamp,f)
 
     def make_workspace(self):
         '''
@@ -334,8 +400,22 @@ class CombineHelper(object):
             args.extend(['--X-allow-no-background'])
         for po in phys_ops: args.extend(['--PO',po])
 
+        # Reuse an identical workspace if one was already built (in any output directory)
+        #   - The parameterization is keyed on its content, not on where it lives
+        #   - The physics model code (and the local modules it imports) is part of the key too
+        use_cache = self.ops.getOption('use_ws_cache')
+        if use_cache:
+            fits_files = [po.split('=',1)[1] for po in phys_ops if po.startswith('fits=')]
+            options = ['fits=' if x.startswith('fits=') else x for x in args[4:]]
+            key = self.ws_cache.getKey(datacard,options,extra_files=fits_files+get_model_files(model))
+            if self.ws_cache.fetch(key,ws_file):
+                self.logger.info("Reusing cached workspace %s",self.ws_cache.getPath(key))
+                return
+
         self.logger.info("text2workspace command: %s",' '.join(args))
         run_command(args)
+        if use_cache:
+            self.ws_cache.store(key,ws_file)
 
     # Run combine using the FitDiagnostic method
     def make_fitdiagnostics(self):
@@ -361,7 +441,7 @@ class CombineHelper(object):
         if other_ops: args.extend([x for x in other_ops])
         
         self.logger.info("Combine command: %s", ' '.join(args))
-        run_command(args)
+        self.runCommand(args)
 
     # Run combine using the MultiDimFit method
     def make_multidimfit(self):
@@ -434,17 +514,24 @@ class CombineHelper(object):
                 to_track = [wc for wc in pois if wc not in to_scan]
 
                 task_name = name.replace('.','') + "_{job}".format(job=''.join(to_scan))
+                job_name = '.{base}.{job}'.format(base=name,job=''.join(to_scan))
                 to_submit.append("condor_{}.sub".format(task_name))
                 to_exec.append("condor_{}.sh".format(task_name))
-                args = ['combineTool.py']
-                args.extend(['-M',method])
-                args.extend(['-d',ws_file])
-                args.extend(['--job-mode',batch_mode])
-                args.extend(['--task-name',task_name])
-                if scan_pts > split_pts:
-                    args.extend(['--split-points','{}'.format(split_pts)])
+                if batch_mode == BatchType.LOCAL:
+                    # The local backend calls combine directly and takes care of the splitting itself
+                    args = ['combine']
+                    args.extend(['-M',method])
+                    args.extend(['-d',ws_file])
+                else:
+                    args = ['combineTool.py']
+                    args.extend(['-M',method])
+                    args.extend(['-d',ws_file])
+                    args.extend(['--job-mode',batch_mode])
+                    args.extend(['--task-name',task_name])
+                    if scan_pts > split_pts:
+                        args.extend(['--split-points','{}'.format(split_pts)])
+                    args.extend(['-n',job_name])
 
-                args.extend(['-n','.{base}.{job}'.format(base=name,job=''.join(to_scan))])
                 args.extend(['-v','{verb}'.format(verb=verb)])
                 args.extend(['--algo={algo}'.format(algo=algo)])
                 if self.ops.getOption('use_poi_ranges'):
@@ -484,11 +571,28 @@ class CombineHelper(object):
                     # This option generates the condor submit files, which we then have to run
                     #   ourselves due to permission issues on the T3
                     args.extend(['--dry-run'])
+                elif batch_mode == BatchType.LOCAL:
+                    if self.recorded is not None:
+                        raise RuntimeError("BatchType.LOCAL scans can't be run as a combine step, they already run in parallel")
+                    # Run the blocks on a local process pool, the merged output has the same name a
+                    #   single (non-split) combine job would have produced
+                    self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
+                    out_file = 'higgsCombine{name}.{method}.mH120.root'.format(name=job_name,method=method)
+                    failed = run_local_scan(args,job_name,scan_pts,out_file,
+                        split_points=split_pts if scan_pts > split_pts else None,
+                        nworkers=self.ops.getOption('local_workers'),
+                        retries=self.ops.getOption('local_retries'),
+                        log_dir='logs{}'.format(job_name),
+                        method=method
+                    )
+                    if failed:
+                        self.logger.error("{n} blocks of {name} failed: {blocks}".format(n=len(failed),name=job_name,blocks=failed))
+                    continue
                 else:
                     raise RuntimeError("Unknown BatchType: {}".format(batch_mode))
 
                 self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
-                run_command(args)
+                self.runCommand(args)
 
             if batch_mode == BatchType.CONDOR:
                 # Now actually run the condor submit jobs
@@ -512,20 +616,20 @@ class CombineHelper(object):
                     sed_str = "s|cd {old}|cd {new}|g".format(old=old_path,new=new_path)
                     args = ['sed','-i','-e',sed_str,condor_exec]
                     self.logger.info("sed command: {cmd}".format(cmd=' '.join(args)))
-                    run_command(args)
+                    self.runCommand(args)
 
                     args = ['chmod','a+x',condor_exec]
                     self.logger.info("Permissions command: {cmd}".format(cmd=' '.join(args)))
-                    run_command(args)
+                    self.runCommand(args)
 
                     args = ['condor_submit']
                     args.extend(['-append','initialdir={}'.format(condor_output_dir)])
                     args.extend([condor_sub])
                     self.logger.info("Condor command: {cmd}".format(cmd=' '.join(args)))
-                    run_command(args)
+                    self.runCommand(args)
         else:
             self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
-            run_command(args)
+            self.runCommand(args)
 
     def make_impact_plots(self):
         '''
@@ -580,7 +684,7 @@ class CombineHelper(object):
         if other_ops: args.extend([x for x in other_ops])
         if is_robust: args.extend(['--robustFit','1'])
         self.logger.info("Initial Fits command: %s", ' '.join(args))
-        run_command(args)
+        self.runCommand(args)
 
         # Do a fit for each nuisance parameter in the datacard
         args = ['combineTool.py','-M',method,'--doFits','--allPars']
@@ -593,7 +697,7 @@ class CombineHelper(object):
         if other_ops: args.extend([x for x in other_ops])
         if is_robust: args.extend(['--robustFit','1'])
         self.logger.info("Do Fits command: %s", ' '.join(args))
-        run_command(args)
+        self.runCommand(args)
 
         # Create a json file using as input the files generated in the previous two steps
         args = ['combineTool.py','-M',method,'-o','impacts.json','--allPars']
@@ -602,7 +706,7 @@ class CombineHelper(object):
         if exclude_nuis: args.extend(['--exclude',','.join(exclude_nuis)])
         if redef_pois: args.extend(['--redefineSignalPOIs',','.join(redef_pois)])
         self.logger.info("To JSON command: %s", ' '.join(args))
-        run_command(args)
+        self.runCommand(args)
 
         # Create the impact plot pdf file
         pois = [x for x in redef_pois] if redef_pois else [x for x in self.getPOIs()]
@@ -610,7 +714,7 @@ class CombineHelper(object):
             outf = 'impacts_%s' % (poi)
             args = ['plotImpacts.py','-i','impacts.json','--POI','%s' % (poi),'-o',outf]
             self.logger.info("%s POI command: %s",poi,' '.join(args))
-            run_command(args)
+            self.runCommand(args)
 
     # Run combine using the GoodnessOfFit method
     def make_gof_test(self):
@@ -657,7 +761,7 @@ class CombineHelper(object):
         if other_ops: args.extend([x for x in other_ops])
 
         self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
-        run_command(args)
+        self.runCommand(args)
 
         if num_toys < 1:
             return
@@ -714,7 +818,7 @@ class CombineHelper(object):
                 else:
                     raise RuntimeError("Unknown BatchType: {}".format(batch_mode))
                 self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
-                run_command(args)
+                self.runCommand(args)
                 toys_left -= job_toys
                 job_count += 1
 
@@ -738,19 +842,19 @@ class CombineHelper(object):
                     sed_str = "s|cd {old}|cd {new}|g".format(old=old_path,new=new_path)
                     args = ['sed','-i','-e',sed_str,condor_exec]
                     self.logger.info("sed command: {cmd}".format(cmd=' '.join(args)))
-                    run_command(args)
+                    self.runCommand(args)
 
                     # Make the generated bash script executable
                     args = ['chmod','a+x',condor_exec]
                     self.logger.info("Permissions command: {cmd}".format(cmd=' '.join(args)))
-                    run_command(args)
+                    self.runCommand(args)
 
                     args = ['condor_submit']
                     args.extend(['-append','initialdir={}'.format(condor_output_dir)])
                     args.extend([condor_sub])
                     self.logger.info("Condor command: {cmd}".format(cmd=' '.join(args)))
                     self.logger.info("")
-                    run_command(args)
+                    self.runCommand(args)
         else:
             args = ['combine']
             args.extend(['-M',method])
@@ -769,7 +873,7 @@ class CombineHelper(object):
             if other_ops: args.extend([x for x in other_ops])
 
             self.logger.info("Combine command: {cmd}".format(cmd=' '.join(args)))
-            run_command(args)
+            self.runCommand(args)
         return
 
 if __name__ == "__main__":
@@ -1,35 +1,232 @@
 from HistoReader import HistoReader
+from template_store import TemplateStore
 import ROOT as r 
 import re 
+import multiprocessing
+import numpy as np
 
+# Bin contents of a TH1 as an array, including the under/overflow bins
+def getContents(histo):
+    return np.frombuffer(histo.GetArray(), dtype=np.float64, count=histo.GetNcells()).copy()
+
+# Crop the negative bins of a histogram (in place) to zero, with a zero error, the other bins keep their errors
 def cropNegativeYields(histo):
-    for bin in range(1, histo.GetNbinsX()+1):
-        if histo.GetBinContent(bin)<0:
-            print '[W]: Negative yields in %s: %f. Cropping to zero'%(histo.GetName(), histo.GetBinContent(bin))
-            histo.SetBinContent(bin,0)
+    contents=getContents(histo)
+    neg=np.nonzero(contents[1:-1]<0)[0]+1
+    for bin in neg:
+        print '[W]: Negative yields in %s: %f. Cropping to zero'%(histo.GetName(), contents[bin])
+    if len(neg):
+        contents[neg]=0
+        histo.SetContent(contents)
+        for bin in neg:
+            histo.SetBinError(int(bin), 0.)
     return histo
 
+# Default settings of the template-level pruning (see pruneCategory)
+DEFAULT_PRUNING = {
+    'shape_tol': 1e-3,  # Drop a shape systematic for a process if up/down never deviate more than this (relative) from nominal
+    'lnN_tol':   1e-3,  # Use lnN instead of shape if the up/down to nominal ratios vary less than this across the bins
+    'merge_frac': 1e-3, # Merge the backgrounds with less than this fraction of the category's total background
+}
+MERGED_BKG_NAME = 'other_bkgs'
+
+# Detached copy of a template, so it can be modified (and named) without touching the original
+def cloneShape(histo, name):
+    ret=histo.Clone(name)
+    ret.SetDirectory(0)
+    r.SetOwnership(ret, True)
+    return ret
+
+def getSystName(syst):
+    return syst.replace("UP","").replace("DOWN","")
+
+# Merge the small backgrounds of a category into a single MERGED_BKG_NAME process
+#   shapes: {proc: {syst: contents}} with the nominal under ''
+#   histos: {proc: {syst: TH1}}, the histograms the contents were taken from
+#   - The variations of the merged process are the sums of the variations of its components, using the
+#     nominal for the components which don't have that systematic
+#   - The histograms are summed with Add(), so the errors of the components are combined
+def mergeSmallProcesses(shapes, histos, bkg_procs, merge_frac, report, cat):
+    total=sum(shapes[proc][''][1:-1].sum() for proc in shapes if proc in bkg_procs)
+    small=[proc for proc in shapes if proc in bkg_procs and shapes[proc][''][1:-1].sum() < merge_frac*total]
+    if len(small) < 2:
+        return shapes,histos
+    systs=set(syst for proc in small for syst in shapes[proc])
+    merged={}
+    merged_histos={}
+    for syst in systs:
+        for proc in small:
+            histo=histos[proc].get(syst, histos[proc][''])
+            if syst not in merged_histos:
+                merged_histos[syst]=cloneShape(histo, '%s_%s'%(MERGED_BKG_NAME, syst))
+            else:
+                merged_histos[syst].Add(histo)
+        merged[syst]=getContents(merged_histos[syst])
+    for proc in small:
+        report.append((cat, proc, '', 'merged into %s (%.3g events)'%(MERGED_BKG_NAME, shapes[proc][''][1:-1].sum())))
+        del shapes[proc]
+        del histos[proc]
+    shapes[MERGED_BKG_NAME]=merged
+    histos[MERGED_BKG_NAME]=merged_histos
+    return shapes,histos
+
+# Decide how each systematic of a process is used
+#   Returns {systName: None (negligible), 'shape' or (kappa_down, kappa_up) (lnN-like)}
+def classifySystematics(proc_shapes, prune):
+    nominal=proc_shapes[''][1:-1]
+    nonzero=nominal>0
+    total=nominal.sum()
+    ret={}
+    for syst in proc_shapes:
+        if syst == "" or "DOWN" in syst: continue
+        name=getSystName(syst)
+        down_syst=syst.replace("UP","DOWN")
+        if "UP" not in syst or down_syst not in proc_shapes or total <= 0:
+            ret[name]='shape'
+            continue
+        up=proc_shapes[syst][1:-1]
+        down=proc_shapes[down_syst][1:-1]
+        # Variations in bins without any nominal yield can't be described relative to nominal
+        if np.any(up[~nonzero]!=0) or np.any(down[~nonzero]!=0):
+            ret[name]='shape'
+            continue
+        r_up=up[nonzero]/nominal[nonzero]
+        r_down=down[nonzero]/nominal[nonzero]
+        if max(np.max(np.abs(r_up-1)), np.max(np.abs(r_down-1))) < prune['shape_tol']:
+            ret[name]=None
+        elif np.ptp(r_up) < prune['lnN_tol'] and np.ptp(r_down) < prune['lnN_tol']:
+            ret[name]=(down.sum()/total, up.sum()/total)
+        else:
+            ret[name]='shape'
+    return ret
+
+# Write the shapes file and the text datacard of a single category
+#   - Runs in its own worker process, so everything it needs is passed in job
+#   - iproc: The process ids for the datacard, shared by all of the categories
+#   - prune: The pruning settings (see DEFAULT_PRUNING), or None to keep everything
+#   - Returns the category and the list of (category, process, nuisance, action) pruning report entries
+def makeCategoryCard(job):
+    store_dir,cat,iproc,prune=job
+    store=TemplateStore(store_dir)
+    templates=store.readCategory(cat)
+    report=[]
+    for proc,contrib in store.getPruned(cat).iteritems():
+        report.append((cat, proc, '', 'pruned template (terms at most %.3g of the SM over the WC ranges)'%contrib))
+    data_obs=templates['data_sm']['']
+    inputs=r.TFile.Open("ttx_multileptons-%s.root"%cat, 'recreate')
+    inputs.WriteTObject( data_obs, "data_obs")
+    allyields={'data_obs' : data_obs.Integral()  }
+
+    # The (cropped) templates, and their bin contents
+    #   - The histograms keep their errors, which combine uses for the MC statistical uncertainties
+    histos={}
+    shapes={}
+    for proc in templates:
+        if proc == 'data_sm': 
+            continue
+        if templates[proc][''].Integral()<1e-3: 
+            continue
+        nominal=cropNegativeYields(cloneShape(templates[proc][''], proc))
+        histos[proc]={'': nominal}
+        shapes[proc]={'': getContents(nominal)}
+        for syst in templates[proc]: 
+            if syst=="": continue
+            histo=cropNegativeYields(cloneShape(templates[proc][syst], "%s_%s"%(proc,syst)))
+            if not histo.Integral():
+                print "Warning: underflow template for %s %s %s. Will take the nominal scaled down by a factor 2" % (cat, proc, syst)
+                histo.Add(nominal)
+                histo.Scale(0.5)
+            histos[proc][syst]=histo
+            shapes[proc][syst]=getContents(histo)
+    del templates
+
+    if prune:
+        shapes,histos=mergeSmallProcesses(shapes, histos, [p for p in iproc if iproc[p]>0], prune['merge_frac'], report, cat)
+    procs=[proc for proc in sorted(shapes, key=lambda p: iproc[p])]
+
+    # systMap: {systName: {proc: 'shape' or (kappa_down, kappa_up)}}
+    systMap={}
+    for proc in procs:
+        allyields[proc]=shapes[proc][''][1:-1].sum()
+        if prune:
+            classes=classifySystematics(shapes[proc], prune)
+        else:
+            classes=dict((getSystName(syst),'shape') for syst in shapes[proc] if syst!="" and "DOWN" not in syst)
+        for name,cls in classes.iteritems():
+            if cls is None:
+                report.append((cat, proc, name, 'dropped (within %g of nominal)'%prune['shape_tol']))
+                continue
+            systMap.setdefault(name, {})[proc]=cls
+
+    # A nuisance is only written as lnN if it is flat for all of the processes it affects
+    systTypes={}
+    for name in systMap:
+        if prune and all(cls!='shape' for cls in systMap[name].values()):
+            systTypes[name]='lnN'
+            report.append((cat, ','.join(sorted(systMap[name])), name, 'converted to lnN'))
+        else:
+            systTypes[name]='shape'
+
+    for proc in procs:
+        inputs.WriteTObject( histos[proc][''], proc)
+        for syst in shapes[proc]:
+            name=getSystName(syst)
+            if syst=="" or proc not in systMap.get(name, {}) or systTypes[name]!='shape': continue
+            histo_name="%s_%s"%(proc,syst.replace("UP","Up").replace("DOWN","Down"))
+            inputs.WriteTObject( histos[proc][syst], histo_name)
+    inputs.Close()
+    nuisances = sorted(systMap)
+
+    datacard = open("ttx_multileptons-%s.txt"%cat, "w"); 
+    datacard.write("shapes *        * ttx_multileptons-%s.root $PROCESS $PROCESS_$SYSTEMATIC\n" % cat)
+    datacard.write('##----------------------------------\n')
+    datacard.write('bin         bin_%s\n' % cat)
+    datacard.write('observation %s\n' % allyields['data_obs'])
+    datacard.write('##----------------------------------\n')
+    klen = max([7, len(cat)]+[len(p) for p in procs])
+    kpatt = " %%%ds "  % klen
+    fpatt = " %%%d.%df " % (klen,3)
+    npatt = "%%-%ds " % max([len('process')]+map(len,nuisances))
+    datacard.write('##----------------------------------\n')
+    datacard.write((npatt % 'bin    ')+(" "*6)+(" ".join([kpatt % ('bin_'+cat)      for p in procs]))+"\n")
+    datacard.write((npatt % 'process')+(" "*6)+(" ".join([kpatt % p        for p in procs]))+"\n")
+    datacard.write((npatt % 'process')+(" "*6)+(" ".join([kpatt % iproc[p] for p in procs]))+"\n")
+    datacard.write((npatt % 'rate   ')+(" "*6)+(" ".join([fpatt % allyields[p] for p in procs]))+"\n")
+    datacard.write('##----------------------------------\n')
+    #towrite = [ report[p].raw() for p in procs ] + [ report["data_obs"].raw() ]
+    for name in nuisances:
+        if systTypes[name] == 'lnN':
+            systEff = dict((p,"%.4f/%.4f"%systMap[name][p] if p in systMap[name] else "-") for p in procs)
+        else:
+            systEff = dict((p,"1" if p in systMap[name] else "-") for p in procs)
+        datacard.write(('%s %5s' % (npatt % name,systTypes[name])) + " ".join([kpatt % systEff[p]  for p in procs]) +"\n")
+    datacard.close()
+    return cat,report
+
 class DatacardMaker:
     def __init__(self):
         self.hr = HistoReader('../hist_files/anatest32_MergeLepFl.root')
-        self.hr.readFromPickle('histos.pickle')
+        self.store = TemplateStore('templates')
         self.eras=['2017']
         self.chan=['multilepton']
         self.outf = "EFT_MultiDim_Datacard_combine.txt"
         
-    def makeCard(self):
+    # nworkers: Number of categories to write at the same time, defaults to the number of cores
+    # prune: Settings of the template-level pruning (e.g. DEFAULT_PRUNING), by default (None) all processes and systematics are kept
+    # report_file: Where to write what the pruning removed
+    def makeCard(self, nworkers=None, prune=None, report_file='pruning_report.txt'):
         #tmp={'3l_mix_sfz_2b': self.hr.th1Tree['3l_mix_sfz_2b']} 
         #self.hr.th1Tree=tmp
         
-        categories = [ 'bin_'+cat for cat in self.hr.th1Tree]
+        categories = [ 'bin_'+cat for cat in self.store.getCategories()]
         cats = list(enumerate(categories))
 
         signalNames=self.hr.sgnl_known
         patterns=[['%s_sm'%process, '%s_lin_(?P<c1>.*)'%process, '%s_quad_(?P<c1>.*)'%process, '%s_quad_mixed_(?P<c1>.*)_(?P<c2>.*)'%process] for process in signalNames]
         patterns=[ re.compile(pattern) for patternlist in patterns for pattern in patternlist ] # :) 
         processes=[]
-        for cat in self.hr.th1Tree:
-            processes+= [proc for proc in self.hr.th1Tree[cat]]
+        for cat in self.store.getCategories():
+            processes+= self.store.getProcesses(cat)
         processes=list(set(processes))
         sig_procs=[]; bkg_procs=[]
         for proc in processes:
@@ -42,76 +239,55 @@ class DatacardMaker:
             else:
                 raise RuntimeError("Process %s not identified"%proc)
 
- 
-
-        signalcount=0; bkgcount=0; iproc = {}
-        for cat in self.hr.th1Tree:
-            inputs=r.TFile.Open("ttx_multileptons-%s.root"%cat, 'recreate')
-            inputs.WriteTObject( self.hr.th1Tree[cat]['data_sm'][''], "data_obs")
-            allyields={'data_obs' : self.hr.th1Tree[cat]['data_sm'][''].Integral()  }
-            procs=[]; systMap={}
-
-            for proc in self.hr.th1Tree[cat]:
-                if proc == 'data_sm': 
-                    continue
-                if self.hr.th1Tree[cat][proc][''].Integral()<1e-3: 
-                    continue
-                procs.append(proc)
-                if proc not in iproc:
-                    if proc in sig_procs:
-                        signalcount=signalcount-1
-                        iproc[proc]=signalcount
-                    else:
-                        bkgcount = bkgcount+1
-                        iproc[proc]=bkgcount
-                        
-                
-
-                for syst in self.hr.th1Tree[cat][proc]: 
-                    self.hr.th1Tree[cat][proc][syst]=cropNegativeYields(self.hr.th1Tree[cat][proc][syst])
-                    if syst=="":
-                        allyields[proc]=self.hr.th1Tree[cat][proc][''].Integral()
-
-                    if not self.hr.th1Tree[cat][proc][syst].Integral():
-                        print "Warning: underflow template for %s %s %s. Will take the nominal scaled down by a factor 2" % (cat, proc, syst)
-                        self.hr.th1Tree[cat][proc][syst].Add(self.hr.th1Tree[cat][proc][''])
-                        self.hr.th1Tree[cat][proc][syst].Scale(0.5)
-                        
-
-                    inputs.WriteTObject( self.hr.th1Tree[cat][proc][syst], proc if syst== "" else "%s_%s"%(proc,syst.replace("UP","Up").replace("DOWN","Down")))
-                    if syst == "" or "DOWN" in syst: continue
-                    systName=syst.replace("UP","").replace("DOWN","")
-                    if systName in systMap:
-                        systMap[systName].append(proc)
-                    else:
-                        systMap[systName]=[proc]
-
-                        
-            inputs.Close()
-            nuisances = [syst for syst in systMap]
-            
-
-            datacard = open("ttx_multileptons-%s.txt"%cat, "w"); 
-            datacard.write("shapes *        * ttx_multileptons-%s.root $PROCESS $PROCESS_$SYSTEMATIC\n" % cat)
-            datacard.write('##----------------------------------\n')
-            datacard.write('bin         bin_%s\n' % cat)
-            datacard.write('observation %s\n' % allyields['data_obs'])
-            datacard.write('##----------------------------------\n')
-            klen = max([7, len(cat)]+[len(p) for p in procs])
-            kpatt = " %%%ds "  % klen
-            fpatt = " %%%d.%df " % (klen,3)
-            npatt = "%%-%ds " % max([len('process')]+map(len,nuisances))
-            datacard.write('##----------------------------------\n')
-            datacard.write((npatt % 'bin    ')+(" "*6)+(" ".join([kpatt % ('bin_'+cat)      for p in procs]))+"\n")
-            datacard.write((npatt % 'process')+(" "*6)+(" ".join([kpatt % p        for p in procs]))+"\n")
-            datacard.write((npatt % 'process')+(" "*6)+(" ".join([kpatt % iproc[p] for p in procs]))+"\n")
-            datacard.write((npatt % 'rate   ')+(" "*6)+(" ".join([fpatt % allyields[p] for p in procs]))+"\n")
-            datacard.write('##----------------------------------\n')
-            #towrite = [ report[p].raw() for p in procs ] + [ report["data_obs"].raw() ]
-            for name in nuisances:
-                systEff = dict((p,"1" if p in systMap[name] else "-") for p in procs)
-                datacard.write(('%s %5s' % (npatt % name,'shape')) + " ".join([kpatt % systEff[p]  for p in procs]) +"\n")
+        # The process ids are fixed up front (signals <= 0, backgrounds > 0), so the categories can be written independently
+        iproc = {}
+        for i,proc in enumerate(sorted(sig_procs)):
+            iproc[proc]=-(i+1)
+        for i,proc in enumerate(sorted(bkg_procs)):
+            iproc[proc]=i+1
+        iproc[MERGED_BKG_NAME]=len(bkg_procs)+1
+
+        if not nworkers:
+            nworkers=multiprocessing.cpu_count()
+        jobs=[(self.store.store_dir, cat, iproc, prune) for cat in self.store.getCategories()]
+        report=[]
+        if nworkers == 1 or len(jobs) <= 1:
+            for job in jobs:
+                cat,cat_report=makeCategoryCard(job)
+                report.extend(cat_report)
+        else:
+            pool=multiprocessing.Pool(processes=min(nworkers,len(jobs)))
+            try:
+                for cat,cat_report in pool.imap_unordered(makeCategoryCard, jobs):
+                    print 'Wrote datacard for', cat
+                    report.extend(cat_report)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        # The EFT templates are pruned when the template store is made (see HistoReader.pruneTemplates)
+        if prune or report:
+            self.writePruningReport(report, report_file)
+
+    def writePruningReport(self, report, report_file):
+        n_pruned=len([x for x in report if x[3].startswith('pruned')])
+        n_merged=len([x for x in report if x[3].startswith('merged')])
+        n_dropped=len([x for x in report if x[3].startswith('dropped')])
+        n_lnN=len([x for x in report if x[3].startswith('converted')])
+        print 'Pruning: %d EFT templates pruned, %d processes merged, %d shape systematics dropped, %d nuisances converted to lnN (see %s)'%(n_pruned, n_merged, n_dropped, n_lnN, report_file)
+        with open(report_file, 'w') as f:
+            f.write('# category process nuisance action\n')
+            for cat,proc,name,action in sorted(report):
+                f.write('%s %s %s %s\n'%(cat, proc, name if name else '-', action))
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Write the per-category datacards from the template store')
+    parser.add_argument('--prune', action='store_true', help='Merge negligible backgrounds and drop/convert negligible shape systematics (see DEFAULT_PRUNING)')
+    parser.add_argument('--nworkers', type=int, default=None, help='Number of categories to write at the same time')
+    args = parser.parse_args()
     dm=DatacardMaker()
-    dm.makeCard()
+    dm.makeCard(nworkers=args.nworkers, prune=DEFAULT_PRUNING if args.prune else None)
@@ -5,6 +5,7 @@ ROOT.gSystem.Load('$CMSSW_BASE/src/EFTFit/Fitter/interface/TH1EFT_h.so')
 
 
 from HiggsAnalysis.CombinedLimit.PhysicsModel import PhysicsModel
+from EFTFit.Fitter.parameterization import load_parameterization
 #Based on 'Quadratic' model from HiggsAnalysis.CombinedLimit.QuadraticScaling
 
 class EFT1DModel(PhysicsModel):
@@ -32,7 +33,7 @@ class EFT1DModel(PhysicsModel):
         procbin_override = [] # Process+bin combinations (tuple) specified by arguments
 
         for option, value in [x.split('=') for x in options]:
-            if option == 'fits':
+            if option == 'fits': # Either a 1D .npy file, or a 16D .eftp file (only the terms of the operator are used)
                 self.fits = value
             elif option == 'operator':
                 if self.operator is not None:
@@ -45,14 +46,15 @@ class EFT1DModel(PhysicsModel):
 
         #If procbins are specified, only use subset that we have fits for.
         #Otherwise, use all of the process+bin combinations that we have fits for.
-        fits = np.load(self.fits)[()]
-        self.procbins = fits[self.operator].keys()
+        self.table = load_parameterization(self.fits,operator=self.operator)
+        self.procbins = list(self.table.procbins)
         if len(procbin_override)>0: self.procbins = np.intersect1d(self.procbins,procbins_override)
+        self.procbin_set = set(tuple(pb) for pb in self.procbins)
 
 
     def setup(self):
         print "Setting up fits"
-        fits = np.load(self.fits)[()]
+        terms = [('sm','sm'),('sm',self.operator),(self.operator,self.operator)]
         #print fits
         #print self.operator
         #table = {}
@@ -61,7 +63,7 @@ class EFT1DModel(PhysicsModel):
             name = 'r_{0}_{1}'.format(procbin[0],procbin[1])
             if not self.modelBuilder.out.function(name):
                 template = "expr::{name}('{a0}+{a1}*{c}+{a2}*{c}*{c}',{c})"
-                a0, a1, a2 = fits[self.operator][procbin]
+                a0, a1, a2 = self.table.getCoefficients(tuple(procbin),terms)
                 print template.format(name=name, a0=a0, a1=a1, a2=a2, c=self.operator)
                 quadratic = self.modelBuilder.factory_(template.format(name=name, a0=a0, a1=a1, a2=a2, c=self.operator))
                 #print 'Quadratic:',template.format(name=name, a0=a0, a1=a1, a2=a2, c=self.operator)
@@ -81,12 +83,10 @@ class EFT1DModel(PhysicsModel):
         self.setup()
 
     def getYieldScale(self, bin, process):
-        if (process,bin) not in self.procbins:
+        if (process,bin) not in self.procbin_set:
             return 1
         else:
             #print 'scaling {0}, {1}'.format(process, bin)
-            fits = np.load(self.fits)[()]
-            #print self.operator,process,bin,fits[self.operator][(process,bin)]
             name = 'r_{0}_{1}'.format(process,bin)
             return name
 
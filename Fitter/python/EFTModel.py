@@ -5,6 +5,7 @@ ROOT.gSystem.Load('$CMSSW_BASE/src/EFTFit/Fitter/interface/TH1EFT_h.so')
 
 
 from HiggsAnalysis.CombinedLimit.PhysicsModel import PhysicsModel
+from EFTFit.Fitter.parameterization import load_parameterization, prune_terms, summarize_pruning, print_pruning_report, DEFAULT_PRUNE_TOL, DEFAULT_WC_RANGES
 #Based on 'Quadratic' model from HiggsAnalysis.CombinedLimit.QuadraticScaling
 
 class EFTModel(PhysicsModel):
@@ -21,34 +22,29 @@ class EFTModel(PhysicsModel):
     >>> np.save('scales.npy', scales)
 
     Oversimplified example for running with override options:
-    text2workspace.py EFT_MultiDim_Datacard.txt -P EFTFit.Fitter.EFTModel:eftmodel --PO fits=EFT_Parameterization.npy --PI wcs=ctW,ctZ -o 16D.root
+    text2workspace.py EFT_MultiDim_Datacard.txt -P EFTFit.Fitter.EFTModel:eftmodel --PO fits=EFT_Parameterization.eftp --PI wcs=ctW,ctZ -o 16D.root
     combine -M MultiDimFit 16D.root
     """
 
     def setPhysicsOptions(self, options):
         self.fits = None # File containing WC parameterizations of each process+bin *with events*!
         self.linear_only = False    # Physics Option flag to determine if the quadratic terms should be dropped from the workspace
+        self.prune_tol = DEFAULT_PRUNE_TOL  # Terms contributing less than this fraction of the SM yield over the whole wc_ranges box are dropped
         self.wcs = ['ctW','ctZ','ctp','cpQM','ctG','cbW','cpQ3','cptb','cpt','cQl3i','cQlMi','cQei','ctli','ctei','ctlSi','ctlTi'] # Hardcoded currently...
-        self.wc_ranges = {  'ctW':(-6,6),    'ctZ':(-7,7),
-                            'cpt':(-40,30),  'ctp':(-35,65),
-                            'ctli':(-20,20), 'ctlSi':(-22,22),
-                            'cQl3i':(-20,20),'cptb':(-40,40),
-                            'ctG':(-3,3),    'cpQM':(-30,50),
-                            'ctlTi':(-4,4),  'ctei':(-20,20),
-                            'cQei':(-16,16), 'cQlMi':(-17,17),
-                            'cpQ3':(-20,12), 'cbW':(-10,10)
-                        }
+        self.wc_ranges = dict(DEFAULT_WC_RANGES)
         wcs_override = [] # WCs specified by arguments
         self.procbins = [] # Process+bin combinations (tuple) that we have events for
         procbin_override = [] # Process+bin combinations (tuple) specified by arguments
 
         for option, value in [x.split('=') for x in options]:
-            if option == 'fits': # .npy fit file created with FitConversion16D.py
+            if option == 'fits': # .eftp (or pickled .npy) fit file created with FitConversionEFT.py
                 self.fits = value
             elif option == 'wcs': # Override to fit only a subset of WCs
                 wcs_override = value.split(',')
             elif option == 'procbins': # Override to fit only a subset of proc+category combinations
                 procbin_override = value.split(',')
+            elif option == 'prune-tol': # Override the relative tolerance used to drop negligible terms
+                self.prune_tol = float(value)
             elif option == 'linear-only':
                 self.linear_only = True
                 # Alternate ranges for linear-term only parameterizations
@@ -75,62 +71,74 @@ class EFTModel(PhysicsModel):
 
         #If procbins are specified, only use subset that we have fits for.
         #Otherwise, use all of the process+bin combinations that we have fits for.
-        fits = np.load(self.fits)[()]
-        self.procbins.extend(fits.keys())
+        self.table = load_parameterization(self.fits)
+        self.procbins.extend(self.table.procbins)
         if len(wcs_override)>0: self.wcs = np.intersect1d(self.wcs,wcs_override)
         if len(procbin_override)>0: self.procbins = np.intersect1d(self.procbins,procbins_override)
+        self.procbin_set = set(tuple(pb) for pb in self.procbins)
+
+    # Build the dense coefficient tensor for all of the proc+bins
+    #   - terms: [('sm','sm'), ('sm',wc1), ..., (wc1,wc1), (wc1,wc2), ...], i.e. the constant, linear and quadratic terms
+    #   - coeffs[i,j]: Coefficient of terms[j] for procbins[i]
+    def buildCoefficients(self, procbins):
+        wcs = list(self.wcs)
+        terms = [('sm','sm')] + [('sm',wc) for wc in wcs]
+        if not self.linear_only:
+            terms += [(wc1,wc2) for idx,wc1 in enumerate(wcs) for wc2 in wcs[idx:]]
+        return terms,self.table.getTensor(terms,procbins)
+
+    # Make the monomials (1, wc1, wc1*wc1, wc1*wc2, ...) which are shared by all of the proc+bins
+    #   - Built from compiled RooFit classes, so RooFit only recomputes the ones depending on a parameter that changed
+    #   - Monomials which aren't used by any proc+bin (used[j] is False) are not made, and are None in the returned list
+    def makeMonomials(self, terms, used):
+        out = self.modelBuilder.out
+        one = ROOT.RooConstVar('eft_one','eft_one',1.)
+        out._import(one,ROOT.RooFit.Silence())
+        monomials = []
+        for (wc1,wc2),is_used in zip(terms,used):
+            if not is_used:
+                monomials.append(None)
+            elif wc1 == 'sm' and wc2 == 'sm':
+                monomials.append(out.function('eft_one'))
+            elif wc1 == 'sm':
+                monomials.append(out.var(wc2))
+            else:
+                name = 'eft_m_{}_{}'.format(wc1,wc2)
+                if wc1 == wc2:
+                    mon = ROOT.RooPolyVar(name,name,out.var(wc1),ROOT.RooArgList(out.function('eft_one')),2)
+                else:
+                    mon = ROOT.RooProduct(name,name,ROOT.RooArgList(out.var(wc1),out.var(wc2)))
+                out._import(mon,ROOT.RooFit.RecycleConflictNodes(),ROOT.RooFit.Silence())
+                monomials.append(out.function(name))
+        return monomials
 
     def setup(self):
         print "Setting up fits"
-        fits = np.load(self.fits)[()]
-        for i,procbin in enumerate(sorted(self.procbins)):
-            #self.modelBuilder.out.var(procbin)
+        procbins = sorted(self.procbin_set)
+        terms,coeffs = self.buildCoefficients(procbins)
+        # Drop the negligible terms (the constant term is always kept)
+        keep = prune_terms(terms,coeffs,self.wc_ranges,self.prune_tol)
+        print_pruning_report(summarize_pruning(terms,coeffs,keep,self.wc_ranges),self.prune_tol)
+
+        monomials = self.makeMonomials(terms,keep.any(axis=0))
+        for i,procbin in enumerate(procbins):
             name = 'r_{proc}_{cat}'.format(proc=procbin[0],cat=procbin[1])
             procbin_name = '_'.join(procbin)
-
-            if not self.modelBuilder.out.function(name):
-                # Initialize function pieces
-                constant = '{}'.format(fits[procbin][('sm','sm')]) # constant term (should be 1)
-                lin_name = procbin_name+"_L" # Name of linear function
-                lin_term = [] # Linear term
-                lin_args = [] # List of wcs in linear term
-                quartic_names = [procbin_name+"_Q"+str(idx) for idx,wc in enumerate(self.wcs)] # Names of quadratic functions
-                quartic_terms = [[] for wc in self.wcs] # Quartic terms, but split into chunks
-                quartic_args = [[] for wc in self.wcs] # List of wcs in quartic terms
-                fit_terms = [constant] # List of fit terms
-
-                # Fill function pieces
-                for idx,wc1 in enumerate(self.wcs):
-                    if abs(fits[procbin][('sm',wc1)]) >= 0.001:
-                        if fits[procbin][('sm',wc1)] < 0.0:
-                            lin_term.append('({0})*{1}'.format(round(fits[procbin][('sm',wc1)],4),wc1))
-                        else:
-                            lin_term.append('{0}*{1}'.format(round(fits[procbin][('sm',wc1)],4),wc1))
-                        lin_args.append(wc1)
-                    for idy,wc2 in enumerate(self.wcs):
-                        if self.linear_only: continue
-                        if (idy >= idx) and (abs(fits[procbin][(wc1,wc2)]) >= 0.001):
-                            quartic_terms[idx].append('{0}*{1}*{2}'.format(round(fits[procbin][(wc1,wc2)],4),wc1,wc2))
-                            quartic_args[idx].extend([wc1,wc2])
-                # Compile linear function for combine
-                if lin_term:
-                    lin_expr = "expr::{lin_name}('{lin_term}',{lin_args})".format(lin_name=lin_name,lin_term="+".join(lin_term),lin_args=",".join(lin_args))
-                    lin_func = self.modelBuilder.factory_(lin_expr)
-                    self.modelBuilder.out._import(lin_func)
-                    fit_terms.append(lin_name)
-                # Compile quartic functions separately first
-                for idx,fn in enumerate(quartic_terms):
-                    if not fn: continue # Skip empty quartic functions
-                    quartic_expr = "expr::{quartic_names}('{quartic_terms}',{quartic_args})".format(quartic_names=quartic_names[idx], quartic_terms="+".join(fn), quartic_args=",".join(list(set(quartic_args[idx]))))
-                    quartic_func = self.modelBuilder.factory_(quartic_expr)
-                    self.modelBuilder.out._import(quartic_func)
-                    fit_terms.append(quartic_names[idx])
-                # Compile the full function
-                fit_function = "expr::{name}('{fit_terms}',{fit_args})".format(name=name,fit_terms="+".join(fit_terms),fit_args=",".join(fit_terms[1:]))
-                quadratic = self.modelBuilder.factory_(fit_function)
-
-                # Export fit function
-                self.modelBuilder.out._import(quadratic)
+            if self.modelBuilder.out.function(name): continue
+
+            # The scaling function is sum_j coeffs[i,j]*monomial_j, as a single (compiled) RooAddition
+            mon_list = ROOT.RooArgList()
+            coef_list = ROOT.RooArgList()
+            coef_vars = [] # Keep the python objects alive until the function is imported
+            for j in np.nonzero(keep[i])[0]:
+                coef = ROOT.RooConstVar('{}_c{}'.format(procbin_name,j),'',float(coeffs[i,j]))
+                coef_vars.append(coef)
+                mon_list.add(monomials[j])
+                coef_list.add(coef)
+            quadratic = ROOT.RooAddition(name,name,mon_list,coef_list)
+
+            # Export fit function
+            self.modelBuilder.out._import(quadratic,ROOT.RooFit.RecycleConflictNodes(),ROOT.RooFit.Silence())
 
     def doParametersOfInterest(self):
         # user can call combine with `--setPhysicsModelParameterRanges` to set to sensible ranges
@@ -141,7 +149,7 @@ class EFTModel(PhysicsModel):
         self.setup()
 
     def getYieldScale(self, bin, process):
-        if (process,bin) not in self.procbins:
+        if (process,bin) not in self.procbin_set:
             return 1
         else:
             name = 'r_{0}_{1}'.format(process,bin)
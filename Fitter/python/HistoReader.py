@@ -1,7 +1,10 @@
 import ROOT as r 
 import copy
+import numpy as np
 from array import array
-import pickle 
+
+from template_store import TemplateStore
+from parameterization import prune_terms, get_relative_contributions, summarize_pruning, print_pruning_report, DEFAULT_PRUNE_TOL, DEFAULT_WC_RANGES
 
 
 r.gSystem.Load('$CMSSW_BASE/lib/$SCRAM_ARCH/libEFTGenReaderEFTHelperUtilities.so')
@@ -11,19 +14,88 @@ def addProcessToDict(dic, process, systematic, histo):
         dic[process]={}
     dic[process][systematic]=histo
 
-def getHistAtPoint( point, th1eft, name):
-    binning=array('d', [th1eft.GetBinLowEdge(1)]+[th1eft.GetBinLowEdge(i)+th1eft.GetBinWidth(i) for i in range(1, th1eft.GetNbinsX()+1)])
-    outh=r.TH1D(name,'', len(binning)-1, binning)
-    for bin in range(1, outh.GetXaxis().GetNbins()+1):
-        outh.SetBinContent(bin, th1eft.GetBinContent( bin, point))
-        # To do SetBinError (things to be fixed downstream as well)
+def getBinning(th1eft):
+    return array('d', [th1eft.GetBinLowEdge(1)]+[th1eft.GetBinLowEdge(i)+th1eft.GetBinWidth(i) for i in range(1, th1eft.GetNbinsX()+1)])
+
+# Make a TH1D with the given bin contents (under/overflow are left empty)
+def makeTH1(name, binning, contents):
+    nbins=len(binning)-1
+    outh=r.TH1D(name,'', nbins, binning)
+    outh.SetDirectory(0)
+    outh.SetContent(np.concatenate(([0.], contents, [0.])))
+    outh.SetEntries(nbins)
     return outh
+
+# Read the fit structure constants of all the bins of a TH1EFT at once
+#   - Returns s0[bin], lin[bin,i] and quad[bin,i,j] (symmetric) for the WCs in 'coefs', such that the content
+#     of a bin at a WC point x is s0 + sum_i lin_i*x_i + sum_{i<=j} quad_ij*x_i*x_j, plus the set of WCs
+#     the histogram depends on
+#   - Bins without a fit keep their content at every point, and empty bins stay empty (as in TH1EFT::GetBinContent)
+def getBinCoefficients(th1eft, coefs):
+    nbins=th1eft.GetNbinsX()
+    wc_idx=dict((wc,i) for i,wc in enumerate(coefs))
+    s0=np.zeros(nbins)
+    lin=np.zeros((nbins,len(coefs)))
+    quad=np.zeros((nbins,len(coefs),len(coefs)))
+    currentWCs=set()
+    for bin in range(1, nbins+1):
+        fit=th1eft.GetBinFit(bin)
+        names=[str(n) for n in fit.getNames()]
+        currentWCs.update(names)
+        if fit.getDim() <= 0:
+            s0[bin-1]=th1eft.GetBinContent(bin)
+            continue
+        if th1eft.GetBinContent(bin) == 0:
+            continue
+        for pair,c in zip(fit.getPairs(), fit.getCoefficients()):
+            n1,n2=names[pair.first],names[pair.second]
+            if n1 == 'sm' and n2 == 'sm':
+                s0[bin-1]+=c
+            elif n1 == 'sm' or n2 == 'sm':
+                wc=n2 if n1 == 'sm' else n1
+                if wc in wc_idx: lin[bin-1,wc_idx[wc]]+=c
+            elif n1 in wc_idx and n2 in wc_idx:
+                i,j=wc_idx[n1],wc_idx[n2]
+                quad[bin-1,i,j]+=c
+                if i != j: quad[bin-1,j,i]+=c
+    return s0,lin,quad,currentWCs
+
+# The terms of the templates, in the layout of parameterization.prune_terms: the constant term, then the linear,
+# quadratic and mixed (i<j) terms of the WCs in 'coefs'
+def getTemplateTerms(coefs):
+    iu=np.triu_indices(len(coefs), 1)
+    return [('sm','sm')]+[('sm',wc) for wc in coefs]+[(wc,wc) for wc in coefs]+[(coefs[i],coefs[j]) for i,j in zip(*iu)]
+
+# The (bin x term) coefficients of getTemplateTerms, from the output of getBinCoefficients
+def getTermCoefficients(s0, lin, quad):
+    iu=np.triu_indices(lin.shape[1], 1)
+    return np.column_stack([s0, lin, np.diagonal(quad, axis1=1, axis2=2), quad[:,iu[0],iu[1]]])
+
+# Split a (bin x term) array of getTemplateTerms (e.g. the mask of prune_terms) into the lin[bin,i] and
+# quad[bin,i,j] (symmetric) layout
+def splitTermMask(keep, ncoefs):
+    iu=np.triu_indices(ncoefs, 1)
+    diag=np.arange(ncoefs)
+    keep_lin=keep[:,1:1+ncoefs]
+    keep_quad=np.zeros((len(keep),ncoefs,ncoefs), dtype=keep.dtype)
+    keep_quad[:,diag,diag]=keep[:,1+ncoefs:1+2*ncoefs]
+    keep_quad[:,iu[0],iu[1]]=keep[:,1+2*ncoefs:]
+    keep_quad[:,iu[1],iu[0]]=keep[:,1+2*ncoefs:]
+    return keep_lin,keep_quad
+
+# Which templates are needed for the kept terms: lin_i (S+L_i+Q_i) if L_i or Q_i is kept in any bin, quad_i if
+# Q_i is, and quad_mixed_ij if M_ij is
+def getKeptTemplates(keep_lin, keep_quad):
+    quads=np.diagonal(keep_quad, axis1=1, axis2=2).any(axis=0)
+    return keep_lin.any(axis=0) | quads, quads, keep_quad.any(axis=0)
         
         
 
 
 class HistoReader(object):
-    def __init__(self, infile='', fakeData=False, pointForFakeData=None, central=False):
+    # prune_tol: Templates whose terms all contribute less than this fraction of the SM yield over the whole
+    #   wc_ranges box aren't written (see pruneTemplates), None to write all of them
+    def __init__(self, infile='', fakeData=False, pointForFakeData=None, central=False, prune_tol=DEFAULT_PRUNE_TOL, wc_ranges=None):
 
 
         self.sgnl_known = ['ttH','tllq','ttll','ttlnu','tHq']
@@ -31,6 +103,10 @@ class HistoReader(object):
         self.bkgd_known = ['charge_flips','fakes','Diboson','Triboson','convs']
         self.data_known = ['data'] 
         self.coefs = ["cptb", "ctlSi", "cpt", "ctei", "cpQ3", "ctli", "ctW", "ctlTi", "cpQM", "cQei", "cQl3i", "ctp", "ctZ", "cQlMi", "cbW", "ctG"]
+        self.prune_tol = prune_tol
+        self.wc_ranges = dict(wc_ranges if wc_ranges else DEFAULT_WC_RANGES)
+        self.pruning = []   # (coefficients, kept terms) of each signal process and category, for the report
+        self.pruned = {}    # {category: {template: largest relative contribution}} of the templates not written
         
 
         self.fakeData=fakeData # to do 
@@ -42,14 +118,13 @@ class HistoReader(object):
 
         self.processList=[]
         self.eftTree={} 
-        self.th1Tree={} 
         self.categories=[]
 
     def read(self):
         
         for key in self.readfile.GetListOfKeys():
-            hist=key.ReadObj()
-            histname = hist.GetName().split('.')
+            # Only the key names are kept, the histograms are read when their category is converted
+            histname = key.GetName().split('.')
             category,systematic,process = '','',''
             if(len(histname)==3): [category,systematic,process] = histname
             if(len(histname)==2): [category,process] = histname
@@ -82,86 +157,127 @@ class HistoReader(object):
             if systematic in self.eftTree[process][category]:
                 raise RuntimeError("Systematic %s for process %s in category %s already added "%(systematic, process, category))
 
-            self.eftTree[process][category][systematic]=hist
+            self.eftTree[process][category][systematic]=key.GetName()
 
     
-    def convertToTH1(self):
+    # Read a TH1EFT from the input file, owned by python so it is freed once it isn't needed anymore
+    def getTH1EFT(self, process, category, systematic):
+        th1eft=self.readfile.Get(self.eftTree[process][category][systematic])
+        th1eft.SetDirectory(0)
+        r.SetOwnership(th1eft, True)
+        return th1eft
+
+    # Decide which terms (and so which templates) of a signal process are kept in a category
+    #   - The terms contributing less than prune_tol of the SM yield over the whole wc_ranges box are zeroed in
+    #     every bin (see parameterization.prune_terms), a template is only written if one of its terms is kept
+    #     in some bin (see getKeptTemplates)
+    #   - Returns the masks of the linear (bin x WC) and quadratic (bin x WC x WC) coefficients to keep
+    def pruneTemplates(self, process, category, s0, lin, quad):
+        terms=getTemplateTerms(self.coefs)
+        coeffs=getTermCoefficients(s0, lin, quad)
+        if self.prune_tol is None:
+            keep=np.ones(coeffs.shape, dtype=bool)
+        else:
+            keep=prune_terms(terms, coeffs, self.wc_ranges, self.prune_tol)
+        self.pruning.append((coeffs, keep))
+        keep_lin,keep_quad=splitTermMask(keep, len(self.coefs))
+
+        # Record the templates that won't be written, with the largest contribution of their terms
+        contrib=get_relative_contributions(terms, coeffs, self.wc_ranges)
+        contrib_lin,contrib_quad=splitTermMask(contrib, len(self.coefs))
+        contrib_lin,contrib_quad=contrib_lin.max(axis=0),contrib_quad.max(axis=0)
+        lins,quads,mixeds=getKeptTemplates(keep_lin, keep_quad)
+        pruned=self.pruned.setdefault(category, {})
+        for i1, wc1 in enumerate(self.coefs):
+            if not lins[i1]:
+                pruned['%s_lin_%s'%(process,wc1)]=float(max(contrib_lin[i1], contrib_quad[i1,i1]))
+            if not quads[i1]:
+                pruned['%s_quad_%s'%(process,wc1)]=float(contrib_quad[i1,i1])
+            for i2,wc2 in enumerate(self.coefs):
+                if i1<i2 and not mixeds[i1,i2]:
+                    pruned['%s_quad_mixed_%s_%s'%(process,wc1,wc2)]=float(contrib_quad[i1,i2])
+        return keep_lin,keep_quad
+
+    # Make the templates of one category, returns {process: {systematic: TH1D}}
+    def convertCategory(self, category):
+        templates={}
         for process in self.eftTree:
-            print 'Processing', process
-
-            for category in self.eftTree[process]:
-                if category not in self.th1Tree:
-                    self.th1Tree[category]={}
-                                        
-                for systematic in self.eftTree[process][category]:
-                    
-                    th1eft=self.eftTree[process][category][systematic]
-                    point_sm=r.WCPoint()
-                    th1_sm=getHistAtPoint( point_sm, th1eft, "%s.%s.%s.sm"%(process,category,systematic))                     
-                    currentWCs = list(set([ x for bin in range(1, th1eft.GetNbinsX()+1) for x in th1eft.GetBinFit(bin).getNames()])) # WC in this th1eft
-
-                    addProcessToDict( self.th1Tree[category], '%s_sm'%process,  systematic, th1_sm)
-
-                    if process not in self.sgnl_known:
-                        continue
-                    print process
-                    for i1, wc1 in enumerate(self.coefs):
-                        
-                        if wc1 in currentWCs:
-                            point_wc=r.WCPoint(); point_wc.setStrength(wc1, 1)
-                            th1_lin=getHistAtPoint( point_wc, th1eft, "%s.%s.%s.lin_%s"%(process,category,systematic, wc1))
-                            addProcessToDict( self.th1Tree[category], '%s_lin_%s'%(process,wc1), systematic, th1_lin)
-                            
-                            point_wc=r.WCPoint(); point_wc.setStrength(wc1, 2)
-                            th1_quad=getHistAtPoint( point_wc, th1eft, "%s.%s.%s.quad_%s"%(process,category,systematic, wc1))
-                            th1_quad.Add(th1_lin, -2)
-                            th1_quad.Add(th1_sm)
-                            r.TH1D.Scale(th1_quad,0.5)
-                            addProcessToDict( self.th1Tree[category], '%s_quad_%s'%(process,wc1), systematic, th1_quad)
-                            
-                            for i2,wc2 in enumerate(self.coefs): 
-                                if i1>=i2: continue
-                                if wc2 in currentWCs:
-                                    point_wc=r.WCPoint(); point_wc.setStrength(wc1, 1); point_wc.setStrength(wc2,1)
-                                    th1_quad_mixed=getHistAtPoint( point_wc, th1eft, "%s.%s.%s.quad_mixed_%s_%s"%(process,category,systematic, wc1, wc2))
-                                    addProcessToDict( self.th1Tree[category], '%s_quad_mixed_%s_%s'%(process,wc1,wc2), systematic, th1_quad_mixed)
-                                else: 
-                                    # if wc2 is not there then this term is S+L_1+Q_1
-                                    point_wc=r.WCPoint(); point_wc.setStrength(wc1, 1)
-                                    th1_quad_mixed=getHistAtPoint( point_wc, th1eft, "%s.%s.%s.quad_mixed_%s_%s"%(process,category,systematic, wc1, wc2))
-                                    addProcessToDict( self.th1Tree[category], '%s_quad_mixed_%s_%s'%(process,wc1,wc2), systematic, th1_quad_mixed)
-                                    
-                        else:
-                            print 'Coefficient %s does not exist!'%wc1
-                            # if the wc does not exist (the dependence is zero) the linear term is that of the sm 
-                            th1_lin=th1_sm.Clone( "%s.%s.%s.lin_%s"%(process,category,systematic, wc1))
-                            addProcessToDict( self.th1Tree[category], '%s_lin_%s'%(process,wc1), systematic, th1_lin)
-
-                            # the quadratic is zero
-                            th1_quad=th1_sm.Clone( "%s.%s.%s.lin_%s"%(process,category,systematic, wc1))
-                            th1_quad.Reset()
-                            addProcessToDict( self.th1Tree[category], '%s_quad_%s'%(process,wc1), systematic, th1_quad)
-                            for i2,wc2 in enumerate(self.coefs): 
-                                if i1>=i2: continue
-                                if wc2 not in currentWCs:
-                                    # if wc2 is not there either, this is just the SM 
-                                    th1_quad_mixed=th1_sm.Clone("%s.%s.%s.quad_mixed_%s_%s"%(process,category,systematic, wc1, wc2))
-                                    addProcessToDict( self.th1Tree[category], '%s_quad_mixed_%s_%s'%(process,wc1,wc2), systematic, th1_quad_mixed)
-                                else:
-                                    # if it is there then it is S+L_2+Q_2
-                                    point_wc=r.WCPoint(); point_wc.setStrength(wc2, 1)
-                                    th1_quad_mixed=getHistAtPoint( point_wc, th1eft, "%s.%s.%s.quad_mixed_%s_%s"%(process,category,systematic, wc1, wc2))
-                                    addProcessToDict( self.th1Tree[category], '%s_quad_mixed_%s_%s'%(process,wc1,wc2), systematic, th1_quad_mixed)
-
-                                    
-
-                            
-        with open('histos.pickle', 'wb') as handle:
-            pickle.dump(self.th1Tree, handle, protocol=pickle.HIGHEST_PROTOCOL)                            
-        
-    def readFromPickle(self,pk):
-        f = open(pk, 'rb')
-        self.th1Tree=pickle.load(f)
+            if category not in self.eftTree[process]:
+                continue
+            # The nominal goes first, the terms it keeps are used for all of the systematics of the process
+            keep=None
+            for systematic in sorted(self.eftTree[process][category], key=lambda syst: syst!=''):
+                th1eft=self.getTH1EFT(process, category, systematic)
+                binning=getBinning(th1eft)
+                s0,lin,quad,currentWCs=getBinCoefficients(th1eft, self.coefs) # WC in this th1eft
+                th1_sm=makeTH1("%s.%s.%s.sm"%(process,category,systematic), binning, s0)
+
+                addProcessToDict( templates, '%s_sm'%process,  systematic, th1_sm)
+
+                if process not in self.sgnl_known:
+                    continue
+                print process
+                if keep is None:
+                    keep=self.pruneTemplates(process, category, s0, lin, quad)
+                keep_lin,keep_quad=keep
+                lins,quads,mixeds=getKeptTemplates(keep_lin, keep_quad)
+                lin=np.where(keep_lin, lin, 0.)
+                quad=np.where(keep_quad, quad, 0.)
+                # Closed form of the templates, for all WCs (and pairs) at once:
+                #   lin_i = f(x_i=1) = s0 + l_i + q_ii
+                #   quad_i = (f(x_i=2) - 2*f(x_i=1) + f(0))/2 = q_ii
+                #   quad_mixed_ij = f(x_i=1,x_j=1) = s0 + l_i + l_j + q_ii + q_jj + q_ij
+                # WCs which the histogram doesn't depend on have zero coefficients, so e.g. quad_mixed_ij
+                # falls back to S+L_i+Q_i when wc_j is missing, and to the SM when both are missing
+                # The pruned terms are zero as well, and the templates without any kept term aren't written (the
+                # physics model only uses the templates which are in the datacard)
+                diag=np.diagonal(quad, axis1=1, axis2=2)
+                th1_lins=s0[:,None]+lin+diag
+                th1_quads=diag
+                th1_mixeds=th1_lins[:,:,None]+th1_lins[:,None,:]-s0[:,None,None]+quad
+                for i1, wc1 in enumerate(self.coefs):
+                    if wc1 not in currentWCs:
+                        print 'Coefficient %s does not exist!'%wc1
+                    if lins[i1]:
+                        th1_lin=makeTH1("%s.%s.%s.lin_%s"%(process,category,systematic, wc1), binning, th1_lins[:,i1])
+                        addProcessToDict( templates, '%s_lin_%s'%(process,wc1), systematic, th1_lin)
+
+                    if quads[i1]:
+                        th1_quad=makeTH1("%s.%s.%s.quad_%s"%(process,category,systematic, wc1), binning, th1_quads[:,i1])
+                        addProcessToDict( templates, '%s_quad_%s'%(process,wc1), systematic, th1_quad)
+
+                    for i2,wc2 in enumerate(self.coefs):
+                        if i1>=i2 or not mixeds[i1,i2]: continue
+                        th1_quad_mixed=makeTH1("%s.%s.%s.quad_mixed_%s_%s"%(process,category,systematic, wc1, wc2), binning, th1_mixeds[:,i1,i2])
+                        addProcessToDict( templates, '%s_quad_mixed_%s_%s'%(process,wc1,wc2), systematic, th1_quad_mixed)
+        return templates
+
+    def printPruningReport(self):
+        terms=getTemplateTerms(self.coefs)
+        coeffs=np.vstack([coeffs for coeffs,keep in self.pruning])
+        keep=np.vstack([keep for coeffs,keep in self.pruning])
+        print_pruning_report(summarize_pruning(terms, coeffs, keep, self.wc_ranges), self.prune_tol)
+        npruned=sum(len(pruned) for pruned in self.pruned.values())
+        ntotal=len(self.pruning)*(len(terms)-1)
+        print "\tTemplates: {}/{} EFT templates not written".format(npruned, ntotal)
+
+    # Convert the TH1EFTs to TH1D templates, and write them to the per-category template store
+    #   - Only one category is kept in memory at a time
+    #   - Any categories left in the store from an earlier conversion are removed first
+    #   - The pruned templates are listed in the store, so they show up in the datacard pruning report
+    def convertToTH1(self, store_dir='templates'):
+        store=TemplateStore(store_dir)
+        store.clear()
+        self.pruning=[]
+        self.pruned={}
+        categories=sorted(set(category for process in self.eftTree for category in self.eftTree[process]))
+        for category in categories:
+            print 'Processing', category
+            templates=self.convertCategory(category)
+            store.writeCategory(category, templates, self.pruned.get(category, {}))
+        if self.prune_tol is not None and self.pruning:
+            self.printPruningReport()
+        return store
 
 
 if __name__ == "__main__":
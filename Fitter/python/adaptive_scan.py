@@ -0,0 +1,132 @@
+import json
+
+import numpy as np
+
+# Tools for adaptive likelihood scans
+#   - Start from a coarse scan, then only spend more points where the intervals are actually decided:
+#     around the crossings of the 2*deltaNLL levels (1 and 4 for the 1 and 2 sigma intervals) and
+#     around the local minima
+
+# Merge overlapping (or touching) intervals
+def merge_regions(regions):
+    merged = []
+    for lo,hi in sorted(regions):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0],max(hi,merged[-1][1]))
+        else:
+            merged.append((lo,hi))
+    return merged
+
+# Find the regions of a 1D scan that should be scanned more finely
+#   wc_vals, nll_vals: The scan points, with nll_vals being 2*deltaNLL
+#   levels: The 2*deltaNLL levels whose crossings we want to resolve
+#   nll_max: Ignore local minima above this 2*deltaNLL value
+#   min_width: Regions narrower than this are considered resolved and are dropped
+#   Returns a sorted list of non-overlapping (lo,hi) ranges
+def find_refine_regions(wc_vals,nll_vals,levels=[1,4],nll_max=None,min_width=0.):
+    x = np.asarray(wc_vals,dtype=np.float64)
+    y = np.asarray(nll_vals,dtype=np.float64)
+    if len(x) < 2: return []
+    # Sort by wc value, and keep only the lowest nll for repeated wc values (e.g. from merged passes)
+    order = np.lexsort((y,x))
+    x = x[order]
+    y = y[order]
+    keep = np.append(True,x[1:] != x[:-1])
+    x = x[keep]
+    y = y[keep] - np.min(y)
+
+    regions = []
+    # Each crossing is bracketed by the pair of neighbouring points on either side of the level
+    for level in levels:
+        above = y > level
+        idx = np.nonzero(above[1:] != above[:-1])[0]
+        regions.extend(zip(x[idx],x[idx+1]))
+
+    # Local minima are bracketed by their two neighbours
+    if len(x) >= 3:
+        idx = np.nonzero((y[1:-1] < y[:-2]) & (y[1:-1] <= y[2:]))[0] + 1
+        if nll_max is not None:
+            idx = idx[y[idx] < nll_max]
+        regions.extend(zip(x[idx-1],x[idx+1]))
+
+    return [(lo,hi) for lo,hi in merge_regions(regions) if hi - lo > min_width]
+
+# 2*deltaNLL levels of the 68%, 95% and 99.7% CL contours for two parameters
+CONTOUR_LEVELS_2D = [2.30,5.99,11.83]
+
+# The POI values are stored as floats in the limit tree, so all points are snapped to float precision
+#   to be able to find them again after the fit
+def _snap(v):
+    return float(np.float32(v))
+
+# Quadtree over a 2D scan
+#   - The leaves are stored as [x_lo,x_hi,y_lo,y_hi,depth]
+#   - Each refine() step splits the leaves whose corners straddle one of the contour levels into four,
+#     and returns the new points which need to be fitted (the center and edge midpoints of the split cells)
+class QuadTree2D(object):
+    def __init__(self,cells=None):
+        self.cells = cells or []
+
+    # Build the initial cells from a (coarse) regular grid scan
+    #   - Values which appear only once (e.g. the best fit point combine adds to each job) aren't part of the grid
+    @classmethod
+    def fromGrid(cls,xvals,yvals):
+        xs,xcounts = np.unique(np.float32(xvals),return_counts=True)
+        ys,ycounts = np.unique(np.float32(yvals),return_counts=True)
+        xs = [float(x) for x in xs[xcounts > 1]]
+        ys = [float(y) for y in ys[ycounts > 1]]
+        cells = []
+        for i in range(len(xs)-1):
+            for j in range(len(ys)-1):
+                cells.append([xs[i],xs[i+1],ys[j],ys[j+1],0])
+        return cls(cells)
+
+    @classmethod
+    def load(cls,fpath):
+        with open(fpath) as f:
+            return cls(json.load(f))
+
+    def save(self,fpath):
+        with open(fpath,'w') as f:
+            json.dump(self.cells,f)
+
+    # Split the cells which straddle a contour level
+    #   xvals, yvals, nllvals: All of the points scanned so far, with nllvals being 2*deltaNLL
+    #   Returns the number of cells which were split, and the sorted list of (x,y) points that still have to be fitted
+    def refine(self,xvals,yvals,nllvals,levels=CONTOUR_LEVELS_2D,max_depth=4):
+        nlls = np.asarray(nllvals,dtype=np.float64)
+        nlls = nlls - np.min(nlls)
+        lookup = {}
+        for x,y,nll in zip(np.float32(xvals),np.float32(yvals),nlls):
+            key = (float(x),float(y))
+            if key not in lookup or nll < lookup[key]: lookup[key] = nll
+
+        new_cells = []
+        new_points = set()
+        n_split = 0
+        for x0,x1,y0,y1,depth in self.cells:
+            corners = [lookup.get(p) for p in [(x0,y0),(x0,y1),(x1,y0),(x1,y1)]]
+            if any(v is None for v in corners) or depth >= max_depth:
+                # Either not all of the corners have been fitted yet, or the cell is already small enough
+                new_cells.append([x0,x1,y0,y1,depth])
+                continue
+            lo,hi = min(corners),max(corners)
+            if not any(lo < level < hi for level in levels):
+                new_cells.append([x0,x1,y0,y1,depth])
+                continue
+            n_split += 1
+            xm = _snap(0.5*(x0+x1))
+            ym = _snap(0.5*(y0+y1))
+            new_cells.extend([[x0,xm,y0,ym,depth+1],[xm,x1,y0,ym,depth+1],[x0,xm,ym,y1,depth+1],[xm,x1,ym,y1,depth+1]])
+            for p in [(xm,y0),(xm,y1),(x0,ym),(x1,ym),(xm,ym)]:
+                if p not in lookup: new_points.add(p)
+        self.cells = new_cells
+        return n_split,sorted(new_points)
+
+# Write a list of points in the format read by combine's MultiDimFit --fromfile option
+#   - A header line with the comma separated POI names, followed by one line of comma separated values per point
+def write_points_file(fpath,poi_names,points):
+    with open(fpath,'w') as f:
+        f.write(','.join(poi_names) + '\n')
+        for p in points:
+            f.write(','.join([repr(v) for v in p]) + '\n')
@@ -0,0 +1,119 @@
+import os
+import time
+import Queue
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from utils import run_command
+
+# Dependency graph of combine steps, run on a bounded pool of workers
+#   - A step is a list of shell commands which are run one after another, and is started as soon as all of
+#     the steps it depends on have finished, so independent steps (e.g. fits which only need the workspace)
+#     run at the same time
+#   - Each step writes the output of its commands to its own log file
+#   - A failed step doesn't stop the independent steps, but the steps depending on it are skipped
+
+class CombineStep(object):
+    def __init__(self,name,commands,depends=[]):
+        self.name = name
+        self.commands = [list(cmd) for cmd in commands]
+        self.depends = list(depends)
+
+# Returns the step names in an order where each step comes after the steps it depends on
+def sort_steps(steps):
+    by_name = {}
+    for step in steps:
+        if step.name in by_name:
+            raise RuntimeError("Duplicate combine step: {}".format(step.name))
+        by_name[step.name] = step
+    for step in steps:
+        for dep in step.depends:
+            if dep not in by_name:
+                raise RuntimeError("Combine step {} depends on unknown step {}".format(step.name,dep))
+    order = []
+    state = {}     # name -> 'visiting' or 'done'
+    def visit(name,chain):
+        if state.get(name) == 'done': return
+        if state.get(name) == 'visiting':
+            raise RuntimeError("Cyclic dependency between combine steps: {}".format(' -> '.join(chain + [name])))
+        state[name] = 'visiting'
+        for dep in by_name[name].depends:
+            visit(dep,chain + [name])
+        state[name] = 'done'
+        order.append(name)
+    for step in steps:
+        visit(step.name,[])
+    return order
+
+def _run_step(job):
+    name,commands,log_file,cwd = job
+    tic = time.time()
+    max_rss = 0.
+    try:
+        open(log_file,'w').close()
+        for cmd in commands:
+            result = run_command(cmd,log_file=log_file,check=False,quiet=True,cwd=cwd)
+            max_rss = max(max_rss,result.max_rss)
+            if result.returncode != 0:
+                return name,False,time.time() - tic,max_rss,"'{}' exited with code {}".format(cmd[0],result.returncode)
+    except Exception as e:
+        return name,False,time.time() - tic,max_rss,str(e)
+    return name,True,time.time() - tic,max_rss,''
+
+# Run the steps, respecting their dependencies
+#   nworkers: Max number of steps to run at the same time, defaults to the number of cores
+#   log_dir: Directory for the step logs, named {step}.log
+#   cwd: Directory to run the commands in
+#   Returns {step: wall time} for the steps which finished, and raises a RuntimeError if any step failed
+def run_steps(steps,nworkers=None,log_dir='logs_steps',cwd=None):
+    order = sort_steps(steps)
+    if not order: return {}
+    by_name = dict((step.name,step) for step in steps)
+    if not nworkers:
+        nworkers = multiprocessing.cpu_count()
+    if cwd is None:
+        cwd = os.getcwd()
+    log_path = os.path.join(cwd,log_dir)
+    if not os.path.isdir(log_path):
+        os.makedirs(log_path)
+
+    finished = {}
+    failed = {}
+    skipped = []
+    running = set()
+    results = Queue.Queue()
+    logging.info("Running {} combine steps with {} workers, logs in {}/".format(len(order),nworkers,log_dir))
+    pool = ThreadPool(processes=min(nworkers,len(order)))
+    try:
+        while True:
+            for name in order:
+                if name in finished or name in failed or name in running or name in skipped: continue
+                deps = by_name[name].depends
+                if any(dep in failed or dep in skipped for dep in deps):
+                    logging.warning("Skipping combine step {}, since a step it depends on failed".format(name))
+                    skipped.append(name)
+                elif all(dep in finished for dep in deps):
+                    job = (name,by_name[name].commands,os.path.join(log_path,'{}.log'.format(name)),cwd)
+                    pool.apply_async(_run_step,(job,),callback=results.put)
+                    running.add(name)
+            if not running:
+                break
+            name,ok,wall_time,max_rss,msg = results.get()
+            running.remove(name)
+            if ok:
+                finished[name] = wall_time
+                logging.info("Finished combine step {} in {:.1f} s, peak RSS {:.1f} MB".format(name,wall_time,max_rss))
+            else:
+                failed[name] = msg
+                logging.error("Combine step {} failed after {:.1f} s: {}, see {}/{}.log".format(name,wall_time,msg,log_dir,name))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if failed:
+        raise RuntimeError("{} combine steps failed ({}), {} skipped".format(len(failed),', '.join(sorted(failed)),len(skipped)))
+    return finished
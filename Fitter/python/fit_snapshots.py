@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+import ROOT
+
+from workspace_cache import file_digest
+
+# Cache of best fit snapshots, used to warm start later fits and scans
+#   - Each entry is the output of a best fit run with --saveWorkspace (which holds the workspace with the
+#     best fit point saved as the 'MultiDimFit' snapshot), plus a json file with the POI and nuisance values
+#   - Entries are keyed by the content of the workspace and the sets of floated and frozen parameters, so
+#     a fit with a different configuration never starts from the wrong minimum
+
+SNAPSHOT_NAME = 'MultiDimFit'   # The name combine gives to the best fit snapshot
+DEFAULT_SNAPSHOT_DIR = os.path.join('..','fit_files','snapshots')
+
+# Returns the parameters frozen by the --freezeParameters options in a list of combine arguments
+#   - Handles '--freezeParameters a,b', '--freezeParameters=a,b' and the option and value packed in one string
+def get_frozen_parameters(args):
+    frozen = []
+    for idx,arg in enumerate(args):
+        if not arg.startswith('--freezeParameters'): continue
+        tokens = arg.replace('=',' ',1).split()
+        if len(tokens) > 1:
+            value = tokens[1]
+        elif idx+1 < len(args):
+            value = args[idx+1]
+        else:
+            continue
+        frozen.extend([x for x in value.split(',') if x])
+    return frozen
+
+# Read the parameter values (and the minimum NLL) from the RooFitResult saved with --saveFitResult
+def get_fit_values(fit_file,fit_name='fit_mdf'):
+    inf = ROOT.TFile.Open(fit_file)
+    if not inf:
+        raise RuntimeError("Failed to open file {}".format(fit_file))
+    fit = inf.Get(fit_name)
+    if not fit:
+        inf.Close()
+        raise RuntimeError("No RooFitResult {} in {}".format(fit_name,fit_file))
+    values = {}
+    for pars in (fit.constPars(),fit.floatParsFinal()):
+        for i in range(pars.getSize()):
+            values[pars.at(i).GetName()] = pars.at(i).getVal()
+    nll = fit.minNll()
+    inf.Close()
+    return values,nll
+
+class SnapshotCache(object):
+    def __init__(self,cache_dir=DEFAULT_SNAPSHOT_DIR):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def getKey(self,workspace,floated,frozen):
+        h = hashlib.sha1()
+        h.update(file_digest(workspace))
+        h.update(json.dumps([sorted(set(floated)),sorted(set(frozen))]))
+        return h.hexdigest()
+
+    def getPath(self,key):
+        return os.path.join(self.cache_dir,key + '.root')
+
+    def getInfoPath(self,key):
+        return os.path.join(self.cache_dir,key + '.json')
+
+    # Returns the path of the matching snapshot file, or None if there is none
+    def find(self,workspace,floated,frozen):
+        key = self.getKey(workspace,floated,frozen)
+        if os.path.exists(self.getPath(key)) and os.path.exists(self.getInfoPath(key)):
+            return self.getPath(key)
+        return None
+
+    # Returns the json info of an entry: the fit name, floated/frozen parameters, values and minimum NLL
+    def getInfo(self,key):
+        with open(self.getInfoPath(key)) as f:
+            return json.load(f)
+
+    # Store the outputs of a best fit
+    #   snapshot_file: The higgsCombine output of a fit run with --saveWorkspace
+    #   fit_file: The multidimfit output of the same fit, run with --saveFitResult
+    def store(self,workspace,floated,frozen,snapshot_file,fit_file,name=''):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        values,nll = get_fit_values(fit_file)
+        key = self.getKey(workspace,floated,frozen)
+        info = {
+            'name': name,
+            'workspace': os.path.abspath(workspace),
+            'floated': sorted(set(floated)),
+            'frozen': sorted(set(frozen)),
+            'nll': nll,
+            'values': values,
+        }
+        # Write to temporary files first, so a concurrent job never starts from a partial snapshot
+        tmp_path = self.getPath(key).replace('.root','.{}.tmp.root'.format(os.getpid()))
+        shutil.copyfile(snapshot_file,tmp_path)
+        os.rename(tmp_path,self.getPath(key))
+        with open(self.getInfoPath(key) + '.tmp','w') as f:
+            json.dump(info,f,indent=1,sort_keys=True)
+        os.rename(self.getInfoPath(key) + '.tmp',self.getInfoPath(key))
+        self.logger.info("Saved best fit snapshot {} for {}".format(key,name))
+        return key
+
+    def clear(self):
+        if not os.path.exists(self.cache_dir): return
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith('.root') or fn.endswith('.json'): os.remove(os.path.join(self.cache_dir,fn))
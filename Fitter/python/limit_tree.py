@@ -0,0 +1,123 @@
+import os
+import fnmatch
+import logging
+
+import numpy as np
+import uproot
+
+# Tools for reading the combine 'limit' TTree in bulk
+#   - Branches are loaded column-wise straight into numpy arrays, instead of looping over the
+#     entries with GetEntry() and GetLeaf(...).GetValue(0)
+#   - Branch names can be given as glob patterns, e.g. 'trackedParam_*'
+
+TRACKED_PREFIX = 'trackedParam_'
+
+def _to_str(s):
+    # uproot3 returns the branch names as bytes
+    if isinstance(s,bytes) and not isinstance(s,str):
+        return s.decode('utf-8')
+    return s
+
+# Returns the list of branch names in the tree
+def get_branch_names(tree):
+    return [_to_str(k) for k in tree.keys()]
+
+# Expand any glob patterns in 'branches' against the branch names of the tree
+#   - Keeps the order of the requested branches and drops duplicates
+def match_branches(available,branches,ignore_missing=False):
+    matched = []
+    for pat in branches:
+        hits = fnmatch.filter(available,pat)
+        if not hits:
+            if ignore_missing: continue
+            raise RuntimeError("No branch matching '{}' in the limit tree".format(pat))
+        for h in hits:
+            if h not in matched: matched.append(h)
+    return matched
+
+# Strip the 'trackedParam_' prefix, so the tracked POIs can be looked up by name
+def strip_tracked_name(name):
+    if name.startswith(TRACKED_PREFIX):
+        return name[len(TRACKED_PREFIX):]
+    return name
+
+# Read the requested branches of a single limit tree into a dict of numpy arrays
+#   branches: List of branch names (or glob patterns) to read
+#   strip_tracked: If true, the 'trackedParam_' prefix is removed from the returned keys
+#   ignore_missing: If true, silently skip branches which aren't in the tree
+def read_limit_tree(fpath,branches,tree_name='limit',strip_tracked=False,ignore_missing=False):
+    if not os.path.exists(fpath):
+        raise RuntimeError("File {} does not exist!".format(fpath))
+    ret = {}
+    with uproot.open(fpath) as f:
+        tree = f[tree_name]
+        to_read = match_branches(get_branch_names(tree),branches,ignore_missing)
+        for b in to_read:
+            key = strip_tracked_name(b) if strip_tracked else b
+            ret[key] = np.asarray(tree[b].array(),dtype=np.float64)
+    return ret
+
+# Same as read_limit_tree(), but concatenates the branches from several files
+def read_limit_trees(fpaths,branches,**kwargs):
+    chunks = [read_limit_tree(fpath,branches,**kwargs) for fpath in fpaths]
+    if not chunks: return {}
+    ret = {}
+    for k in chunks[0].keys():
+        ret[k] = np.concatenate([c[k] for c in chunks if k in c])
+    return ret
+
+# Remove combine's best fit row (quantileExpected=-1) from a set of limit tree arrays
+#   - Trees without a quantileExpected branch are returned unchanged
+def drop_best_fit_rows(arrs,qe_branch='quantileExpected'):
+    if qe_branch not in arrs: return arrs
+    keep = arrs[qe_branch] != -1
+    return {k: v[keep] for k,v in arrs.items()}
+
+# Number of scan points in a set of limit tree arrays, i.e. the entries other than combine's best fit row
+#   - The best fit row is only there if the initial fit wasn't skipped, so counting all entries would give
+#     a different number of points for the same scan
+def count_scan_points(arrs,qe_branch='quantileExpected'):
+    if not arrs: return 0
+    if qe_branch not in arrs: return len(arrs.values()[0])
+    return int(np.count_nonzero(arrs[qe_branch] != -1))
+
+# Returns the index of the entry with the smallest deltaNLL (first one in case of ties)
+def get_best_entry(arrs,nll_branch='deltaNLL'):
+    nlls = arrs[nll_branch]
+    if len(nlls) == 0:
+        logging.error("Can't find the best entry of an empty limit tree!")
+        return -1
+    return int(np.argmin(nlls))
+
+# Returns a dict of {branch: value} for the entry with the smallest deltaNLL
+def get_best_point(arrs,nll_branch='deltaNLL'):
+    idx = get_best_entry(arrs,nll_branch)
+    if idx < 0: return {}
+    return {k: float(v[idx]) for k,v in arrs.items()}
+
+# Returns the number of entries in a tree (uproot3 and uproot4 name this differently)
+def get_num_entries(tree):
+    if hasattr(tree,'num_entries'):
+        return tree.num_entries
+    return tree.numentries
+
+# Same as read_limit_tree(), but yields the branches in blocks of at most step_size entries, so a
+#   large tree can be processed without loading all of it into memory
+def iter_limit_tree(fpath,branches,step_size=1000000,tree_name='limit',strip_tracked=False,ignore_missing=False):
+    if not os.path.exists(fpath):
+        raise RuntimeError("File {} does not exist!".format(fpath))
+    with uproot.open(fpath) as f:
+        tree = f[tree_name]
+        to_read = match_branches(get_branch_names(tree),branches,ignore_missing)
+        nentries = get_num_entries(tree)
+        for start in range(0,nentries,step_size):
+            stop = min(start+step_size,nentries)
+            ret = {}
+            for b in to_read:
+                key = strip_tracked_name(b) if strip_tracked else b
+                if hasattr(tree,'num_entries'):
+                    arr = tree[b].array(entry_start=start,entry_stop=stop,library='np')
+                else:
+                    arr = tree[b].array(entrystart=start,entrystop=stop)
+                ret[key] = np.asarray(arr,dtype=np.float64)
+            yield ret
@@ -0,0 +1,81 @@
+import os
+import math
+import logging
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from scan_merger import merge_scan_outputs
+from scan_coverage import expected_blocks
+
+# Local 'batch system' for combine grid scans
+#   - The --points range is split into --firstPoint/--lastPoint blocks, which are run on a pool of
+#     workers sized to the machine (the heavy lifting is done by the combine subprocesses, so threads are enough)
+#   - Each block writes its own log, failed blocks are retried, and the outputs are merged into a single limit tree
+
+# Default number of points per block: aim for a few blocks per worker, so the load stays balanced
+def default_split_points(points,nworkers):
+    return max(1,int(math.ceil(points/float(4*nworkers))))
+
+def get_block_name(name,first,last):
+    return '{}.POINTS.{}.{}'.format(name,first,last)
+
+def _run_block(job):
+    cmd,name,first,last,method,mass,log_dir,retries = job
+    block_name = get_block_name(name,first,last)
+    out_file = 'higgsCombine{}.{}.mH{}.root'.format(block_name,method,mass)
+    log_file = os.path.join(log_dir,'{}.log'.format(block_name))
+    full_cmd = '{} -n {} --firstPoint {} --lastPoint {}'.format(cmd,block_name,first,last)
+    for attempt in range(1,retries+2):
+        with open(log_file,'a') as log:
+            log.write('# Attempt {}: {}\n'.format(attempt,full_cmd))
+            log.flush()
+            ret = subprocess.call(full_cmd,shell=True,stdout=log,stderr=subprocess.STDOUT)
+        if ret == 0 and os.path.exists(out_file):
+            return first,last,out_file,attempt
+        logging.warning("Block {} failed (exit code {}), attempt {}/{}, see {}".format(block_name,ret,attempt,retries+1,log_file))
+    return first,last,None,retries+1
+
+# Run a grid scan split in blocks on the local machine, and merge the outputs into out_path
+#   args: The combine command for the full scan (without -n, --firstPoint and --lastPoint)
+#   name: The name of the scan, the blocks are named {name}.POINTS.{first}.{last}
+#   nworkers: Number of blocks to run at the same time, defaults to the number of cores
+#   retries: Number of times a failed block is rerun
+#   Returns the list of (first,last) blocks which failed
+def run_local_scan(args,name,points,out_path,split_points=None,nworkers=None,retries=1,log_dir='logs_local',method='MultiDimFit',mass=120):
+    if not nworkers:
+        nworkers = multiprocessing.cpu_count()
+    if not split_points:
+        split_points = default_split_points(points,nworkers)
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    cmd = ' '.join(args)
+    blocks = expected_blocks(points,split_points)
+    jobs = [(cmd,name,first,last,method,mass,log_dir,retries) for first,last in blocks]
+    logging.info("Running {} points in {} blocks with {} workers, logs in {}/".format(points,len(blocks),nworkers,log_dir))
+
+    outputs = []
+    failed = []
+    pool = ThreadPool(processes=min(nworkers,len(jobs)))
+    try:
+        for idx,(first,last,out_file,attempts) in enumerate(pool.imap_unordered(_run_block,jobs)):
+            if out_file is None:
+                failed.append((first,last))
+            else:
+                outputs.append(out_file)
+            logging.info("Finished block {}/{} (POINTS.{}.{}{})".format(idx+1,len(jobs),first,last,', FAILED' if out_file is None else ''))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if failed:
+        logging.error("{} blocks failed: {}".format(len(failed),', '.join(['{}-{}'.format(*b) for b in sorted(failed)])))
+    if outputs:
+        merge_scan_outputs(sorted(outputs),out_path)
+        for out_file in outputs:
+            os.remove(out_file)
+    return sorted(failed)
@@ -103,11 +103,12 @@ class HelperOptions(OptionsBase):
         self.save_workspace = False     # Whether a RooWorkspace object should be saved or not
         self.use_poi_ranges = True      # If true we should limit the poi ranges in the combine fit
         self.stats_only     = False     # If true, ignore systematics constraint terms from the datacard
+        self.use_ws_cache   = True      # If true, reuse identical workspaces from the content-addressed workspace cache
 
         self.histogram_file  = 'anatest10.root'                     # The histogram file to generate the datacard
         self.original_card   = 'EFT_MultiDim_Datacard.txt'          # The name of the original datacard
         self.datacard_file   = self.original_card                   # The name of the (potentially modified) datacard
-        self.conversion_file = 'EFT_Parameterization.npy'           # The EFT 16D WC parameterization mapping
+        self.conversion_file = 'EFT_Parameterization.eftp'          # The EFT 16D WC parameterization mapping
         self.ws_file         = '16D.root'                           # The name of the workspace root file
         self.model           = 'EFTFit.Fitter.EFTModel:eftmodel'    # The physics model used to make the RooWorkspace
         self.ws_type         = WorkspaceType.EFT
@@ -141,6 +142,10 @@ class HelperOptions(OptionsBase):
         self.align_edges      = False   # Whether or not to align the edges during the grid scan
         self.scan_points      = 300     # The number of scan points for the grid algo
         self.split_points     = 3000    # The number of scan points to do per batch task
+        self.local_workers    = 0       # Number of parallel blocks for BatchType.LOCAL, 0 means use all of the cores
+        self.local_retries    = 1       # Number of times a failed block is rerun for BatchType.LOCAL
+        self.command_log_dir  = ''      # If set, the output of each combine command is also written to {command_log_dir}/{name}.log
+        self.step_workers     = 0       # Number of combine steps runSteps runs at the same time, 0 means use all of the cores
 
         self.crab_config = 'custom_crab.py' # Name of the custom crab config to use for crab based grid scans
 
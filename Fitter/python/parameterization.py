@@ -0,0 +1,216 @@
+import os
+import json
+import struct
+
+import numpy as np
+
+# Shared store for the WC parameterizations (the .eftp/.npy files made by FitConversionEFT.py)
+#   - text2workspace asks the physics model for the yield scale of every (bin,process), so each file is only
+#     loaded once per process (on first use) and kept as a dense coefficient array with a dict index,
+#     instead of the nested dicts of tuples
+
+# Cache of the loaded tables, keyed by (path,mtime,operator)
+_tables = {}
+
+class CoefficientTable(object):
+    def __init__(self,procbins,terms,coeffs):
+        self.procbins = procbins    # List of (process,bin) tuples, one per row
+        self.terms = terms          # List of (wc1,wc2) tuples, one per column, 'sm' for the constant/linear parts
+        self.coeffs = coeffs        # 2D array of shape (len(procbins),len(terms))
+        self.index = {procbin: i for i,procbin in enumerate(procbins)}
+        self.term_index = {term: j for j,term in enumerate(terms)}
+
+    def __contains__(self,procbin):
+        return procbin in self.index
+
+    def __len__(self):
+        return len(self.procbins)
+
+    # Build the table from the {procbin: {(wc1,wc2): coeff}} dictionary layout
+    @classmethod
+    def fromDict(cls,fits):
+        procbins = sorted(fits.keys())
+        terms = sorted(set(term for fit in fits.values() for term in fit.keys()))
+        term_index = {term: j for j,term in enumerate(terms)}
+        coeffs = np.zeros((len(procbins),len(terms)))
+        for i,procbin in enumerate(procbins):
+            for term,v in fits[procbin].iteritems():
+                coeffs[i,term_index[term]] = v
+        return cls(procbins,terms,coeffs)
+
+    # Column of each of the requested terms, the pair might be stored in either order (-1 if not stored at all)
+    def getColumns(self,terms):
+        cols = []
+        for wc1,wc2 in terms:
+            cols.append(self.term_index.get((wc1,wc2),self.term_index.get((wc2,wc1),-1)))
+        return np.array(cols,dtype=np.int64)
+
+    # Dense (procbin x term) coefficient array for the requested terms, terms which aren't stored are zero
+    def getTensor(self,terms,procbins=None):
+        rows = np.arange(len(self.procbins)) if procbins is None else np.array([self.index[pb] for pb in procbins],dtype=np.int64)
+        cols = self.getColumns(terms)
+        found = cols >= 0
+        tensor = np.zeros((len(rows),len(terms)))
+        tensor[:,found] = self.coeffs[np.ix_(rows,cols[found])]
+        return tensor
+
+    def getCoefficients(self,procbin,terms):
+        return self.getTensor(terms,[procbin])[0]
+
+# Binary parameterization format (.eftp)
+#   - 8 byte magic, uint32 format version and uint32 header length, followed by a JSON header holding the string
+#     tables (processes, bins, wcs) with the rows/columns stored as indices into them, and then the coefficient
+#     matrix as raw little-endian float64 [n_procbin,n_terms]
+#   - The header is padded so the matrix starts on a 64 byte boundary, and can be memory-mapped
+EFTP_MAGIC = 'EFTPARAM'
+EFTP_VERSION = 1
+_EFTP_PREAMBLE = struct.Struct('<8sII')
+_EFTP_ALIGN = 64
+
+def is_eftp_file(fpath):
+    with open(fpath,'rb') as f:
+        return f.read(len(EFTP_MAGIC)) == EFTP_MAGIC
+
+def write_parameterization(fpath,table):
+    processes = sorted(set(p for p,b in table.procbins))
+    bins = sorted(set(b for p,b in table.procbins))
+    wcs = sorted(set(wc for term in table.terms for wc in term))
+    p_idx = {p: i for i,p in enumerate(processes)}
+    b_idx = {b: i for i,b in enumerate(bins)}
+    w_idx = {wc: i for i,wc in enumerate(wcs)}
+    header = json.dumps({
+        'processes': processes,
+        'bins': bins,
+        'wcs': wcs,
+        'procbins': [[p_idx[p],b_idx[b]] for p,b in table.procbins],
+        'terms': [[w_idx[wc1],w_idx[wc2]] for wc1,wc2 in table.terms],
+        'shape': [len(table.procbins),len(table.terms)],
+        'dtype': '<f8',
+    })
+    header += ' '*(-(_EFTP_PREAMBLE.size + len(header)) % _EFTP_ALIGN)
+    # Write to a temporary file first, so readers never see a truncated file
+    tmp_path = fpath + '.tmp'
+    with open(tmp_path,'wb') as f:
+        f.write(_EFTP_PREAMBLE.pack(EFTP_MAGIC,EFTP_VERSION,len(header)))
+        f.write(header)
+        np.ascontiguousarray(table.coeffs,dtype='<f8').tofile(f)
+    os.rename(tmp_path,fpath)
+
+# Read a .eftp file, by default the coefficient matrix is memory-mapped rather than read in
+def read_parameterization(fpath,mmap=True):
+    with open(fpath,'rb') as f:
+        magic,version,header_len = _EFTP_PREAMBLE.unpack(f.read(_EFTP_PREAMBLE.size))
+        if magic != EFTP_MAGIC:
+            raise RuntimeError("{} is not a parameterization file".format(fpath))
+        if version > EFTP_VERSION:
+            raise RuntimeError("{} has format version {}, only versions up to {} are supported".format(fpath,version,EFTP_VERSION))
+        header = json.loads(f.read(header_len))
+        offset = _EFTP_PREAMBLE.size + header_len
+        shape = tuple(header['shape'])
+        if mmap and shape[0]*shape[1] > 0:
+            coeffs = np.memmap(fpath,dtype=header['dtype'],mode='r',offset=offset,shape=shape)
+        else:
+            coeffs = np.fromfile(f,dtype=header['dtype'],count=shape[0]*shape[1]).reshape(shape)
+    processes = [str(p) for p in header['processes']]
+    bins = [str(b) for b in header['bins']]
+    wcs = [str(wc) for wc in header['wcs']]
+    procbins = [(processes[p],bins[b]) for p,b in header['procbins']]
+    terms = [(wcs[i],wcs[j]) for i,j in header['terms']]
+    return CoefficientTable(procbins,terms,coeffs)
+
+# Read a pickled .npy parameterization into the {procbin: {(wc1,wc2): coeff}} layout
+#   operator: For the 1D parameterizations ({operator: {procbin: (a0,a1,a2)}}), the operator to read
+def read_npy_fits(fpath,operator=None):
+    fits = np.load(fpath)[()]
+    if operator is not None:
+        fits = {procbin: {('sm','sm'): a0, ('sm',operator): a1, (operator,operator): a2} for procbin,(a0,a1,a2) in fits[operator].iteritems()}
+    return fits
+
+# Convert a pickled .npy parameterization to the .eftp format
+def convert_npy(in_path,out_path,operator=None):
+    table = CoefficientTable.fromDict(read_npy_fits(in_path,operator))
+    write_parameterization(out_path,table)
+    return table
+
+# Returns the (cached) CoefficientTable for a parameterization file, either .eftp or pickled .npy
+#   operator: For the 1D .npy parameterizations, the operator to read
+def load_parameterization(fpath,operator=None):
+    fpath = os.path.abspath(fpath)
+    key = (fpath,os.path.getmtime(fpath),operator)
+    if key not in _tables:
+        if is_eftp_file(fpath):
+            _tables[key] = read_parameterization(fpath)
+        else:
+            _tables[key] = CoefficientTable.fromDict(read_npy_fits(fpath,operator))
+    return _tables[key]
+
+# Pruning of negligible terms
+#   - Each term's largest contribution over the box of WC ranges is |coeff|*max|wc1|*max|wc2| (1 for 'sm'),
+#     a term is dropped if that stays below tol times the SM yield of the proc+bin
+#   - DEFAULT_WC_RANGES and DEFAULT_PRUNE_TOL are shared by the physics models and the template making, so
+#     both prune the same terms
+
+DEFAULT_PRUNE_TOL = 0.001
+DEFAULT_WC_RANGES = {
+    'ctW':(-6,6),    'ctZ':(-7,7),
+    'cpt':(-40,30),  'ctp':(-35,65),
+    'ctli':(-20,20), 'ctlSi':(-22,22),
+    'cQl3i':(-20,20),'cptb':(-40,40),
+    'ctG':(-3,3),    'cpQM':(-30,50),
+    'ctlTi':(-4,4),  'ctei':(-20,20),
+    'cQei':(-16,16), 'cQlMi':(-17,17),
+    'cpQ3':(-20,12), 'cbW':(-10,10)
+}
+
+def get_term_kind(term):
+    wc1,wc2 = term
+    if wc1 == 'sm' and wc2 == 'sm': return 'constant'
+    if wc1 == 'sm' or wc2 == 'sm': return 'linear'
+    if wc1 == wc2: return 'quadratic'
+    return 'mixed'
+
+# Largest absolute value of each term's monomial over the wc_ranges box
+def get_term_bounds(terms,wc_ranges):
+    def bound(wc):
+        if wc == 'sm': return 1.
+        lo,hi = wc_ranges[wc]
+        return max(abs(lo),abs(hi))
+    return np.array([bound(wc1)*bound(wc2) for wc1,wc2 in terms])
+
+# Largest contribution of each term over the wc_ranges box, relative to the SM yield of each proc+bin
+def get_relative_contributions(terms,coeffs,wc_ranges):
+    ref = np.abs(coeffs[:,terms.index(('sm','sm'))])
+    ref[ref == 0] = 1.
+    return np.abs(coeffs)*get_term_bounds(terms,wc_ranges)/ref[:,None]
+
+# Returns a boolean (procbin x term) mask of the terms to keep, the constant term is always kept
+def prune_terms(terms,coeffs,wc_ranges,tol):
+    contrib = get_relative_contributions(terms,coeffs,wc_ranges)
+    keep = (contrib > 0) & (contrib >= tol)
+    keep[:,terms.index(('sm','sm'))] = True
+    return keep
+
+# Summarize what prune_terms() removed
+#   - Each kept term costs one coefficient*monomial product in every evaluation of the proc+bin scaling
+#   - max_dropped: Largest summed contribution of the dropped terms for any proc+bin, relative to its SM yield
+def summarize_pruning(terms,coeffs,keep,wc_ranges):
+    nonzero = coeffs != 0
+    report = {'kinds': {}}
+    for kind in ['linear','quadratic','mixed']:
+        cols = np.array([get_term_kind(term) == kind for term in terms],dtype=bool)
+        report['kinds'][kind] = (int(np.count_nonzero(keep[:,cols])),int(np.count_nonzero(nonzero[:,cols])))
+    report['products'] = (int(np.count_nonzero(keep)),int(keep.size))
+    report['monomials'] = (int(np.count_nonzero(keep.any(axis=0))),len(terms))
+    dropped = np.where(keep,0.,get_relative_contributions(terms,coeffs,wc_ranges))
+    report['max_dropped'] = float(np.max(np.sum(dropped,axis=1))) if len(dropped) else 0.
+    return report
+
+def print_pruning_report(report,tol):
+    print "Pruning terms with tolerance {}:".format(tol)
+    for kind in ['linear','quadratic','mixed']:
+        kept,total = report['kinds'][kind]
+        print "\t{:<10} kept {}/{} non-zero terms".format(kind,kept,total)
+    kept,total = report['products']
+    print "\tEvaluation cost: {}/{} coefficient*monomial products ({:.1f}% saved), {}/{} monomials".format(
+        kept,total,100.*(total-kept)/max(total,1),*report['monomials'])
+    print "\tLargest summed contribution of the dropped terms: {:.3g} of the SM yield".format(report['max_dropped'])
@@ -0,0 +1,317 @@
+import math
+import logging
+from array import array
+
+import numpy as np
+import ROOT
+
+from limit_tree import read_limit_tree, drop_best_fit_rows
+
+# Profiled likelihood scans which follow a continuous path through the scan points
+#   - combine restarts the fit of every grid point from the best fit, so neighbouring points of a profiled
+#     scan can end up in different minima (which is what DiscontinuityFinder.py looks for). Here the points
+#     are visited in serpentine order, starting next to the best fit, and each fit is seeded with the
+#     profiled WC and nuisance values of the neighbouring point fitted just before it
+#   - Neighbouring points whose deltaNLL jumps are refitted from the other seeds available (the other
+#     fitted neighbours and the best fit), keeping the lowest minimum
+#   - The fits are run in-process, so the workspace is only loaded once, and the output is written as a
+#     combine limit tree (best fit first, with quantileExpected=-1), so it can be plotted like a grid scan
+#   - The fits use combine's own NLL and CascadeMinimizer, configured like the gridScan commands, so the profiled
+#     minima are the ones combine finds (compare_with_grid checks a path scan against a gridScan of the same points)
+
+# Minimizer settings of the gridScan commands (combine's --cminDefaultMinimizerType/Algo/Tolerance/Strategy)
+#   fallback_strategy: Strategy of the one retry of a failed fit (as --cminFallbackAlgo Minuit2,Migrad,1:0.1 would),
+#     None to give up like combine does without fallbacks
+COMBINE_MINIMIZER = {
+    'type': 'Minuit2',
+    'algo': 'Migrad',
+    'tolerance': 0.1,
+    'strategy': 0,
+    'fallback_strategy': 1,
+}
+
+# Apply the minimizer settings the way combine does, as the ROOT::Math::MinimizerOptions defaults which its
+#   CascadeMinimizer reads
+#   runtime_defs: combine runtime options, as given with --X-rtd NAME=VALUE (e.g. {'MINIMIZER_analytic': 1})
+def configure_combine_minimizer(settings=COMBINE_MINIMIZER,runtime_defs={}):
+    ROOT.Math.MinimizerOptions.SetDefaultMinimizer(settings['type'],settings['algo'])
+    ROOT.Math.MinimizerOptions.SetDefaultTolerance(settings['tolerance'])
+    ROOT.Math.MinimizerOptions.SetDefaultStrategy(settings['strategy'])
+    for name,value in runtime_defs.items():
+        ROOT.runtimedef.set(name,int(value))
+
+# Scan points at the bin centres of a regular grid, the same points combine's --algo grid uses
+#   ranges: [(lo,hi)] for each scanned parameter
+#   points: Total number of points, as given to combine with --points: 'points' points in 1D, and
+#     ceil(sqrt(points)) points per axis in 2D (so the grid can have more points than requested)
+#   Returns the grid shape and the list of axis values
+def build_grid(ranges,points):
+    if len(ranges) == 1:
+        nper = points
+    elif len(ranges) == 2:
+        nper = int(math.ceil(math.sqrt(points)))
+    else:
+        raise RuntimeError("Path scans are only implemented for 1 or 2 parameters, not {}".format(len(ranges)))
+    axes = [lo + (np.arange(nper) + 0.5)*(hi - lo)/nper for lo,hi in ranges]
+    return tuple([nper]*len(ranges)),axes
+
+def get_neighbours(idx,shape):
+    ret = []
+    for d in range(len(shape)):
+        for step in (-1,1):
+            n = list(idx)
+            n[d] += step
+            if 0 <= n[d] < shape[d]: ret.append(tuple(n))
+    return ret
+
+# Order the points of a 1D or 2D grid along a serpentine path, starting from the point 'start'
+#   - 1D: from start up to the upper edge, then from start down to the lower edge
+#   - 2D: the row of start first, then the rows above and below it, alternating the direction of each row
+#   Returns the ordered grid indices, and for each of them the (already visited) neighbour to seed the fit
+#   from, or None to start from the best fit
+def path_order(shape,start):
+    if len(shape) == 1:
+        n,k = shape[0],start[0]
+        order = [(i,) for i in range(k,n)] + [(i,) for i in range(k-1,-1,-1)]
+    elif len(shape) == 2:
+        nx,ny = shape
+        i0,j0 = start
+        order = [(i,j0) for i in range(i0,nx)] + [(i,j0) for i in range(i0-1,-1,-1)]
+        forward = True
+        for rows in (range(j0+1,ny),range(j0-1,-1,-1)):
+            for j in rows:
+                cols = range(nx) if forward else range(nx-1,-1,-1)
+                order.extend([(i,j) for i in cols])
+                forward = not forward
+    else:
+        raise RuntimeError("Path scans are only implemented for 1 or 2 parameters, not {}".format(len(shape)))
+    visited = set()
+    seeds = []
+    prev = None
+    for idx in order:
+        neighbours = get_neighbours(idx,shape)
+        if prev in neighbours:
+            seeds.append(prev)
+        else:
+            seeds.append(next((n for n in neighbours if n in visited),None))
+        visited.add(idx)
+        prev = idx
+    return order,seeds
+
+# Find the neighbouring points whose 2*deltaNLL differ by more than abs_tol, and by more than rel_tol relative to
+#   the lower of the two (same criteria as DiscontinuityFinder.py)
+#   nlls: {grid index: 2*deltaNLL}
+def find_jumps(nlls,shape,abs_tol=0.5,rel_tol=0.1):
+    flagged = set()
+    for idx,nll in nlls.items():
+        for n in get_neighbours(idx,shape):
+            if n not in nlls or n < idx: continue
+            diff = abs(nll - nlls[n])
+            if diff > abs_tol and diff/(min(nll,nlls[n]) + 1.) > rel_tol:
+                flagged.update([idx,n])
+    return flagged
+
+# In-process profiled fits on a combine workspace
+#   - The NLL is made by combine's pdf (createNLL of a RooSimultaneousOpt gives combine's CachingSimNLL, with the
+#     same constraint terms and zero point as in combine), with the scanned parameters fixed
+#   - The fits use combine's CascadeMinimizer, in the mode MultiDimFit uses for the grid points
+#   float_others: If true the other POIs are profiled (--floatOtherPOIs 1), otherwise they stay fixed
+#   frozen: Other parameters to keep fixed (--freezeParameters)
+#   snapshot: Name of a snapshot in the workspace to start from (e.g. 'MultiDimFit' for a saved best fit)
+#   minimizer: Settings of the minimizer (see COMBINE_MINIMIZER)
+#   runtime_defs: combine runtime options (see configure_combine_minimizer)
+class PathFitter(object):
+    def __init__(self,ws_file,scan_params,float_others=True,frozen=[],ranges={},snapshot=None,minimizer=COMBINE_MINIMIZER,runtime_defs={},ws_name='w',data_name='data_obs'):
+        ROOT.gSystem.Load('libHiggsAnalysisCombinedLimit')
+        configure_combine_minimizer(minimizer,runtime_defs)
+        self.inf = ROOT.TFile.Open(ws_file)
+        if not self.inf:
+            raise RuntimeError("Failed to open file {}".format(ws_file))
+        self.ws = self.inf.Get(ws_name)
+        if snapshot:
+            self.ws.loadSnapshot(snapshot)
+        mc = self.ws.genobj('ModelConfig')
+        pdf = mc.GetPdf()
+        data = self.ws.data(data_name)
+        self.scan_params = [self.ws.var(p) for p in scan_params]
+        for name,(lo,hi) in ranges.items():
+            self.ws.var(name).setRange(lo,hi)
+        pois = mc.GetParametersOfInterest()
+        for i in range(pois.getSize()):
+            if not float_others and pois.at(i).GetName() not in scan_params:
+                pois.at(i).setConstant(True)
+        for name in frozen:
+            if self.ws.var(name): self.ws.var(name).setConstant(True)
+        for var in self.scan_params:
+            var.setConstant(True)
+        nuis = mc.GetNuisanceParameters()
+        self.nll = pdf.createNLL(data,ROOT.RooFit.Constrain(nuis),ROOT.RooFit.Extended(pdf.canBeExtended()),ROOT.RooFit.Offset(True))
+        if not isinstance(self.nll,ROOT.cacheutils.CachingSimNLL):
+            logging.warning("The pdf of {} is not a RooSimultaneousOpt, so the NLL is not the one combine uses".format(ws_file))
+        params = self.nll.getParameters(data)
+        self.floating = [params.at(i) for i in range(params.getSize()) if not params.at(i).isConstant()]
+        self.strategy = minimizer['strategy']
+        self.fallback_strategy = minimizer['fallback_strategy']
+        self.minim = self.makeMinimizer()
+
+    # The minimizer is made for the parameters which are floating at that time
+    def makeMinimizer(self):
+        minim = ROOT.CascadeMinimizer(self.nll,ROOT.CascadeMinimizer.Constrained)
+        minim.setStrategy(self.strategy)
+        return minim
+
+    def getValues(self):
+        return [v.getVal() for v in self.floating]
+
+    def setValues(self,values):
+        for v,x in zip(self.floating,values):
+            v.setVal(x)
+
+    # Returns 0 if the fit converged (with the fallback if needed), 1 otherwise
+    def minimize(self,minim=None):
+        minim = minim or self.minim
+        ok = minim.minimize(0)
+        if not ok and self.fallback_strategy is not None and self.fallback_strategy != self.strategy:
+            minim.setStrategy(self.fallback_strategy)
+            ok = minim.minimize(0)
+            minim.setStrategy(self.strategy)
+        return 0 if ok else 1
+
+    # Global best fit, with the scanned parameters floating
+    def bestFit(self):
+        for var in self.scan_params:
+            var.setConstant(False)
+        self.floating.extend(self.scan_params)
+        self.minimize(self.makeMinimizer())
+        point = [var.getVal() for var in self.scan_params]
+        nll,values = self.nll.getVal(),self.getValues()
+        self.floating = self.floating[:-len(self.scan_params)]
+        for var in self.scan_params:
+            var.setConstant(True)
+        return point,nll,values[:len(self.floating)]
+
+    # Fit at a scan point, starting from the given values of the floating parameters
+    def fitPoint(self,point,seed):
+        self.setValues(seed)
+        for var,x in zip(self.scan_params,point):
+            var.setVal(x)
+        status = self.minimize()
+        return self.nll.getVal(),self.getValues(),status
+
+    def getFloatingNames(self):
+        return [v.GetName() for v in self.floating]
+
+    # Current values of (fixed) parameters
+    def getParameterValues(self,names):
+        return dict((name,self.ws.var(name).getVal()) for name in names if self.ws.var(name))
+
+    def close(self):
+        self.inf.Close()
+
+# Write the scan as a combine limit tree
+#   rows: List of (point,nll,values) with the best fit first, point being the scanned parameter values
+#   names: The names of the floating parameters in values, the tracked parameters which aren't floating are taken from defaults
+def write_limit_tree(out_path,scan_params,tracked,names,rows,nll0,defaults={}):
+    outf = ROOT.TFile.Open(out_path,'recreate')
+    tree = ROOT.TTree('limit','limit')
+    buffers = {}
+    for b in ['deltaNLL','quantileExpected'] + scan_params + ['trackedParam_'+p for p in tracked]:
+        buffers[b] = array('f',[0.])
+        tree.Branch(b,buffers[b],b+'/F')
+    ndof = len(scan_params)
+    for irow,(point,nll,values) in enumerate(rows):
+        dnll = nll - nll0
+        buffers['deltaNLL'][0] = dnll
+        buffers['quantileExpected'][0] = -1. if irow == 0 else ROOT.Math.chisquared_cdf_c(max(2*dnll,0.),ndof)
+        for p,x in zip(scan_params,point):
+            buffers[p][0] = x
+        lookup = dict(zip(names,values))
+        for p in tracked:
+            buffers['trackedParam_'+p][0] = lookup.get(p,defaults.get(p,0.))
+        tree.Fill()
+    outf.WriteTObject(tree,'limit')
+    outf.Close()
+
+# Run a profiled scan along a serpentine path
+#   ranges: [(lo,hi)] for each of the scan_params
+#   tracked: Parameters to store as trackedParam_* branches
+#   jump_tol,rel_tol: Thresholds on the 2*deltaNLL difference between neighbours for a refit (see find_jumps)
+#   max_passes: Max number of refit passes over the flagged points
+#   Returns the number of points which were improved by a refit
+#   minimizer,runtime_defs: See PathFitter
+def run_path_scan(ws_file,scan_params,ranges,points,out_path,tracked=[],float_others=True,frozen=[],snapshot=None,jump_tol=0.5,rel_tol=0.1,max_passes=2,minimizer=COMBINE_MINIMIZER,runtime_defs={}):
+    fitter = PathFitter(ws_file,scan_params,float_others=float_others,frozen=frozen,
+        ranges=dict(zip(scan_params,ranges)),snapshot=snapshot,minimizer=minimizer,runtime_defs=runtime_defs)
+    shape,axes = build_grid(ranges,points)
+    best_point,nll0,best_values = fitter.bestFit()
+    logging.info("Best fit: {}".format(', '.join(['{}={:.4f}'.format(p,x) for p,x in zip(scan_params,best_point)])))
+
+    start = tuple([int(np.argmin(np.abs(ax - x))) for ax,x in zip(axes,best_point)])
+    order,seeds = path_order(shape,start)
+    results = {}    # {grid index: (nll,values)}
+    n_failed = 0
+    for count,(idx,seed) in enumerate(zip(order,seeds)):
+        point = [ax[i] for ax,i in zip(axes,idx)]
+        nll,values,status = fitter.fitPoint(point,results[seed][1] if seed is not None else best_values)
+        if status != 0: n_failed += 1
+        results[idx] = (nll,values)
+        if (count+1) % 100 == 0 or count+1 == len(order):
+            logging.info("Fitted {}/{} points".format(count+1,len(order)))
+    if n_failed:
+        logging.warning("{} fits did not converge".format(n_failed))
+
+    # Refit the points next to a jump from all of the other seeds, and keep the lowest minimum
+    n_improved = 0
+    for ipass in range(max_passes):
+        flagged = find_jumps(dict((idx,2*(r[0]-nll0)) for idx,r in results.items()),shape,jump_tol,rel_tol)
+        if not flagged: break
+        improved = 0
+        for idx in sorted(flagged):
+            point = [ax[i] for ax,i in zip(axes,idx)]
+            candidates = [results[n][1] for n in get_neighbours(idx,shape)] + [best_values]
+            for seed in candidates:
+                nll,values,status = fitter.fitPoint(point,seed)
+                if status == 0 and nll < results[idx][0] - 1e-4:
+                    results[idx] = (nll,values)
+                    improved += 1
+        logging.info("Refit pass {}: {} points next to a jump, {} improved".format(ipass+1,len(flagged),improved))
+        n_improved += improved
+        if not improved: break
+
+    # A scan point below the best fit means the global fit missed the minimum, so use that as the reference
+    nll_min = min([nll0] + [r[0] for r in results.values()])
+    if nll_min < nll0 - 1e-4:
+        logging.warning("Found a scan point {:.4f} below the best fit, using it as the deltaNLL reference".format(nll_min - nll0))
+
+    rows = [(best_point,nll0,best_values)]
+    for idx in sorted(results.keys()):
+        rows.append(([ax[i] for ax,i in zip(axes,idx)],results[idx][0],results[idx][1]))
+    write_limit_tree(out_path,scan_params,tracked,fitter.getFloatingNames(),rows,nll_min,fitter.getParameterValues(tracked))
+    fitter.close()
+    return n_improved
+
+# Compare a path scan with a gridScan of the same points (e.g. a 1D scan with the same range and --points)
+#   - The points are matched on their (float) values, and the deltaNLL of each scan is taken relative to its own
+#     lowest point, so a better global minimum in one of the scans doesn't shift all of the points
+#   - The points where the path scan is lower by more than tol are expected (a minimum the grid scan missed),
+#     the ones where it is higher mean the path scan missed the minimum combine found
+#   Returns the number of common points, and the largest differences of 2*deltaNLL (path - grid) in both directions
+def compare_with_grid(path_file,grid_file,scan_params,tol=0.1):
+    scans = []
+    for fpath in [path_file,grid_file]:
+        arrs = drop_best_fit_rows(read_limit_tree(fpath,list(scan_params)+['deltaNLL','quantileExpected']))
+        nlls = 2*(arrs['deltaNLL'] - np.min(arrs['deltaNLL']))
+        keys = zip(*[arrs[p].astype(np.float32) for p in scan_params])
+        scans.append(dict(zip(keys,nlls)))
+    path,grid = scans
+    common = sorted(set(path) & set(grid))
+    if not common:
+        raise RuntimeError("{} and {} have no scan points in common".format(path_file,grid_file))
+    diffs = np.array([path[k] - grid[k] for k in common])
+    for k,diff in zip(common,diffs):
+        if diff > tol:
+            logging.warning("Path scan above the grid scan at {}: 2*deltaNLL {:.4f} vs {:.4f}".format(
+                ', '.join(['{}={:.4g}'.format(p,x) for p,x in zip(scan_params,k)]),path[k],grid[k]))
+    logging.info("Compared {} points: 2*deltaNLL(path - grid) between {:.4f} and {:.4f}, {} points below and {} above by more than {}".format(
+        len(common),np.min(diffs),np.max(diffs),np.count_nonzero(diffs < -tol),np.count_nonzero(diffs > tol),tol))
+    return len(common),float(np.min(diffs)),float(np.max(diffs))
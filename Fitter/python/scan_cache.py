@@ -0,0 +1,99 @@
+import os
+import hashlib
+import logging
+
+import numpy as np
+
+from limit_tree import read_limit_tree
+
+# On-disk cache for the arrays read out of the combine 'limit' trees
+#   - Each entry is a .npz file, keyed by the file path, size, mtime and the set of requested branches,
+#     so rerunning or re-hadding a scan automatically invalidates the old entry
+#   - Entries are evicted least-recently-used first once the cache grows beyond max_size (in MB)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"),".cache","EFTFit","nll_scans")
+
+class ScanCache(object):
+    def __init__(self,cache_dir=DEFAULT_CACHE_DIR,max_size=500):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    # Build the cache key for a particular (file,branches) request
+    def getKey(self,fpath,branches,**kwargs):
+        fpath = os.path.abspath(fpath)
+        st = os.stat(fpath)
+        tokens = [fpath,str(st.st_size),repr(st.st_mtime)]
+        tokens.extend(sorted(set(branches)))
+        tokens.extend(['{}={}'.format(k,kwargs[k]) for k in sorted(kwargs.keys())])
+        return hashlib.sha1('|'.join(tokens).encode('utf-8')).hexdigest()
+
+    def getPath(self,key):
+        return os.path.join(self.cache_dir,key + '.npz')
+
+    # Drop-in replacement for limit_tree.read_limit_tree(), which goes through the cache
+    def read(self,fpath,branches,**kwargs):
+        if not os.path.exists(fpath):
+            raise RuntimeError("File {} does not exist!".format(fpath))
+        cache_path = self.getPath(self.getKey(fpath,branches,**kwargs))
+        if os.path.exists(cache_path):
+            try:
+                arrs = self.load(cache_path)
+                self.hits += 1
+                return arrs
+            except (IOError,ValueError) as e:
+                self.logger.warning("Unable to read cache entry {}, rebuilding it: {}".format(cache_path,e))
+        self.misses += 1
+        arrs = read_limit_tree(fpath,branches,**kwargs)
+        self.store(cache_path,arrs)
+        return arrs
+
+    # Same as read(), but concatenates the branches from several files
+    def readMany(self,fpaths,branches,**kwargs):
+        chunks = [self.read(fpath,branches,**kwargs) for fpath in fpaths]
+        if not chunks: return {}
+        ret = {}
+        for k in chunks[0].keys():
+            ret[k] = np.concatenate([c[k] for c in chunks if k in c])
+        return ret
+
+    def load(self,cache_path):
+        with np.load(cache_path) as npz:
+            arrs = {k: npz[k] for k in npz.files}
+        # Bump the mtime, which is what we use to decide the LRU order
+        os.utime(cache_path,None)
+        return arrs
+
+    def store(self,cache_path,arrs):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write to a temporary file first, so an interrupted job never leaves a truncated entry behind
+        tmp_path = cache_path.replace('.npz','.{}.tmp.npz'.format(os.getpid()))
+        np.savez(tmp_path,**arrs)
+        os.rename(tmp_path,cache_path)
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits in max_size
+    def evict(self):
+        if self.max_size is None or not os.path.exists(self.cache_dir): return
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.npz') or fn.endswith('.tmp.npz'): continue
+            fpath = os.path.join(self.cache_dir,fn)
+            st = os.stat(fpath)
+            entries.append((st.st_mtime,st.st_size,fpath))
+        entries.sort()
+        total = sum(x[1] for x in entries)
+        max_bytes = self.max_size*1024*1024
+        while entries and total > max_bytes:
+            mtime,size,fpath = entries.pop(0)
+            self.logger.debug("Evicting {} from the scan cache".format(fpath))
+            os.remove(fpath)
+            total -= size
+
+    def clear(self):
+        if not os.path.exists(self.cache_dir): return
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith('.npz'): os.remove(os.path.join(self.cache_dir,fn))
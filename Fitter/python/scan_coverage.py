@@ -0,0 +1,72 @@
+import os
+import json
+import logging
+
+from scan_merger import load_manifest
+
+# Coverage index of a split grid scan
+#   - Built from the manifest written by scan_merger.incremental_merge(), which records the number of
+#     scan points merged from each higgsCombine*.POINTS.X.Y.*.root output (without combine's best fit row,
+#     so the counts don't depend on whether the initial fit was skipped)
+#   - Compared against the --firstPoint/--lastPoint blocks that combineTool makes for --split-points,
+#     to find the blocks which never came back (missing) or came back with fewer entries than points (truncated)
+
+# The split of a scan into jobs is recorded next to its output at submission, so the coverage can be checked
+#   (and the missing blocks resubmitted) with the same layout
+def get_layout_path(out_path):
+    return out_path + '.layout.json'
+
+def save_layout(out_path,points,split_points):
+    with open(get_layout_path(out_path),'w') as f:
+        json.dump({'points': points, 'split_points': split_points},f)
+
+# Returns (points,split_points) of a submission, or (None,None) if it wasn't recorded
+def load_layout(out_path):
+    if not os.path.exists(get_layout_path(out_path)):
+        return None,None
+    with open(get_layout_path(out_path)) as f:
+        layout = json.load(f)
+    return layout['points'],layout['split_points']
+
+# The (first,last) point ranges combineTool uses when splitting 'points' into jobs of 'split_points'
+def expected_blocks(points,split_points):
+    return [(first,min(first+split_points,points)-1) for first in range(0,points,split_points)]
+
+class CoverageIndex(object):
+    def __init__(self,blocks=None):
+        self.logger = logging.getLogger(__name__)
+        # {(first,last): entries}
+        self.blocks = {}
+        for first,last,entries in (blocks or []):
+            self.add(first,last,entries)
+
+    @classmethod
+    def fromManifest(cls,out_path):
+        manifest = load_manifest(out_path)
+        return cls(manifest['blocks'].values())
+
+    def add(self,first,last,entries):
+        key = (first,last)
+        # If a block was merged more than once (e.g. after a resubmission) keep the most complete one
+        self.blocks[key] = max(entries,self.blocks.get(key,0))
+
+    # Returns the number of scan points covered by each of the expected blocks
+    def getCoverage(self,points,split_points):
+        return [(first,last,self.blocks.get((first,last),0)) for first,last in expected_blocks(points,split_points)]
+
+    # Returns the list of (first,last) ranges which are missing or truncated
+    def getMissing(self,points,split_points):
+        missing = []
+        for first,last,entries in self.getCoverage(points,split_points):
+            if entries < last - first + 1:
+                missing.append((first,last))
+        return missing
+
+    def printSummary(self,points,split_points):
+        coverage = self.getCoverage(points,split_points)
+        n_missing = len([x for x in coverage if x[2] == 0])
+        n_truncated = len([x for x in coverage if 0 < x[2] < x[1] - x[0] + 1])
+        print "Coverage: {}/{} blocks complete, {} missing, {} truncated".format(len(coverage)-n_missing-n_truncated,len(coverage),n_missing,n_truncated)
+        for first,last,entries in coverage:
+            if entries < last - first + 1:
+                print "\tPOINTS.{}.{}: {}/{} entries".format(first,last,entries,last-first+1)
@@ -0,0 +1,486 @@
+import os
+import re
+import abc
+import json
+import shutil
+import fnmatch
+import tarfile
+import logging
+import tempfile
+import multiprocessing
+
+import numpy as np
+import uproot
+import ROOT
+
+from limit_tree import read_limit_tree, drop_best_fit_rows, count_scan_points, get_branch_names, get_num_entries
+
+# Merge the outputs of a split combine scan (condor POINTS files, crab tarballs) without hadd
+#   - Tar members are streamed out of the archives one at a time, so the full set of job outputs is
+#     never unpacked on disk at once
+#   - Only the columns of the 'limit' tree are kept, and they're appended to a single output: either
+#     one consolidated ROOT file with a flat 'limit' tree (default), or a set of .npz chunks
+#   - Unreadable inputs (e.g. a tarball that is still being written) are skipped with an error,
+#     so the merge can be run while some of the jobs are still finishing
+
+# Matches the point range in the name of a split grid job (or its output), e.g. higgsCombine.test.POINTS.0.99.MultiDimFit.mH120.root
+POINTS_RGX = re.compile(r'\.POINTS\.(\d+)\.(\d+)(?!\d)')
+
+class MergeFormat(object):
+    ROOT = "root"
+    NPZ  = "npz"
+
+# Yields (input path, source name, local path to a root file) for each root file in the inputs
+#   - Plain root files are yielded directly
+#   - Tarballs are read in streaming mode, with each matching member copied to a single temporary
+#     file which is overwritten by the next member
+#   failed: If a list is given, the tarballs which couldn't be read to the end are appended to it
+def iter_root_files(inputs,member_pattern='*.root',tmp_dir=None,failed=None):
+    work_dir = tempfile.mkdtemp(prefix='scan_merge_',dir=tmp_dir)
+    try:
+        for fpath in inputs:
+            if not fpath.endswith('.tar'):
+                yield fpath,fpath,fpath
+                continue
+            try:
+                with tarfile.open(fpath,mode='r|*') as tar:
+                    for member in tar:
+                        if not member.isfile(): continue
+                        if not fnmatch.fnmatch(os.path.basename(member.name),member_pattern): continue
+                        tmp_path = os.path.join(work_dir,'member.root')
+                        with open(tmp_path,'wb') as fout:
+                            shutil.copyfileobj(tar.extractfile(member),fout)
+                        yield fpath,'{}:{}'.format(fpath,member.name),tmp_path
+            except (tarfile.TarError,IOError) as e:
+                logging.error("Unable to read tarball {}: {}".format(fpath,e))
+                if failed is not None and fpath not in failed: failed.append(fpath)
+    finally:
+        shutil.rmtree(work_dir,ignore_errors=True)
+
+# Buffers the incoming columns and writes them out in chunks of at least chunk_size entries
+class _ChunkedWriter(object):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self,out_path,chunk_size=100000):
+        self.out_path = out_path
+        self.chunk_size = chunk_size
+        self.branches = None
+        self.buffer = []
+        self.buffered = 0
+        self.entries = 0
+
+    def extend(self,arrs):
+        if self.branches is None:
+            self.branches = sorted(arrs.keys())
+        self.buffer.append(arrs)
+        self.buffered += len(arrs[self.branches[0]])
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer: return
+        chunk = {}
+        for b in self.branches:
+            chunk[b] = np.concatenate([arrs[b] for arrs in self.buffer])
+        self.write(chunk)
+        self.entries += self.buffered
+        self.buffer = []
+        self.buffered = 0
+
+    # Write out one chunk of concatenated columns
+    @abc.abstractmethod
+    def write(self,chunk):
+        pass
+
+    def close(self):
+        self.flush()
+
+# Writes a single ROOT file with a flat tree of doubles
+#   - The file is written under a temporary name and only moved into place by close()
+class RootTreeWriter(_ChunkedWriter):
+    def __init__(self,out_path,tree_name='limit',chunk_size=100000):
+        super(RootTreeWriter,self).__init__(out_path,chunk_size)
+        self.tree_name = tree_name
+        self.tmp_path = out_path + '.tmp'
+        self.fout = None
+
+    def write(self,chunk):
+        if self.fout is None:
+            self.fout = uproot.recreate(self.tmp_path)
+            types = {b: np.float64 for b in self.branches}
+            if hasattr(uproot,'newtree'):
+                # uproot3
+                self.fout[self.tree_name] = uproot.newtree(types)
+            else:
+                self.fout.mktree(self.tree_name,types)
+        self.fout[self.tree_name].extend(chunk)
+
+    def close(self):
+        super(RootTreeWriter,self).close()
+        if self.fout is None:
+            logging.warning("Nothing was written to {}".format(self.out_path))
+            return
+        self.fout.close()
+        os.rename(self.tmp_path,self.out_path)
+
+# Appends to the flat tree of an existing ROOT file (e.g. one written by RootTreeWriter), opened in UPDATE mode
+#   - Only the new entries are written, the baskets already in the file are left as they are
+#   - The incoming columns have to be the branches of the tree
+#   - The file is changed in place, an append that gets interrupted leaves extra entries at the end of the tree
+class RootTreeAppender(_ChunkedWriter):
+    def __init__(self,out_path,tree_name='limit',chunk_size=100000):
+        super(RootTreeAppender,self).__init__(out_path,chunk_size)
+        self.tree_name = tree_name
+        self.fout = None
+        self.tree = None
+        self.buffers = []
+
+    def write(self,chunk):
+        if self.fout is None:
+            self.fout = ROOT.TFile.Open(self.out_path,'update')
+            if not self.fout or self.fout.IsZombie():
+                raise RuntimeError("Unable to open {} for appending".format(self.out_path))
+            self.tree = self.fout.Get(self.tree_name)
+            available = sorted(b.GetName() for b in self.tree.GetListOfBranches())
+            if available != self.branches:
+                raise RuntimeError("Can't append the branches {} to the tree of {} ({})".format(','.join(self.branches),self.out_path,','.join(available)))
+            self.buffers = [np.zeros(1,dtype=np.float64) for b in self.branches]
+            for b,buf in zip(self.branches,self.buffers):
+                self.tree.SetBranchAddress(b,buf)
+        for row in np.column_stack([chunk[b] for b in self.branches]):
+            for buf,x in zip(self.buffers,row):
+                buf[0] = x
+            self.tree.Fill()
+
+    def close(self):
+        super(RootTreeAppender,self).close()
+        if self.fout is None: return
+        self.fout.cd()
+        self.tree.Write('',ROOT.TObject.kOverwrite)
+        self.tree.ResetBranchAddresses()
+        self.fout.Close()
+
+# Writes the columns as a numbered series of .npz files: out_path.chunk00000.npz, out_path.chunk00001.npz, ...
+class NpzChunkWriter(_ChunkedWriter):
+    def __init__(self,out_path,chunk_size=100000):
+        super(NpzChunkWriter,self).__init__(out_path,chunk_size)
+        self.nchunks = 0
+
+    def write(self,chunk):
+        np.savez(get_npz_chunk_path(self.out_path,self.nchunks),**chunk)
+        self.nchunks += 1
+
+def get_npz_chunk_path(out_path,idx):
+    return '{}.chunk{:05d}.npz'.format(out_path,idx)
+
+# Read back (and concatenate) all of the chunks written by NpzChunkWriter
+def read_npz_chunks(out_path):
+    chunks = []
+    idx = 0
+    while os.path.exists(get_npz_chunk_path(out_path,idx)):
+        with np.load(get_npz_chunk_path(out_path,idx)) as npz:
+            chunks.append({k: npz[k] for k in npz.files})
+        idx += 1
+    if not chunks: return {}
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0].keys()}
+
+def make_writer(out_path,fmt=MergeFormat.ROOT,chunk_size=100000):
+    if fmt == MergeFormat.ROOT:
+        return RootTreeWriter(out_path,chunk_size=chunk_size)
+    elif fmt == MergeFormat.NPZ:
+        return NpzChunkWriter(out_path,chunk_size=chunk_size)
+    raise RuntimeError("Unknown merge format: {}".format(fmt))
+
+# Merge the 'limit' trees from a list of root files and/or tarballs into out_path
+#   inputs: List of paths to root files or .tar archives containing root files
+#   branches: Branches (or glob patterns) to keep, by default everything in the limit tree
+#   fmt: One of MergeFormat.ROOT or MergeFormat.NPZ
+#   ingested: If a list is given, the inputs which contributed at least one file are appended to it
+#   stats: If a dict is given, it's filled with the number of scan points (entries other than the best fit row) read from each source
+#   drop_best_fit: Inputs whose best fit rows (quantileExpected=-1) are left out, e.g. the extra passes of a refined scan
+#   select: {input: boolean array} of the rows to keep from a (plain root file) input
+#   sources: If a list is given, (input,source,entries) is appended for each merged source, in the order of the output rows
+#   failed: If a list is given, the inputs which couldn't be read completely are appended to it
+#   required: Inputs which have to be read, if one of them can't be the merge is aborted (and out_path left untouched)
+#   append: Append the entries to the tree of the existing out_path (see RootTreeAppender) instead of writing a new
+#     output, branches then has to give exactly the branches of that tree
+#   Returns the list of sources (files or tar members) which were merged successfully
+def merge_scan_outputs(inputs,out_path,branches=['*'],fmt=MergeFormat.ROOT,member_pattern='*.root',chunk_size=100000,tmp_dir=None,ingested=None,stats=None,drop_best_fit=[],select={},sources=None,failed=None,required=[],append=False):
+    if append:
+        if fmt != MergeFormat.ROOT:
+            raise RuntimeError("Appending is only supported for root outputs")
+        writer = RootTreeAppender(out_path,chunk_size=chunk_size)
+    else:
+        writer = make_writer(out_path,fmt,chunk_size)
+    merged = []
+    for inp,src,fpath in iter_root_files(inputs,member_pattern,tmp_dir,failed):
+        try:
+            arrs = read_limit_tree(fpath,branches)
+        except Exception as e:
+            if inp in required:
+                raise RuntimeError("Unable to read {}: {}".format(src,e))
+            logging.error("Skipping {}: {}".format(src,e))
+            if failed is not None and inp not in failed: failed.append(inp)
+            continue
+        if inp in drop_best_fit:
+            arrs = drop_best_fit_rows(arrs)
+        if inp in select:
+            arrs = {k: v[select[inp]] for k,v in arrs.items()}
+        if writer.branches is None:
+            # The first file fixes the set of branches, so every later file gives the same columns
+            branches = sorted(arrs.keys())
+        writer.extend(arrs)
+        merged.append(src)
+        if stats is not None:
+            stats[src] = count_scan_points(arrs)
+        if sources is not None:
+            sources.append((inp,src,len(arrs[branches[0]]) if arrs else 0))
+        if ingested is not None and inp not in ingested:
+            ingested.append(inp)
+        if len(merged) % 100 == 0:
+            logging.info("Merged {} files ({} entries)".format(len(merged),writer.entries+writer.buffered))
+    writer.close()
+    logging.info("Merged {} files into {} ({} entries)".format(len(merged),out_path,writer.entries))
+    return merged
+
+# Path of the manifest which records the inputs already merged into out_path
+def get_manifest_path(out_path):
+    return out_path + '.manifest.json'
+
+# Identify an input by its path, size and mtime, so a file that gets rewritten is seen as new
+def _input_stamp(fpath):
+    st = os.stat(fpath)
+    return [st.st_size,st.st_mtime]
+
+# The manifest has the form:
+#   {'inputs': {input path: [size,mtime]}, 'blocks': {source: [first point,last point,entries]}, 'sources': [[source,input path,entries]]}
+#   - 'blocks' lists the combine outputs of the --firstPoint/--lastPoint jobs (the higgsCombine*.POINTS.X.Y.*.root files),
+#     see scan_coverage.py
+#   - 'sources' lists the sources (files or tar members) in the order of their rows in the output, so the rows of an
+#     input can be replaced when it changes. It's None for outputs written before it was recorded
+def load_manifest(out_path):
+    manifest_path = get_manifest_path(out_path)
+    if not os.path.exists(manifest_path) or not os.path.exists(out_path):
+        return {'inputs': {}, 'blocks': {}, 'sources': []}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if 'sources' not in manifest:
+        manifest['sources'] = [] if not manifest['inputs'] else None
+    return manifest
+
+def save_manifest(out_path,manifest):
+    manifest_path = get_manifest_path(out_path)
+    with open(manifest_path + '.tmp','w') as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+    os.rename(manifest_path + '.tmp',manifest_path)
+
+# Number of entries and (sorted) branch names of the limit tree of a file, without reading any of its baskets
+def _get_tree_info(fpath,tree_name='limit'):
+    with uproot.open(fpath) as f:
+        tree = f[tree_name]
+        return get_num_entries(tree),sorted(get_branch_names(tree))
+
+# Same as merge_scan_outputs(), but only merges the inputs which aren't in the manifest of out_path yet
+#   - The entries of the new inputs are appended to the tree of the existing output (see RootTreeAppender), so the
+#     cost of a retrieval only depends on what it adds, and the manifest is updated
+#   - An input which changed since it was merged (e.g. a tarball that was still being copied) replaces the rows it
+#     contributed before, and an input which couldn't be read completely is retried the next time
+#   - A POINTS block which comes back again (e.g. a resubmitted job which was truncated the first time) replaces
+#     the rows of the earlier copy of the block
+#   - Replacing rows is the only case where the whole output is rewritten
+#   - Entries left past the ones in the manifest by an interrupted append are dropped
+#   - Without a manifest (or with fresh=True) the output is rebuilt from all of the inputs
+#   - Only supported for MergeFormat.ROOT outputs
+#   - Returns the list of inputs which were newly ingested
+def incremental_merge(inputs,out_path,fresh=False,**kwargs):
+    if kwargs.get('fmt',MergeFormat.ROOT) != MergeFormat.ROOT:
+        raise RuntimeError("Incremental merging is only supported for root outputs")
+    manifest = {'inputs': {}, 'blocks': {}, 'sources': []} if fresh else load_manifest(out_path)
+    new_inputs = []
+    for fpath in inputs:
+        key = os.path.abspath(fpath)
+        if manifest['inputs'].get(key) == _input_stamp(fpath): continue
+        new_inputs.append(fpath)
+    if not new_inputs:
+        logging.info("All {} inputs are already merged into {}".format(len(inputs),out_path))
+        return []
+
+    new_keys = set(os.path.abspath(fpath) for fpath in new_inputs)
+    if manifest['sources'] is None and any(key in manifest['inputs'] for key in new_keys):
+        logging.warning("The manifest of {} doesn't record the rows of each input, rebuilding it from all of the inputs".format(out_path))
+        manifest = {'inputs': {}, 'blocks': {}, 'sources': []}
+        new_inputs = list(inputs)
+        new_keys = set(os.path.abspath(fpath) for fpath in new_inputs)
+    logging.info("Merging {} new inputs into {} ({} already merged)".format(len(new_inputs),out_path,len(manifest['inputs'])))
+
+    # Stamp the inputs before merging, so anything written while we're reading is picked up next time
+    stamps = dict((os.path.abspath(fpath),_input_stamp(fpath)) for fpath in new_inputs)
+    old_sources = manifest['sources']
+    append = bool(manifest['inputs'] or old_sources)
+    extra = 0
+    if append:
+        try:
+            nentries,branches = _get_tree_info(out_path)
+        except Exception as e:
+            raise RuntimeError("Unable to read back {} ({}), rerun with fresh=True to rebuild it".format(out_path,e))
+        if old_sources is not None:
+            listed = sum(x[2] for x in old_sources)
+            if nentries < listed:
+                raise RuntimeError("{} has {} entries, but its manifest lists {}, rerun with fresh=True to rebuild it".format(out_path,nentries,listed))
+            extra = nentries - listed
+            if extra:
+                logging.warning("{} has {} entries past the ones in its manifest (from an interrupted merge), dropping them".format(out_path,extra))
+        # The new rows have to fill the same branches as the ones already in the tree
+        kwargs['branches'] = branches
+        for key in new_keys:
+            manifest['inputs'].pop(key,None)
+        for src in [x[0] for x in old_sources or [] if x[1] in new_keys]:
+            manifest['blocks'].pop(os.path.basename(src),None)
+    ingested = []
+    stats = {}
+    sources = []
+    failed = []
+    merge_scan_outputs(new_inputs,out_path,ingested=ingested,stats=stats,sources=sources,failed=failed,append=append,**kwargs)
+
+    for fpath in ingested:
+        # Inputs which were only partly read are left out of the manifest, so they're replaced the next time
+        if fpath in failed: continue
+        manifest['inputs'][os.path.abspath(fpath)] = stamps[os.path.abspath(fpath)]
+    new_sources = [[src,os.path.abspath(inp),entries] for inp,src,entries in sources]
+    if old_sources is not None:
+        # Drop the rows merged before from the inputs which were merged again, the ones of an interrupted merge, and
+        #   the earlier copies of the POINTS blocks which came back
+        all_sources = old_sources + ([['',None,extra]] if extra else []) + new_sources
+        keep = [x[1] not in new_keys for x in old_sources] + [False]*(1 if extra else 0) + [True]*len(new_sources)
+        keep = _keep_last_blocks(all_sources,keep)
+        if not all(keep):
+            _drop_rows(out_path,all_sources,keep)
+        manifest['sources'] = [x for x,k in zip(all_sources,keep) if k]
+    # In the order of the output rows, so the last copy of a block is the one that's recorded
+    for inp,src,entries in sources:
+        entries = stats[src]
+        m = POINTS_RGX.search(os.path.basename(src))
+        if m is None: continue
+        # Keyed by the file name only, so a block which was rerun replaces the old one
+        manifest['blocks'][os.path.basename(src)] = [int(m.group(1)),int(m.group(2)),entries]
+    save_manifest(out_path,manifest)
+    return ingested
+
+# Only keep the last copy of each POINTS block, so a block which was merged again from a new source (e.g. a
+#   resubmitted job in a new tarball) replaces the rows of the earlier copy
+#   - sources: The manifest 'sources' entries of the rows in the output, in order
+#   - keep: Whether the rows of each source are kept so far
+def _keep_last_blocks(sources,keep):
+    last = {}
+    for idx,(x,k) in enumerate(zip(sources,keep)):
+        block = os.path.basename(x[0])
+        if k and POINTS_RGX.search(block): last[block] = idx
+    return [k and last.get(os.path.basename(x[0]),idx) == idx for idx,(x,k) in enumerate(zip(sources,keep))]
+
+# Rewrite out_path without the rows of the sources which aren't kept
+def _drop_rows(out_path,sources,keep):
+    mask = np.concatenate([np.full(x[2],k,dtype=bool) for x,k in zip(sources,keep)])
+    logging.info("Removing {} replaced entries from {}".format(np.count_nonzero(~mask),out_path))
+    merge_scan_outputs([out_path],out_path,select={out_path: mask},required=[out_path])
+
+# Worker for parallel_merge(), has to live at module level so that it can be pickled
+def _merge_part(job):
+    inputs,out_path = job
+    merged = merge_scan_outputs(inputs,out_path)
+    return out_path,len(merged)
+
+# Path of the record of the inputs a partial output of parallel_merge() was built from
+def _get_record_path(out_path):
+    return out_path + '.inputs.json'
+
+# The inputs of a part, with their size and mtime, so that a partial output is rebuilt whenever the
+#   set of inputs of its part changes or one of them is rewritten (e.g. a lower level output that was rebuilt)
+def _get_input_record(inputs):
+    return [[os.path.abspath(fpath)] + _input_stamp(fpath) for fpath in inputs]
+
+def _is_part_done(job,record):
+    inputs,out_path = job
+    if not os.path.exists(out_path) or not os.path.exists(_get_record_path(out_path)):
+        return False
+    with open(_get_record_path(out_path)) as f:
+        return json.load(f) == record
+
+def _run_parts(jobs,nworkers,label):
+    # Skip anything that was already produced from the same inputs by a previous (interrupted) run
+    records = dict((job[1],_get_input_record(job[0])) for job in jobs)
+    todo = [job for job in jobs if not _is_part_done(job,records[job[1]])]
+    if len(todo) < len(jobs):
+        logging.info("{}: {}/{} parts already done, resuming".format(label,len(jobs)-len(todo),len(jobs)))
+    if not todo: return
+    for inputs,out_path in todo:
+        # Stale outputs (built from a different set of inputs) are removed, so they can't be picked up if the rebuild fails
+        for fpath in (out_path,_get_record_path(out_path)):
+            if os.path.exists(fpath): os.remove(fpath)
+    empty = []
+    pool = multiprocessing.Pool(processes=min(nworkers,len(todo)))
+    try:
+        for idx,(out_path,nmerged) in enumerate(pool.imap_unordered(_merge_part,todo)):
+            logging.info("{}: finished part {}/{} ({})".format(label,idx+1,len(todo),os.path.basename(out_path)))
+            if not nmerged or not os.path.exists(out_path):
+                empty.append(out_path)
+                continue
+            with open(_get_record_path(out_path),'w') as f:
+                json.dump(records[out_path],f)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    if empty:
+        for out_path in empty:
+            inputs = [job[0] for job in todo if job[1] == out_path][0]
+            logging.error("{}: none of the inputs of {} could be read: {}".format(label,os.path.basename(out_path),', '.join(inputs)))
+        raise RuntimeError("{}: {} parts produced no output".format(label,len(empty)))
+
+# Merge a large number of inputs with a bounded pool of worker processes
+#   - The inputs are split into parts of files_per_part, which are merged concurrently by nworkers processes
+#   - The partial outputs are then merged hierarchically, fan_in at a time, until a single file is left
+#   - Every partial output is only moved into place once it is complete, so rerunning with the same
+#     work_dir after an interruption picks up where the previous run stopped
+#   - The inputs of each partial output are recorded next to it, and any output whose inputs changed (e.g. a
+#     higher level group which got new parts) is rebuilt
+#   - A part whose inputs are all unreadable raises a RuntimeError instead of being left out
+def parallel_merge(inputs,out_path,work_dir,nworkers=4,files_per_part=100,fan_in=16):
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    # Keep the split of the inputs from the first run, so the parts stay valid when resuming
+    #   - Inputs which showed up since then (e.g. jobs which finished in the meantime) are added as new parts
+    parts_file = os.path.join(work_dir,'parts.json')
+    parts = []
+    if os.path.exists(parts_file):
+        with open(parts_file) as f:
+            parts = json.load(f)
+    known = set(fpath for part in parts for fpath in part)
+    new_inputs = sorted(fpath for fpath in inputs if fpath not in known)
+    for i in range(0,len(new_inputs),files_per_part):
+        parts.append(new_inputs[i:i+files_per_part])
+    with open(parts_file,'w') as f:
+        json.dump(parts,f)
+
+    level = 0
+    jobs = [(part,os.path.join(work_dir,'level{}_{:05d}.root'.format(level,i))) for i,part in enumerate(parts)]
+    _run_parts(jobs,nworkers,'Level {}'.format(level))
+    outputs = [job[1] for job in jobs if os.path.exists(job[1])]
+
+    # Tree-reduce the partial outputs
+    while len(outputs) > 1:
+        level += 1
+        jobs = []
+        for i in range(0,len(outputs),fan_in):
+            jobs.append((outputs[i:i+fan_in],os.path.join(work_dir,'level{}_{:05d}.root'.format(level,i//fan_in))))
+        _run_parts(jobs,nworkers,'Level {}'.format(level))
+        outputs = [job[1] for job in jobs if os.path.exists(job[1])]
+
+    if not outputs:
+        logging.error("Nothing was merged into {}".format(out_path))
+        return False
+    shutil.move(outputs[0],out_path)
+    logging.info("Merged {} inputs into {}".format(len(known)+len(new_inputs),out_path))
+    return True
@@ -0,0 +1,111 @@
+import logging
+
+import numpy as np
+
+from limit_tree import iter_limit_tree
+from scan_merger import RootTreeWriter
+
+# Reduce a higher-dimension scan to a lower-dimension one, keeping the lowest deltaNLL at each point
+#   - The limit tree is streamed in fixed-size blocks of columns, and a running minimum is kept for each
+#     cell of the reduced grid in a numpy array, so memory only scales with the size of the reduced grid
+#     and not with the number of points in the scan
+#   - The grid axes are the distinct values of the reduced parameters, found as the blocks are read, so
+#     no range or number of points has to be given (the values of a combine grid are exact float32
+#     bin centres, so the same point always maps to the same cell)
+#   - The reduced tree is written in one go with uproot
+
+# Running minimum of deltaNLL on the grid spanned by params
+#   - Any other branches passed to update() are kept for the entry with the lowest deltaNLL in each cell
+class GridMinimum(object):
+    def __init__(self,params,nll_branch='deltaNLL'):
+        self.params = list(params)
+        self.nll_branch = nll_branch
+        self.axes = [np.zeros(0) for p in self.params]
+        self.nll = np.full([0]*len(self.params),np.inf)
+        self.kept = None    # {branch: array with the same shape as self.nll}
+
+    def getShape(self):
+        return tuple([len(ax) for ax in self.axes])
+
+    # Extend the axes with new values, moving the existing cells to their new indices
+    def grow(self,new_vals):
+        new_axes = [np.union1d(ax,vals) for ax,vals in zip(self.axes,new_vals)]
+        shape = tuple([len(ax) for ax in new_axes])
+        old_idx = np.ix_(*[np.searchsorted(new,old) for new,old in zip(new_axes,self.axes)])
+        nll = np.full(shape,np.inf)
+        nll[old_idx] = self.nll
+        self.nll = nll
+        for b,arr in self.kept.items():
+            new_arr = np.full(shape,np.nan)
+            new_arr[old_idx] = arr
+            self.kept[b] = new_arr
+        self.axes = new_axes
+
+    def update(self,arrs):
+        if self.kept is None:
+            self.kept = {}
+            for b in arrs.keys():
+                if b in self.params or b == self.nll_branch: continue
+                self.kept[b] = np.full(self.getShape(),np.nan)
+        nlls = arrs[self.nll_branch]
+        mask = np.isfinite(nlls)
+        if not np.any(mask): return
+        nlls = nlls[mask]
+        vals = [arrs[p][mask] for p in self.params]
+
+        uniques = [np.unique(v) for v in vals]
+        if any(len(np.setdiff1d(u,ax,assume_unique=True)) for u,ax in zip(uniques,self.axes)):
+            self.grow(uniques)
+        cells = np.ravel_multi_index([np.searchsorted(ax,v) for ax,v in zip(self.axes,vals)],self.getShape())
+
+        # Lowest deltaNLL of each cell in this block: sort by cell, then deltaNLL, and take the first entry of each cell
+        order = np.lexsort((nlls,cells))
+        sorted_cells = cells[order]
+        first = np.ones(len(order),dtype=bool)
+        first[1:] = sorted_cells[1:] != sorted_cells[:-1]
+        sel = order[first]
+        cells,block_min = cells[sel],nlls[sel]
+
+        # Merge into the running minimum (reshape(-1) gives views, since the arrays are contiguous)
+        running = self.nll.reshape(-1)
+        better = block_min < running[cells]
+        running[cells[better]] = block_min[better]
+        for b,arr in self.kept.items():
+            arr.reshape(-1)[cells[better]] = arrs[b][mask][sel[better]]
+
+    # Returns the filled cells as a dict of flat arrays {branch: values}
+    def getEntries(self):
+        filled = np.isfinite(self.nll)
+        ret = {}
+        grids = np.meshgrid(*self.axes,indexing='ij')
+        for p,grid in zip(self.params,grids):
+            ret[p] = grid[filled]
+        ret[self.nll_branch] = self.nll[filled]
+        for b,arr in self.kept.items():
+            ret[b] = arr[filled]
+        return ret
+
+# Reduce the limit trees in fpaths to the grid of params, and write the result to out_path
+#   params: The parameters to keep, e.g. ['ctp'] or ['cpt','ctp']
+#   keep: Other branches (or glob patterns) to store for the best entry of each point, e.g. ['trackedParam_*']
+#   step_size: Number of entries read at a time
+#   Returns the number of points in the reduced tree
+def reduce_limit_trees(fpaths,params,out_path,keep=[],step_size=1000000,nll_branch='deltaNLL'):
+    reducer = GridMinimum(params,nll_branch)
+    branches = list(params) + [nll_branch] + list(keep)
+    nread = 0
+    for fpath in fpaths:
+        for arrs in iter_limit_tree(fpath,branches,step_size):
+            reducer.update(arrs)
+            nread += len(arrs[nll_branch])
+            logging.debug("Reduced {} entries, {} grid points".format(nread,np.count_nonzero(np.isfinite(reducer.nll))))
+    entries = reducer.getEntries()
+    npoints = len(entries[nll_branch])
+    if not npoints:
+        logging.error("No entries to reduce in {}".format(', '.join(fpaths)))
+        return 0
+    writer = RootTreeWriter(out_path,chunk_size=npoints)
+    writer.extend(entries)
+    writer.close()
+    logging.info("Reduced {} entries to {} points of {} in {}".format(nread,npoints,', '.join(params),out_path))
+    return npoints
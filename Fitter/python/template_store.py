@@ -0,0 +1,102 @@
+import os
+import json
+import ROOT as r
+
+# Per-category store of the TH1D templates made by HistoReader.convertToTH1
+#   - One root file per category, with the histograms named {process} (nominal) or {process}__{systematic}, and
+#     an index.json listing the processes and systematics of each category, so the categories can be listed
+#     (and the processes classified) without reading any histograms
+#   - Categories are written one at a time and loaded on demand, so only one category has to be in memory
+#   - pruned.json lists the EFT templates of each category which weren't written (see HistoReader.pruneTemplates)
+
+class TemplateStore(object):
+    INDEX_NAME = 'index.json'
+    PRUNED_NAME = 'pruned.json'
+
+    def __init__(self, store_dir='templates'):
+        self.store_dir = store_dir
+        self.index = {}     # {category: {process: [systematics]}}
+        self.pruned = {}    # {category: {template: largest contribution relative to the SM}}
+        index_path = os.path.join(store_dir, self.INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        pruned_path = os.path.join(store_dir, self.PRUNED_NAME)
+        if os.path.exists(pruned_path):
+            with open(pruned_path) as f:
+                self.pruned = json.load(f)
+
+    @staticmethod
+    def getKeyName(process, systematic):
+        return process if systematic == '' else '%s__%s'%(process, systematic)
+
+    def getFilePath(self, category):
+        return os.path.join(self.store_dir, '%s.root'%category)
+
+    def getCategories(self):
+        return sorted(self.index.keys())
+
+    def getProcesses(self, category):
+        return sorted(self.index[category].keys())
+
+    def getSystematics(self, category, process):
+        return list(self.index[category][process])
+
+    def getPruned(self, category):
+        return dict(self.pruned.get(category, {}))
+
+    def saveIndex(self):
+        for name,content in [(self.INDEX_NAME, self.index), (self.PRUNED_NAME, self.pruned)]:
+            fpath = os.path.join(self.store_dir, name)
+            with open(fpath + '.tmp', 'w') as f:
+                json.dump(content, f, indent=1, sort_keys=True)
+            os.rename(fpath + '.tmp', fpath)
+
+    # Remove all of the categories, so nothing from an earlier conversion is left in the store
+    def clear(self):
+        for category in self.index:
+            if os.path.exists(self.getFilePath(category)):
+                os.remove(self.getFilePath(category))
+        if os.path.exists(self.store_dir):
+            for fn in os.listdir(self.store_dir):
+                if fn.endswith('.tmp.root'): os.remove(os.path.join(self.store_dir, fn))
+        self.index = {}
+        self.pruned = {}
+        if os.path.exists(self.store_dir):
+            self.saveIndex()
+
+    # templates: {process: {systematic: TH1}}
+    # pruned: {template: largest contribution relative to the SM} of the templates that weren't written
+    def writeCategory(self, category, templates, pruned={}):
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        # Write to a temporary file first, so an interrupted conversion never leaves a truncated category behind
+        fpath = self.getFilePath(category)
+        tmp_path = fpath.replace('.root', '.tmp.root')
+        outf = r.TFile.Open(tmp_path, 'recreate')
+        for process in templates:
+            for systematic in templates[process]:
+                outf.WriteTObject(templates[process][systematic], self.getKeyName(process, systematic))
+        outf.Close()
+        os.rename(tmp_path, fpath)
+        self.index[category] = dict((process, sorted(templates[process].keys())) for process in templates)
+        self.pruned[category] = dict(pruned)
+        self.saveIndex()
+
+    # Returns {process: {systematic: TH1}}, the histograms are detached from the file and freed once dropped
+    def readCategory(self, category):
+        if category not in self.index:
+            raise RuntimeError("Category %s not in the template store %s"%(category, self.store_dir))
+        inf = r.TFile.Open(self.getFilePath(category))
+        if not inf:
+            raise RuntimeError("Failed to open file %s ! "%self.getFilePath(category))
+        templates = {}
+        for process in self.index[category]:
+            templates[process] = {}
+            for systematic in self.index[category][process]:
+                histo = inf.Get(self.getKeyName(process, systematic))
+                histo.SetDirectory(0)
+                r.SetOwnership(histo, True) # Otherwise nothing ever deletes the histograms returned by Get()
+                templates[process][systematic] = histo
+        inf.Close()
+        return templates
@@ -1,7 +1,10 @@
 import re
 import os
-import subprocess
+import time
 import logging
+import threading
+import subprocess
+import collections
 
 class CombineMethod(object):
     NONE = "None"
@@ -52,20 +55,64 @@ def regex_match(lst,regex_lst):
                 break
     return matches
 
-# Run a shell subprocess
-def run_command(inputs):
+# Summary of a finished run_command call
+class CommandResult(object):
+    def __init__(self,cmd,returncode,wall_time,max_rss,tail):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.wall_time = wall_time  # In seconds
+        self.max_rss = max_rss      # Peak resident memory of the command, in MB
+        self.tail = tail            # The last lines of the output
+
+def _stream_lines(pipe,level,tail,log,quiet):
+    for l in iter(pipe.readline,''):
+        l = l.rstrip('\n')
+        tail.append(l)
+        if log is not None:
+            log.write(l + '\n')
+        if not quiet:
+            logging.log(level,l)
+
+# Run a shell subprocess, logging its output line by line as it arrives
+#   - Only the last 'tail_lines' lines are kept in memory (for the error report), so a verbose combine run
+#     doesn't have to be buffered until it exits
+#   log_file: If set, the output is also written to this file
+#   stderr_level: If set, stderr is logged separately at this level, otherwise it is merged into stdout
+#   check: If true, raise a CalledProcessError when the command fails
+#   quiet: If true, the output only goes to the log file
+#   Returns a CommandResult with the exit code, wall time and peak RSS of the command
+def run_command(inputs,log_file=None,stderr_level=None,check=True,quiet=False,cwd=None,tail_lines=200):
+    tic = time.time()
+    tail = collections.deque(maxlen=tail_lines)
+    log = open(log_file,'a') if log_file else None
     try:
-        stdout = subprocess.check_output(inputs,stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
+        if log is not None:
+            log.write('# {}\n'.format(' '.join(inputs)))
+        stderr = subprocess.STDOUT if stderr_level is None else subprocess.PIPE
+        process = subprocess.Popen(inputs,stdout=subprocess.PIPE,stderr=stderr,cwd=cwd,bufsize=1)
+        err_thread = None
+        if stderr_level is not None:
+            # Read stderr on the side, so neither pipe can fill up and block the process
+            err_thread = threading.Thread(target=_stream_lines,args=(process.stderr,stderr_level,tail,log,quiet))
+            err_thread.start()
+        _stream_lines(process.stdout,logging.INFO,tail,log,quiet)
+        if err_thread is not None:
+            err_thread.join()
+        # wait4 also gives us the resource usage of the (finished) child, ru_maxrss is in kB on linux
+        pid,status,usage = os.wait4(process.pid,0)
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    finally:
+        if log is not None:
+            log.close()
+    result = CommandResult(inputs,process.returncode,time.time() - tic,usage.ru_maxrss/1024.,list(tail))
+    logging.info("Command '{}' finished in {:.1f} s, peak RSS {:.1f} MB".format(inputs[0],result.wall_time,result.max_rss))
+    if check and result.returncode != 0:
+        e = subprocess.CalledProcessError(result.returncode,inputs,'\n'.join(result.tail))
         # Log the error and re-raise the exception
-        logging.exception(e)
-        logging.error(e.cmd)
-        stdout = e.output
-        for l in stdout.split('\n'):
-            logging.info(l)
+        logging.error(e)
+        logging.error(' '.join(inputs))
         raise e
-    for l in stdout.split('\n'):
-        logging.info(l)
+    return result
 
 # Returns a list of file names from the target directory, optionally matching a list of regexs
 def get_files(tdir,targets=[]):
@@ -0,0 +1,151 @@
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import logging
+import pkgutil
+
+# Content-addressed cache of the text2workspace.py outputs
+#   - Each entry is keyed by a hash of the datacard text, the shape files it references, the text2workspace
+#     options (model, --PO options, ...) and the contents of any extra input files (e.g. the parameterization),
+#     so an identical workspace is reused across output directories and runs
+#   - Entries are evicted least-recently-used first once the cache grows beyond max_size (in MB)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"),".cache","EFTFit","workspaces")
+
+# Matches the modules imported by a python file
+IMPORT_RGX = re.compile(r'^\s*(?:from\s+([\w\.]+)\s+import|import\s+([\w\.]+))',re.MULTILINE)
+
+# Hashing the inputs is only redone when a file changes: {(path,size,mtime): digest}
+_file_digests = {}
+
+def file_digest(fpath):
+    fpath = os.path.abspath(fpath)
+    st = os.stat(fpath)
+    key = (fpath,st.st_size,st.st_mtime)
+    if key not in _file_digests:
+        h = hashlib.sha1()
+        with open(fpath,'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024),b''):
+                h.update(chunk)
+        _file_digests[key] = h.hexdigest()
+    return _file_digests[key]
+
+# Returns the shape files referenced by the 'shapes' lines of a datacard
+#   - Paths with $CHANNEL/$PROCESS/... placeholders are expanded to all of the files matching them
+def get_shape_files(datacard):
+    card_dir = os.path.dirname(os.path.abspath(datacard))
+    fpaths = set()
+    with open(datacard) as f:
+        for l in f:
+            tokens = l.split()
+            if len(tokens) < 4 or tokens[0] != 'shapes': continue
+            pattern = os.path.join(card_dir,tokens[3])
+            if '$' in pattern:
+                fpaths.update(glob.glob(re.sub(r'\$[A-Z_]+','*',pattern)))
+            else:
+                fpaths.add(pattern)
+    return sorted(fpaths)
+
+# Returns the source file of the physics model given to text2workspace.py with -P (e.g. 'EFTFit.Fitter.EFTModel:eftmodel'),
+#   plus the files of the modules it imports from its own directory (e.g. parameterization.py), so a change to the
+#   model code gives a new key
+#   - The model module itself isn't imported, only located
+def get_model_files(model):
+    modname = model.split(':')[0]
+    try:
+        loader = pkgutil.get_loader(modname)
+    except ImportError:
+        loader = None
+    if loader is None or not hasattr(loader,'get_filename'):
+        logging.warning("Unable to locate the physics model {}, changes to its code won't invalidate cached workspaces".format(modname))
+        return []
+    fpath = loader.get_filename()
+    if fpath.endswith('.pyc') and os.path.exists(fpath[:-1]):
+        fpath = fpath[:-1]
+    fpaths = []
+    todo = [os.path.abspath(fpath)]
+    while todo:
+        fpath = todo.pop()
+        if fpath in fpaths: continue
+        fpaths.append(fpath)
+        with open(fpath) as f:
+            text = f.read()
+        for m in IMPORT_RGX.finditer(text):
+            name = (m.group(1) or m.group(2)).split('.')[-1]
+            local = os.path.join(os.path.dirname(fpath),name + '.py')
+            if os.path.exists(local): todo.append(local)
+    return sorted(fpaths)
+
+class WorkspaceCache(object):
+    def __init__(self,cache_dir=DEFAULT_CACHE_DIR,max_size=5000):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    # Build the cache key for a workspace
+    #   datacard: The text datacard
+    #   options: The text2workspace.py options which affect the output, i.e. everything but the datacard and -o
+    #   extra_files: Any other input files read by the physics model, and the model code itself (see get_model_files)
+    def getKey(self,datacard,options,extra_files=[]):
+        h = hashlib.sha1()
+        h.update(file_digest(datacard))
+        for fpath in get_shape_files(datacard):
+            if not os.path.exists(fpath):
+                raise RuntimeError("Shape file {} referenced by {} does not exist!".format(fpath,datacard))
+            h.update(file_digest(fpath))
+        h.update(json.dumps(list(options)))
+        for fpath in extra_files:
+            h.update(file_digest(fpath))
+        return h.hexdigest()
+
+    def getPath(self,key):
+        return os.path.join(self.cache_dir,key + '.root')
+
+    def has(self,key):
+        return os.path.exists(self.getPath(key))
+
+    # Copy a cached workspace to out_path, returns False if there is no entry for the key
+    def fetch(self,key,out_path):
+        cache_path = self.getPath(key)
+        if not os.path.exists(cache_path):
+            return False
+        shutil.copyfile(cache_path,out_path)
+        # Bump the mtime, which is what we use to decide the LRU order
+        os.utime(cache_path,None)
+        return True
+
+    def store(self,key,ws_path):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write to a temporary file first, so a concurrent run never picks up a partial workspace
+        cache_path = self.getPath(key)
+        tmp_path = cache_path.replace('.root','.{}.tmp.root'.format(os.getpid()))
+        shutil.copyfile(ws_path,tmp_path)
+        os.rename(tmp_path,cache_path)
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits in max_size
+    def evict(self):
+        if self.max_size is None or not os.path.exists(self.cache_dir): return
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.root') or fn.endswith('.tmp.root'): continue
+            fpath = os.path.join(self.cache_dir,fn)
+            st = os.stat(fpath)
+            entries.append((st.st_mtime,st.st_size,fpath))
+        entries.sort()
+        total = sum(x[1] for x in entries)
+        max_bytes = self.max_size*1024*1024
+        while entries and total > max_bytes:
+            mtime,size,fpath = entries.pop(0)
+            self.logger.debug("Evicting {} from the workspace cache".format(fpath))
+            os.remove(fpath)
+            total -= size
+
+    def clear(self):
+        if not os.path.exists(self.cache_dir): return
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith('.root'): os.remove(os.path.join(self.cache_dir,fn))
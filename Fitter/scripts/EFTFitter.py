@@ -1,6 +1,8 @@
 import os
+import re
 import stat
 import sys
+import shutil
 import logging
 import subprocess as sp
 import ROOT
@@ -14,15 +16,27 @@ import uproot
 import numpy as np
 from collections import defaultdict
 from EFTFit.Fitter.findMask import findMask 
+from EFTFit.Fitter.utils import run_command
+import EFTFit.Fitter.limit_tree as limit_tree
+from EFTFit.Fitter.scan_merger import merge_scan_outputs, incremental_merge, parallel_merge, get_manifest_path, POINTS_RGX
+from EFTFit.Fitter.adaptive_scan import find_refine_regions, QuadTree2D, CONTOUR_LEVELS_2D, write_points_file
+from EFTFit.Fitter.scan_coverage import CoverageIndex, save_layout, load_layout
+from EFTFit.Fitter.local_batch import run_local_scan
+from EFTFit.Fitter.fit_snapshots import SnapshotCache, SNAPSHOT_NAME, get_frozen_parameters
+from EFTFit.Fitter.path_scan import run_path_scan, compare_with_grid
+from EFTFit.Fitter.scan_reduction import reduce_limit_trees
 from itertools import chain
 from scipy.stats import chi2
 
-# Batch modes supported are: CRAB3 ('crab') and Condor ('condor')
+# Batch modes supported are: CRAB3 ('crab'), Condor ('condor') and the local machine ('local', gridScan based methods only)
 
 class EFTFit(object):
     def __init__(self):
         self.logger = logging.getLogger(__name__)
 
+        # Best fit snapshots, used to warm start the scans and fits which follow a best fit
+        self.snapshots = SnapshotCache()
+
         # WCs lists for easy use
         # Full list of opeators
         self.wcs = ['ctW','ctZ','ctp','cpQM','ctG','cbW','cpQ3','cptb','cpt','cQl3i','cQlMi','cQei','ctli','ctei','ctlSi','ctlTi', 'cQq13', 'cQq83', 'cQq11', 'ctq1', 'cQq81', 'ctq8', 'ctt1', 'cQQ1', 'cQt8', 'cQt1', ] #TOP-22-006
@@ -107,12 +121,6 @@ class EFTFit(object):
         #self.systematics = ['CMS_ttbbnorm','FF','FFcloseEl_2016','FFcloseEl_2017','FFcloseEl_2018','FFcloseMu_2016','FFcloseMu_2017','FFcloseMu_2018','FFeta','FFpt','FSR','ISR','ISR_gg','ISR_qg','ISR_qq','JER_2016','JER_2017','JER_2018','JES_Absolute','JES_BBEC1','JES_FlavorQCD','JES_RelativeBal','JES_RelativeSample','ONE','PU','PreFiring','UE','ak8jer_2016','ak8jer_2017','ak8jer_2018','alphas','bbvlsf_2016','bbvlsf_2017','bbvlsf_2018','btagSFbc_2016','btagSFbc_2016APV','btagSFbc_2017','btagSFbc_2018','btagSFbc_corr','btagSFlight_2016','btagSFlight_2016APV','btagSFlight_2017','btagSFlight_2018','btagSFlight_corr','btgcferr1','btgcferr2','btghf','btghfstats1_2016','btghfstats1_2017','btghfstats1_2018','btghfstats2_2016','btghfstats2_2017','btghfstats2_2018','btgjes','btglf','btglfstats1_2016','btglfstats1_2017','btglfstats1_2018','btglfstats2_2016','btglfstats2_2017','btglfstats2_2018','charge_flips','diboson_njets','eleclepsf_2016','eleclepsf_2017','eleclepsf_2018','electrigeffsf_2016','electrigeffsf_2017','electrigeffsf_2018','fact_Diboson','fact_Triboson','fact_convs','fact_tHq','fact_tWZ','fact_tllq','fact_ttH','fact_ttll','fact_ttlnu','fact_tttt','fsr_ttbb','hdamp','hdamp_ttbb','isr_tt','isr_ttbb','jesEC2','jesEC22016','jesEC22017','jesEC22018','jesHEMIssue','jesHF','jesHF2016','jesHF2017','jesHF2018','jmrbkg_2016','jmrbkg_2017','jmrbkg_2018','jmrsig_2016','jmrsig_2017','jmrsig_2018','jmsbkg_2016','jmsbkg_2017','jmsbkg_2018','jmssig_2016','jmssig_2017','jmssig_2018','lepSF_elec','lepSF_muon','lumi','missing_parton','mu_f_tt','mu_f_ttbb','mu_r_tt','mu_r_ttbb','mulepsf_2016','mulepsf_2017','mulepsf_2018','mutrigeffsf_2016','mutrigeffsf_2017','mutrigeffsf_2018','pdf','pdf_scale_gg','pdf_scale_qg','pdf_scale_qq','pdf_ttbb','qcd_scale_V','qcd_scale_VV','qcd_scale_VVV','qcd_scale_tHq','qcd_scale_tWZ','qcd_scale_ttH','qcd_scale_ttll','qcd_scale_ttlnu','qcd_scale_tttt','renorm_Diboson','renorm_Triboson','renorm_convs','renorm_tHq','renorm_tWZ','renorm_tllq','renorm_ttH','renorm_ttll','renorm_ttlnu','renorm_tttt','singlet_qsc','triggerSF_2016','triggerSF_2016APV','triggerSF_2017','triggerSF_2018','tt2bxsec','ttCxsec','tt_qsc','tth_ggpdf','ttx_qsc','ttz_ggpdf',
         #'prop_bintop21003_y2016_Zhpt1_0_bin0','prop_bintop21003_y2016_Zhpt1_10_bin0','prop_bintop21003_y2016_Zhpt1_11_bin0','prop_bintop21003_y2016_Zhpt1_12_bin0','prop_bintop21003_y2016_Zhpt1_13_bin0','prop_bintop21003_y2016_Zhpt1_14_bin0','prop_bintop21003_y2016_Zhpt1_15_bin0','prop_bintop21003_y2016_Zhpt1_16_bin0','prop_bintop21003_y2016_Zhpt1_17_bin0','prop_bintop21003_y2016_Zhpt1_1_bin0','prop_bintop21003_y2016_Zhpt1_2_bin0','prop_bintop21003_y2016_Zhpt1_3_bin0','prop_bintop21003_y2016_Zhpt1_4_bin0','prop_bintop21003_y2016_Zhpt1_5_bin0','prop_bintop21003_y2016_Zhpt1_6_bin0','prop_bintop21003_y2016_Zhpt1_7_bin0','prop_bintop21003_y2016_Zhpt1_8_bin0','prop_bintop21003_y2016_Zhpt1_9_bin0','prop_bintop21003_y2016_Zhpt2_0_bin0','prop_bintop21003_y2016_Zhpt2_10_bin0','prop_bintop21003_y2016_Zhpt2_11_bin0','prop_bintop21003_y2016_Zhpt2_12_bin0','prop_bintop21003_y2016_Zhpt2_13_bin0','prop_bintop21003_y2016_Zhpt2_14_bin0','prop_bintop21003_y2016_Zhpt2_15_bin0','prop_bintop21003_y2016_Zhpt2_16_bin0','prop_bintop21003_y2016_Zhpt2_17_bin0','prop_bintop21003_y2016_Zhpt2_18_bin0','prop_bintop21003_y2016_Zhpt2_19_bin0','prop_bintop21003_y2016_Zhpt2_1_bin0','prop_bintop21003_y2016_Zhpt2_20_bin0','prop_bintop21003_y2016_Zhpt2_21_bin0','prop_bintop21003_y2016_Zhpt2_22_bin0','prop_bintop21003_y2016_Zhpt2_23_bin0','prop_bintop21003_y2016_Zhpt2_2_bin0','prop_bintop21003_y2016_Zhpt2_3_bin0','prop_bintop21003_y2016_Zhpt2_4_bin0','prop_bintop21003_y2016_Zhpt2_5_bin0','prop_bintop21003_y2016_Zhpt2_6_bin0','prop_bintop21003_y2016_Zhpt2_7_bin0','prop_bintop21003_y2016_Zhpt2_8_bin0','prop_bintop21003_y2016_Zhpt2_9_bin0','prop_bintop21003_y2016_Zhpt3_0_bin0','prop_bintop21003_y2016_Zhpt3_10_bin0','prop_bintop21003_y2016_Zhpt3_11_bin0','prop_bintop21003_y2016_Zhpt3_12_bin0','prop_bintop21003_y2016_Zhpt3_13_bin0','prop_bintop21003_y2016_Zhpt3_14_bin0','prop_bintop21003_y2016_Zhpt3_15_bin0','prop_bintop21003_y2016_Zhpt3_16_bin0','prop_bintop21003_y2016_Zhpt3_17_bin0','prop_bintop21003_y2016_Zhpt3_18_bin0','prop_bintop21003_y2016_Zhpt3_19_bin0','prop_bintop21003_y2016_Zhpt3_1_bin0','prop_bintop21003_y2016_Zhpt3_20_bin0','prop_bintop21003_y2016_Zhpt3_21_bin0','prop_bintop21003_y2016_Zhpt3_22_bin0','prop_bintop21003_y2016_Zhpt3_23_bin0','prop_bintop21003_y2016_Zhpt3_2_bin0','prop_bintop21003_y2016_Zhpt3_3_bin0','prop_bintop21003_y2016_Zhpt3_4_bin0','prop_bintop21003_y2016_Zhpt3_5_bin0','prop_bintop21003_y2016_Zhpt3_6_bin0','prop_bintop21003_y2016_Zhpt3_7_bin0','prop_bintop21003_y2016_Zhpt3_8_bin0','prop_bintop21003_y2016_Zhpt3_9_bin0','prop_bintop21003_y2017_Zhpt1_0_bin0','prop_bintop21003_y2017_Zhpt1_10_bin0','prop_bintop21003_y2017_Zhpt1_11_bin0','prop_bintop21003_y2017_Zhpt1_12_bin0','prop_bintop21003_y2017_Zhpt1_13_bin0','prop_bintop21003_y2017_Zhpt1_14_bin0','prop_bintop21003_y2017_Zhpt1_15_bin0','prop_bintop21003_y2017_Zhpt1_16_bin0','prop_bintop21003_y2017_Zhpt1_17_bin0','prop_bintop21003_y2017_Zhpt1_1_bin0','prop_bintop21003_y2017_Zhpt1_2_bin0','prop_bintop21003_y2017_Zhpt1_3_bin0','prop_bintop21003_y2017_Zhpt1_4_bin0','prop_bintop21003_y2017_Zhpt1_5_bin0','prop_bintop21003_y2017_Zhpt1_6_bin0','prop_bintop21003_y2017_Zhpt1_7_bin0','prop_bintop21003_y2017_Zhpt1_8_bin0','prop_bintop21003_y2017_Zhpt1_9_bin0','prop_bintop21003_y2017_Zhpt2_0_bin0','prop_bintop21003_y2017_Zhpt2_10_bin0','prop_bintop21003_y2017_Zhpt2_11_bin0','prop_bintop21003_y2017_Zhpt2_12_bin0','prop_bintop21003_y2017_Zhpt2_13_bin0','prop_bintop21003_y2017_Zhpt2_14_bin0','prop_bintop21003_y2017_Zhpt2_15_bin0','prop_bintop21003_y2017_Zhpt2_16_bin0','prop_bintop21003_y2017_Zhpt2_17_bin0','prop_bintop21003_y2017_Zhpt2_18_bin0','prop_bintop21003_y2017_Zhpt2_19_bin0','prop_bintop21003_y2017_Zhpt2_1_bin0','prop_bintop21003_y2017_Zhpt2_20_bin0','prop_bintop21003_y2017_Zhpt2_21_bin0','prop_bintop21003_y2017_Zhpt2_22_bin0','prop_bintop21003_y2017_Zhpt2_23_bin0_TTBar','prop_bintop21003_y2017_Zhpt2_23_bin0_VJets','prop_bintop21003_y2017_Zhpt2_23_bin0_ttH','prop_bintop21003_y2017_Zhpt2_23_bin0_ttX','prop_bintop21003_y2017_Zhpt2_23_bin0_ttZ','prop_bintop21003_y2017_Zhpt2_23_bin0_tt_B','prop_bintop21003_y2017_Zhpt2_2_bin0','prop_bintop21003_y2017_Zhpt2_3_bin0','prop_bintop21003_y2017_Zhpt2_4_bin0','prop_bintop21003_y2017_Zhpt2_5_bin0','prop_bintop21003_y2017_Zhpt2_6_bin0','prop_bintop21003_y2017_Zhpt2_7_bin0','prop_bintop21003_y2017_Zhpt2_8_bin0','prop_bintop21003_y2017_Zhpt2_9_bin0','prop_bintop21003_y2017_Zhpt3_0_bin0','prop_bintop21003_y2017_Zhpt3_10_bin0','prop_bintop21003_y2017_Zhpt3_11_bin0','prop_bintop21003_y2017_Zhpt3_12_bin0','prop_bintop21003_y2017_Zhpt3_13_bin0','prop_bintop21003_y2017_Zhpt3_14_bin0','prop_bintop21003_y2017_Zhpt3_15_bin0','prop_bintop21003_y2017_Zhpt3_16_bin0','prop_bintop21003_y2017_Zhpt3_17_bin0','prop_bintop21003_y2017_Zhpt3_18_bin0','prop_bintop21003_y2017_Zhpt3_19_bin0','prop_bintop21003_y2017_Zhpt3_1_bin0','prop_bintop21003_y2017_Zhpt3_20_bin0','prop_bintop21003_y2017_Zhpt3_21_bin0','prop_bintop21003_y2017_Zhpt3_22_bin0','prop_bintop21003_y2017_Zhpt3_23_bin0','prop_bintop21003_y2017_Zhpt3_2_bin0','prop_bintop21003_y2017_Zhpt3_3_bin0','prop_bintop21003_y2017_Zhpt3_4_bin0','prop_bintop21003_y2017_Zhpt3_5_bin0','prop_bintop21003_y2017_Zhpt3_6_bin0','prop_bintop21003_y2017_Zhpt3_7_bin0','prop_bintop21003_y2017_Zhpt3_8_bin0','prop_bintop21003_y2017_Zhpt3_9_bin0','prop_bintop21003_y2018_Zhpt1_0_bin0','prop_bintop21003_y2018_Zhpt1_10_bin0','prop_bintop21003_y2018_Zhpt1_11_bin0','prop_bintop21003_y2018_Zhpt1_12_bin0','prop_bintop21003_y2018_Zhpt1_13_bin0','prop_bintop21003_y2018_Zhpt1_14_bin0','prop_bintop21003_y2018_Zhpt1_15_bin0','prop_bintop21003_y2018_Zhpt1_16_bin0','prop_bintop21003_y2018_Zhpt1_17_bin0','prop_bintop21003_y2018_Zhpt1_1_bin0','prop_bintop21003_y2018_Zhpt1_2_bin0','prop_bintop21003_y2018_Zhpt1_3_bin0','prop_bintop21003_y2018_Zhpt1_4_bin0','prop_bintop21003_y2018_Zhpt1_5_bin0','prop_bintop21003_y2018_Zhpt1_6_bin0','prop_bintop21003_y2018_Zhpt1_7_bin0','prop_bintop21003_y2018_Zhpt1_8_bin0','prop_bintop21003_y2018_Zhpt1_9_bin0','prop_bintop21003_y2018_Zhpt2_0_bin0','prop_bintop21003_y2018_Zhpt2_10_bin0','prop_bintop21003_y2018_Zhpt2_11_bin0','prop_bintop21003_y2018_Zhpt2_12_bin0','prop_bintop21003_y2018_Zhpt2_13_bin0','prop_bintop21003_y2018_Zhpt2_14_bin0','prop_bintop21003_y2018_Zhpt2_15_bin0','prop_bintop21003_y2018_Zhpt2_16_bin0','prop_bintop21003_y2018_Zhpt2_17_bin0','prop_bintop21003_y2018_Zhpt2_18_bin0','prop_bintop21003_y2018_Zhpt2_19_bin0','prop_bintop21003_y2018_Zhpt2_1_bin0','prop_bintop21003_y2018_Zhpt2_20_bin0','prop_bintop21003_y2018_Zhpt2_21_bin0','prop_bintop21003_y2018_Zhpt2_22_bin0','prop_bintop21003_y2018_Zhpt2_23_bin0','prop_bintop21003_y2018_Zhpt2_2_bin0','prop_bintop21003_y2018_Zhpt2_3_bin0','prop_bintop21003_y2018_Zhpt2_4_bin0','prop_bintop21003_y2018_Zhpt2_5_bin0','prop_bintop21003_y2018_Zhpt2_6_bin0','prop_bintop21003_y2018_Zhpt2_7_bin0','prop_bintop21003_y2018_Zhpt2_8_bin0','prop_bintop21003_y2018_Zhpt2_9_bin0','prop_bintop21003_y2018_Zhpt3_0_bin0','prop_bintop21003_y2018_Zhpt3_10_bin0','prop_bintop21003_y2018_Zhpt3_11_bin0','prop_bintop21003_y2018_Zhpt3_12_bin0','prop_bintop21003_y2018_Zhpt3_13_bin0','prop_bintop21003_y2018_Zhpt3_14_bin0','prop_bintop21003_y2018_Zhpt3_15_bin0','prop_bintop21003_y2018_Zhpt3_16_bin0','prop_bintop21003_y2018_Zhpt3_17_bin0','prop_bintop21003_y2018_Zhpt3_18_bin0','prop_bintop21003_y2018_Zhpt3_19_bin0','prop_bintop21003_y2018_Zhpt3_1_bin0','prop_bintop21003_y2018_Zhpt3_20_bin0','prop_bintop21003_y2018_Zhpt3_21_bin0','prop_bintop21003_y2018_Zhpt3_22_bin0','prop_bintop21003_y2018_Zhpt3_23_bin0','prop_bintop21003_y2018_Zhpt3_2_bin0','prop_bintop21003_y2018_Zhpt3_3_bin0','prop_bintop21003_y2018_Zhpt3_4_bin0','prop_bintop21003_y2018_Zhpt3_5_bin0','prop_bintop21003_y2018_Zhpt3_6_bin0','prop_bintop21003_y2018_Zhpt3_7_bin0','prop_bintop21003_y2018_Zhpt3_8_bin0','prop_bintop21003_y2018_Zhpt3_9_bin0','prop_bintop22006_ch10_bin0','prop_bintop22006_ch10_bin1','prop_bintop22006_ch10_bin2','prop_bintop22006_ch11_bin0','prop_bintop22006_ch11_bin1','prop_bintop22006_ch11_bin2','prop_bintop22006_ch11_bin3_fakes_sm','prop_bintop22006_ch12_bin0_fakes_sm','prop_bintop22006_ch12_bin1','prop_bintop22006_ch12_bin2','prop_bintop22006_ch12_bin3_fakes_sm','prop_bintop22006_ch13_bin0','prop_bintop22006_ch13_bin1','prop_bintop22006_ch13_bin2','prop_bintop22006_ch13_bin3','prop_bintop22006_ch14_bin0','prop_bintop22006_ch14_bin1','prop_bintop22006_ch14_bin2','prop_bintop22006_ch14_bin3','prop_bintop22006_ch15_bin0','prop_bintop22006_ch15_bin1','prop_bintop22006_ch15_bin2','prop_bintop22006_ch15_bin3_fakes_sm','prop_bintop22006_ch16_bin0_fakes_sm','prop_bintop22006_ch16_bin1','prop_bintop22006_ch16_bin2','prop_bintop22006_ch16_bin3_fakes_sm','prop_bintop22006_ch17_bin0','prop_bintop22006_ch17_bin1','prop_bintop22006_ch17_bin2','prop_bintop22006_ch18_bin0','prop_bintop22006_ch18_bin1','prop_bintop22006_ch18_bin2','prop_bintop22006_ch18_bin3','prop_bintop22006_ch19_bin0','prop_bintop22006_ch19_bin1','prop_bintop22006_ch19_bin2','prop_bintop22006_ch19_bin3','prop_bintop22006_ch1_bin0','prop_bintop22006_ch1_bin1','prop_bintop22006_ch1_bin2_fakes_sm','prop_bintop22006_ch20_bin0_fakes_sm','prop_bintop22006_ch20_bin1_fakes_sm','prop_bintop22006_ch20_bin3_fakes_sm','prop_bintop22006_ch21_bin0','prop_bintop22006_ch21_bin1','prop_bintop22006_ch21_bin2_fakes_sm','prop_bintop22006_ch22_bin0','prop_bintop22006_ch22_bin1','prop_bintop22006_ch22_bin2_fakes_sm','prop_bintop22006_ch23_bin0_fakes_sm','prop_bintop22006_ch23_bin1','prop_bintop22006_ch23_bin2_fakes_sm','prop_bintop22006_ch23_bin3','prop_bintop22006_ch24_bin0_fakes_sm','prop_bintop22006_ch24_bin2_fakes_sm','prop_bintop22006_ch25_bin0','prop_bintop22006_ch25_bin1','prop_bintop22006_ch25_bin2','prop_bintop22006_ch25_bin3','prop_bintop22006_ch26_bin0','prop_bintop22006_ch26_bin1','prop_bintop22006_ch26_bin2','prop_bintop22006_ch26_bin3','prop_bintop22006_ch26_bin4','prop_bintop22006_ch27_bin0','prop_bintop22006_ch27_bin1','prop_bintop22006_ch28_bin0','prop_bintop22006_ch28_bin1','prop_bintop22006_ch28_bin3','prop_bintop22006_ch29_bin0','prop_bintop22006_ch29_bin1','prop_bintop22006_ch29_bin2','prop_bintop22006_ch29_bin3','prop_bintop22006_ch2_bin0_fakes_sm','prop_bintop22006_ch2_bin1','prop_bintop22006_ch2_bin2_fakes_sm','prop_bintop22006_ch30_bin0','prop_bintop22006_ch30_bin1','prop_bintop22006_ch31_bin0','prop_bintop22006_ch32_bin0','prop_bintop22006_ch32_bin1','prop_bintop22006_ch32_bin2','prop_bintop22006_ch32_bin3_fakes_sm','prop_bintop22006_ch33_bin0','prop_bintop22006_ch33_bin1','prop_bintop22006_ch33_bin2','prop_bintop22006_ch33_bin3','prop_bintop22006_ch34_bin0','prop_bintop22006_ch34_bin1','prop_bintop22006_ch34_bin2','prop_bintop22006_ch34_bin3','prop_bintop22006_ch35_bin0','prop_bintop22006_ch35_bin1','prop_bintop22006_ch35_bin2','prop_bintop22006_ch35_bin3_fakes_sm','prop_bintop22006_ch36_bin0_fakes_sm','prop_bintop22006_ch36_bin1_fakes_sm','prop_bintop22006_ch36_bin2_fakes_sm','prop_bintop22006_ch37_bin0','prop_bintop22006_ch37_bin1','prop_bintop22006_ch37_bin2','prop_bintop22006_ch38_bin0','prop_bintop22006_ch38_bin1','prop_bintop22006_ch39_bin0_fakes_sm','prop_bintop22006_ch39_bin1_fakes_sm','prop_bintop22006_ch3_bin0_fakes_sm','prop_bintop22006_ch3_bin1_fakes_sm','prop_bintop22006_ch3_bin2_fakes_sm','prop_bintop22006_ch40_bin0_fakes_sm','prop_bintop22006_ch40_bin1_fakes_sm','prop_bintop22006_ch40_bin2_fakes_sm','prop_bintop22006_ch40_bin3_fakes_sm','prop_bintop22006_ch4_bin1_fakes_sm','prop_bintop22006_ch4_bin2_fakes_sm','prop_bintop22006_ch5_bin0','prop_bintop22006_ch5_bin1','prop_bintop22006_ch5_bin2_fakes_sm','prop_bintop22006_ch6_bin0_fakes_sm','prop_bintop22006_ch6_bin1','prop_bintop22006_ch6_bin2_fakes_sm','prop_bintop22006_ch6_bin3_fakes_sm','prop_bintop22006_ch7_bin0_fakes_sm','prop_bintop22006_ch7_bin1_fakes_sm','prop_bintop22006_ch7_bin2_fakes_sm','prop_bintop22006_ch7_bin3_fakes_sm','prop_bintop22006_ch8_bin1_fakes_sm','prop_bintop22006_ch8_bin2_fakes_sm','prop_bintop22006_ch8_bin3_fakes_sm','prop_bintop22006_ch9_bin0','prop_bintop22006_ch9_bin1','prop_bintop22006_ch9_bin2','prop_bintop22006_ch9_bin3']
 
-    def log_subprocess_output(self,pipe,level):
-        ### Pipes Popen streams to logging class ###
-        for line in iter(pipe.readline, ''):
-            if level=='info': logging.info(line.rstrip('\n'))
-            if level=='err': logging.error(line.rstrip('\n'))
-
     def makeWorkspaceSM(self, datacard='EFT_MultiDim_Datacard.txt'):
         ### Generates a workspace from a datacard ###
         logging.info("Creating workspace")
@@ -135,11 +143,7 @@ class EFTFit(object):
                 '-o','SMWorkspace.root']
 
         logging.info(" ".join(args))
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
 
     def bestFitSM(self, name='.test', freeze=[], autoMaxPOIs=True, other=[], mask=[], mask_syst=[]):
         ### Multidimensional fit ###
@@ -169,11 +173,7 @@ class EFTFit(object):
             args.extend(['--setParameters',','.join(masks)])
 
         logging.info(" ".join(args))
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
         logging.info("Done with SMFit.")
         sp.call(['mv','higgsCombine'+name+'.MultiDimFit.mH120.root','../fit_files/higgsCombine'+name+'.MultiDimFit.root'])
         sp.call(['mv','multidimfit'+name+'.root','../fit_files/'])
@@ -197,11 +197,7 @@ class EFTFit(object):
         if batch=='condor':    args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--split-points','2000'])
         logging.info(' '.join(args))
 
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
         logging.info("Done with gridScan batch submission.")
 
         if not batch:
@@ -227,6 +223,50 @@ class EFTFit(object):
             
             
 
+    def findSnapshot(self, workspace, floated, frozen):
+        ### Returns the cached best fit snapshot for the workspace and floated/frozen parameters (None if there isn't one) ###
+        if not os.path.isfile(workspace):
+            return None
+        snapshot = self.snapshots.find(workspace, floated, frozen)
+        if snapshot:
+            logging.info("Starting from the best fit snapshot {}".format(snapshot))
+        return snapshot
+
+    def useSnapshot(self, args, snapshot, skip_fit=True):
+        ### Points a combine command to a best fit snapshot, and (optionally) skips its initial fit ###
+        args[args.index('-d')+1] = snapshot
+        args.extend(['--snapshotName',SNAPSHOT_NAME])
+        if skip_fit: args.extend(['--skipInitialFit'])
+
+    def stripZeroStarts(self, other, frozen=[]):
+        ### Returns a copy of other without the wc=0 starting values in its --setParameters options, for scans which start from a snapshot ###
+        # Handles both ['--setParameters','a=0,b=1'] and '--setParameters a=0,b=1', other settings (e.g. masks) and frozen wcs are kept
+        # Also returns the remaining settings, as a list of (parameter,value)
+        ret = []
+        remaining = []
+        idx = 0
+        while idx < len(other):
+            arg = other[idx]
+            if arg == '--setParameters' and idx+1 < len(other):
+                prefix,value = None,other[idx+1]
+                idx += 2
+            elif arg.startswith('--setParameters ') or arg.startswith('--setParameters='):
+                prefix,value = arg[:len('--setParameters')],arg[len('--setParameters')+1:].strip()
+                idx += 1
+            else:
+                ret.append(arg)
+                idx += 1
+                continue
+            kept = []
+            for item in value.split(','):
+                par,_,val = item.partition('=')
+                if par in self.wcs and par not in frozen and float(val) == 0: continue
+                if item: kept.append(item)
+            remaining.extend([tuple(item.split('=',1)) for item in kept])
+            if kept:
+                ret.extend(['--setParameters',','.join(kept)] if prefix is None else ['{} {}'.format(prefix,','.join(kept))])
+        return ret,remaining
+
     def makeWorkspaceEFT(self, datacard='EFT_MultiDim_Datacard.txt'):
         ### Generates a workspace from a datacard and fit parameterization file ###
         logging.info("Creating workspace")
@@ -234,21 +274,22 @@ class EFTFit(object):
             logging.error("Datacard does not exist!")
             sys.exit()
         CMSSW_BASE = os.getenv('CMSSW_BASE')
-        args = ['text2workspace.py',datacard,'-P','EFTFit.Fitter.EFTModel:eftmodel','--PO','fits='+CMSSW_BASE+'/src/EFTFit/Fitter/hist_files/EFT_Parameterization.npy','-o','EFTWorkspace.root','--channel-masks']
+        args = ['text2workspace.py',datacard,'-P','EFTFit.Fitter.EFTModel:eftmodel','--PO','fits='+CMSSW_BASE+'/src/EFTFit/Fitter/hist_files/EFT_Parameterization.eftp','-o','EFTWorkspace.root','--channel-masks']
 
         logging.info(' '.join(args))
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
         
-    def bestFit(self, name='.test', params_POI=[], startValuesString='', freeze=False, autoBounds=True, other=[]):
+    def bestFit(self, name='.test', params_POI=[], startValuesString='', freeze=False, autoBounds=True, other=[], warm_start=True):
         ### Multidimensional fit ###
+        # The best fit is saved as a snapshot, which later scans and fits with the same floated/frozen parameters start from
+        # warm_start: Start the minimization from the snapshot of a previous identical fit, if there is one
         CMSSW_BASE = os.getenv('CMSSW_BASE')
         if params_POI == []:
             params_POI = self.wcs
-        args=['combine','-d',CMSSW_BASE+'/src/EFTFit/Fitter/test/EFTWorkspace.root','-v','2','--saveFitResult','-M','MultiDimFit','-H','AsymptoticLimits','--cminPoiOnlyFit','--cminDefaultMinimizerStrategy=2']
+        workspace = CMSSW_BASE+'/src/EFTFit/Fitter/test/EFTWorkspace.root'
+        floated = self.wcs if not freeze else list(params_POI)
+        frozen = [wc for wc in self.wcs if wc not in floated] + get_frozen_parameters(other)
+        args=['combine','-d',workspace,'-v','2','--saveFitResult','--saveWorkspace','-M','MultiDimFit','-H','AsymptoticLimits','--cminPoiOnlyFit','--cminDefaultMinimizerStrategy=2']
         if name:              args.extend(['-n','{}'.format(name)])
         if params_POI:     args.extend(['-P',' -P '.join(params_POI)]) # Preserves constraints
         args.extend(['--trackParameters',','.join([wc for wc in self.wcs if wc not in params_POI])])
@@ -256,17 +297,16 @@ class EFTFit(object):
         if not freeze:        args.extend(['--floatOtherPOIs','1'])
         if autoBounds:        args.extend(['--autoBoundsPOIs=*'])
         if other:             args.extend(other)
+        snapshot = self.findSnapshot(workspace, floated, frozen) if warm_start else None
+        if snapshot:          self.useSnapshot(args, snapshot, skip_fit=False)
 
         logging.info(" ".join(args))
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
         logging.info("Done with bestFit.")
         sp.call(['mv','higgsCombine'+name+'.MultiDimFit.mH120.root','../fit_files/higgsCombine'+name+'.MultiDimFit.root'])
         if os.path.isfile('multidimfit'+name+'.root'):
             sp.call(['mv','multidimfit'+name+'.root','../fit_files/'])
+            self.snapshots.store(workspace, floated, frozen, '../fit_files/higgsCombine'+name+'.MultiDimFit.root', '../fit_files/multidimfit'+name+'.root', name)
         self.printBestFitsEFT(name)
 
     def batchDNNScan(self, name='.test', batch='crab', points=1000000, workspace='ptz-lj0pt_fullR2_anatest23v01_withAutostats_withSys.root', other=[]):
@@ -307,14 +347,14 @@ class EFTFit(object):
             logging.info(' '.join(args))
 
             # Run the combineTool.py command
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
         os.system('find -type d crab_* -size +1M -delete') # Remove input tgz files to save space
 
-    def retrieveDNNScan(self, name='.test', batch='crab'):
+    def retrieveDNNScan(self, name='.test', batch='crab', nworkers=8, files_per_part=100, fan_in=16):
+        ### Retrieves finished DNN scan jobs and merges them in parallel into a single file ###
+        # The tarballs are merged by a pool of nworkers processes, files_per_part tarballs at a time,
+        # and the partial outputs are then merged fan_in at a time until a single file is left
+        # If interrupted, calling this again with the same name resumes from the partial outputs in {taskname}tmp/
         taskname = name.replace('.','')
         logging.info("Retrieving gridScan files. Task name: "+taskname)
         logging.info(' '.join(['Collecting', name]))
@@ -330,45 +370,19 @@ class EFTFit(object):
             logging.error("No files found in store!")
             sys.exit()
 
-        # Make a temporary folder to hold the extracted root files
-        if not os.path.isdir(taskname+'tmp'):
-            sp.call(['mkdir',taskname+'tmp'])
-        else:
-            logging.error("Directory {}tmp/ already exists! Please rename this directory.".format(taskname))
-            return
+        tars = [tarfiles[0]+'/'+tarfile for tarfiles in paths for tarfile in tarfiles[2] if 'log' not in tarfile and tarfile.endswith('.tar')]
+        logging.info('Merging {} tar files with {} workers'.format(len(tars),nworkers))
+        ok = parallel_merge(tars,'../fit_files/higgsCombine'+name+'.MultiDimFit.root',taskname+'tmp',nworkers=nworkers,files_per_part=files_per_part,fan_in=fan_in)
 
-        def divide_chunks(farray, dfile=1000):
-            for i in range(0, len(farray), dfile):
-                yield farray[i:i+dfile]
-        # Extract the root files
-        print 'Extracting root files, this will take a few minutes'
-        tars = [tarfiles[0]+'/'+tarfile for tarfiles in paths for tarfile in tarfiles[2] if 'log' not in tarfile]
-        for tar in divide_chunks(tars, dfile=100):
-            process = [sp.Popen(['tar', '-xf', tarfile,'-C', taskname+'tmp'], stdout=sp.PIPE, stderr=sp.PIPE) for tarfile in tar]
-            for p in process:
-                p.wait()
-        '''
-        for tarfiles in paths:
-            for tarfile in tarfiles[2]:
-                if tarfile.endswith('.tar'):
-                    #print tarfiles[0]+'/'+tarfile
-                    sp.call(['tar', '-xf', tarfiles[0]+'/'+tarfile,'-C', taskname+'tmp'])
-        '''
-        haddargs = ['hadd', '-f', chunk[0].split('.POINT')[0], '.MultiDimFit_', str(ichunk), '.root', ' '.join(chunk)]
-        #haddargs = ['hadd','-f','../fit_files/higgsCombine'+name+'.MultiDimFit.root']+['{}tmp/{}'.format(taskname,rootfile) for rootfile in os.listdir(taskname+'tmp') if rootfile.endswith('.root')]
-        print haddargs
-        return
-        process = sp.Popen(haddargs, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
-
-        # Remove the temporary directory and split root files
-        sp.call(['rm','-r',taskname+'tmp'])
-
-    def gridScan(self, name='.test', batch='', freeze=False, scan_params=['ctW','ctZ'], params_tracked=[], points=90000, other=[], mask=[], mask_syst=[], workspace='EFTWorkspace.root', track_error=False):
-        ### Runs deltaNLL Scan in two parameters using CRAB or Condor ###
+        # Remove the partial outputs
+        if ok: shutil.rmtree(taskname+'tmp')
+
+    def gridScan(self, name='.test', batch='', freeze=False, scan_params=['ctW','ctZ'], params_tracked=[], points=90000, other=[], mask=[], mask_syst=[], workspace='EFTWorkspace.root', track_error=False, split_points=None, point_ranges=None, nworkers=None, warm_start=True):
+        ### Runs deltaNLL Scan in two parameters using CRAB, Condor, or the local machine ('local') ###
+        # split_points: Number of points per job (defaults depend on the batch type)
+        # point_ranges: Condor only, list of (firstPoint,lastPoint) blocks to submit instead of the full scan
+        # nworkers: Local only, number of blocks to run in parallel (defaults to the number of cores)
+        # warm_start: Start from the matching best fit snapshot (see bestFit) and skip the initial fit, if there is one
         logging.info("Doing grid scan...")
 
         CMSSW_BASE = os.getenv('CMSSW_BASE')
@@ -385,7 +399,19 @@ class EFTFit(object):
         if track_error: args.extend('--trackErrors rgx{.*}')
         if not freeze:        args.extend(['--floatOtherPOIs','1'])
         params = ['{}=0'.format(wc) for wc in scan_params+params_tracked]
-        if '--setParameters' not in other: # Set all starting points to 0 unless the user specifies otherwise
+        snapshot = None
+        # Masked channels change the likelihood, so the unmasked best fit is no use there
+        if warm_start and not mask and not any('mask_' in x for x in other):
+            floated = self.wcs if not freeze else scan_params
+            frozen = [wc for wc in self.wcs if wc not in floated] + get_frozen_parameters(other)
+            snapshot = self.findSnapshot(CMSSW_BASE+'/src/EFTFit/Fitter/test/'+workspace, floated, frozen)
+        if snapshot:
+            # The wc=0 starting values the batch/refine methods pass would overwrite the best fit values of the snapshot
+            other,remaining = self.stripZeroStarts(other, frozen)
+            # The deltaNLL is taken relative to the starting point when the initial fit is skipped, so only
+            #   skip it if no POI is moved away from the best fit by --setParameters
+            self.useSnapshot(args, snapshot, skip_fit=not any(par in self.wcs for par,val in remaining))
+        elif '--setParameters' not in other: # Set all starting points to 0 unless the user specifies otherwise (or we start from a best fit)
             other.append('--setParameters')
             other.append(','.join(['{}=0'.format(wc) for wc in scan_params+params_tracked]))
         if other:             args.extend(other)
@@ -405,21 +431,28 @@ class EFTFit(object):
             params += mask
             args.extend(['--setParameters',','.join(masks)])
 
-        point_scale = 8#hrs
-        wall_time  = 8#hrs
-        if not freeze: wall_time /= 2 # profiled scans take longer, so submit less points per job
-        if batch=='crab':      args.extend(['--job-mode','crab3','--task-name',name.replace('.',''),'--custom-crab','custom_crab.py','--split-points',str(int(round(wall_time*point_scale)))])
-        if batch=='condor' and freeze==False and points>3000: args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--split-points','3000','--dry-run'])
-        elif batch=='condor' and freeze==False: args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--split-points','10','--dry-run'])
-        elif batch=='condor':          args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--split-points','10','--dry-run'])
+        if batch in ['crab','condor']:
+            split_points = self.getSplitPoints(batch, points, freeze, split_points)
+            # Recorded so resubmitMissingPoints checks the coverage against the same blocks
+            save_layout('../fit_files/higgsCombine'+name+'.MultiDimFit.root', points, split_points)
+        if batch=='crab':      args.extend(['--job-mode','crab3','--task-name',name.replace('.',''),'--custom-crab','custom_crab.py','--split-points',str(split_points)])
+        if batch=='condor':
+            args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--split-points',str(split_points),'--dry-run'])
         logging.info(' '.join(args))
 
+        if batch=='local':
+            # Run the --firstPoint/--lastPoint blocks on this machine with combine directly, and merge them
+            local_args = ['combine'] + args[1:]
+            if '-n' in local_args:
+                idx = local_args.index('-n')
+                del local_args[idx:idx+2]
+            failed = run_local_scan(local_args,name,points,'../fit_files/higgsCombine'+name+'.MultiDimFit.root',split_points=split_points,nworkers=nworkers,log_dir='logs{}'.format(name))
+            if failed: logging.error("{} blocks of {} failed, see logs{}/".format(len(failed),name,name))
+            logging.info("Done with local gridScan.")
+            return
+
         # Run the combineTool.py command
-        process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-        with process.stdout,process.stderr:
-            self.log_subprocess_output(process.stdout,'info')
-            self.log_subprocess_output(process.stderr,'err')
-        process.wait()
+        run_command(args,stderr_level=logging.ERROR,check=False)
 
         # Condor needs executable permissions on the .sh file, so we used --dry-run
         # Add the permission and complete the submission.
@@ -429,17 +462,15 @@ class EFTFit(object):
                 logging.error("Aborting submission.")
                 #return
             sp.call(['mkdir','condor{}'.format(name)])
+            if point_ranges is not None:
+                self.filterCondorScan(name,point_ranges)
             sp.call(['chmod','a+x','condor_{}.sh'.format(name.replace('.',''))])
             sp.call(['sed','-i','s/ulimit.*/&\\nunset PERL5LIB/','condor_{}.sh'.format(name.replace('.',''))])
             sp.call(['sed','-i','/arguments/d','condor_{}.sub'.format(name.replace('.',''))])
             sp.call(['sed','-i','s/queue/\\n\\nrequestMemory=10000\\n+JobFlavour = "workday"\\n\\nqueue/','condor_{}.sub'.format(name.replace('.',''))]) # Ask for at least 3GB of RAM
             sp.call(['sed','-i','s/executable = \(.*\)/executable = \/afs\/crc.nd.edu\/user\/b\/byates2\/CMSSW_10_2_13\/src\/EFTFit\/Fitter\/test\/cmssw.sh\\narguments = \/afs\/crc.nd.edu\/user\/b\/byates2\/CMSSW_10_2_13\/src\/EFTFit\/Fitter\/test\/\\1 $(ProcId)/','condor_{}.sub'.format(name.replace('.',''))])
             logging.info('Now submitting condor jobs.')
-            condorsub = sp.Popen(['condor_submit','-append','initialdir=condor{}'.format(name),'condor_{}.sub'.format(name.replace('.',''))], stdout=sp.PIPE, stderr=sp.PIPE)
-            with condorsub.stdout,condorsub.stderr:
-                self.log_subprocess_output(condorsub.stdout,'info')
-                self.log_subprocess_output(condorsub.stderr,'err')
-            condorsub.wait()
+            run_command(['condor_submit','-append','initialdir=condor{}'.format(name),'condor_{}.sub'.format(name.replace('.',''))],stderr_level=logging.ERROR,check=False)
             
         if batch: logging.info("Done with gridScan batch submission.")
             
@@ -447,35 +478,85 @@ class EFTFit(object):
             sp.call(['mv','higgsCombine'+name+'.MultiDimFit.mH120.root','../fit_files/higgsCombine'+name+'.MultiDimFit.root'])
             logging.info("Done with gridScan.")
 
+    def filterCondorScan(self, name, point_ranges):
+        ### Keep only the jobs of a condor gridScan (made with --dry-run) which cover the requested point ranges ###
+        # The jobs are renumbered, and the queue statement of the .sub file is updated to match
+        script = 'condor_{}.sh'.format(name.replace('.',''))
+        subfile = 'condor_{}.sub'.format(name.replace('.',''))
+        with open(script) as f:
+            text = f.read()
+        keep = set(tuple(r) for r in point_ranges)
+        jobs = re.findall(r'\nif \[ \$1 -eq \d+ \]; then\n(.*?)\nfi',text,re.DOTALL)
+        header = text[:text.index('\nif [ $1 -eq')]
+        selected = []
+        for job in jobs:
+            m = POINTS_RGX.search(job)
+            if m is not None and (int(m.group(1)),int(m.group(2))) in keep:
+                selected.append(job)
+        logging.info("Keeping {}/{} condor jobs for {}".format(len(selected),len(jobs),name))
+        with open(script,'w') as f:
+            f.write(header)
+            for idx,job in enumerate(selected):
+                f.write('\nif [ $1 -eq {} ]; then\n{}\nfi'.format(idx,job))
+            f.write('\n')
+        with open(subfile) as f:
+            sub = f.read()
+        with open(subfile,'w') as f:
+            f.write(re.sub(r'(?m)^queue.*$','queue {}'.format(len(selected)),sub))
+
+    def getSplitPoints(self, batch, points, freeze, split_points=None):
+        ### Number of points per job of a gridScan submitted to crab or condor ###
+        if split_points: return split_points
+        if batch=='crab':
+            point_scale = 8#hrs
+            wall_time  = 8#hrs
+            if not freeze: wall_time /= 2 # profiled scans take longer, so submit less points per job
+            return int(round(wall_time*point_scale))
+        return 3000 if freeze==False and points>3000 else 10
+
+    def resubmitMissingPoints(self, name='.test', points=None, split_points=None, dry_run=False, **kwargs):
+        ### Resubmit (with condor) only the point ranges of a split gridScan which are missing or truncated ###
+        # Uses the manifest written by retrieveGridScan, so retrieve the finished jobs first
+        # points and split_points default to the ones recorded by gridScan at submission, or else to gridScan's defaults
+        # Any other gridScan options are passed with kwargs
+        fitFile = '../fit_files/higgsCombine'+name+'.MultiDimFit.root'
+        if not os.path.isfile(get_manifest_path(fitFile)):
+            logging.error("No retrieval manifest found for {}! Please run retrieveGridScan first.".format(fitFile))
+            return
+        layout_points,layout_split = load_layout(fitFile)
+        if points is None: points = layout_points or 90000
+        if split_points is None:
+            split_points = layout_split or self.getSplitPoints('condor', points, kwargs.get('freeze', False))
+        index = CoverageIndex.fromManifest(fitFile)
+        index.printSummary(points,split_points)
+        missing = index.getMissing(points,split_points)
+        if not missing:
+            logging.info("All points of {} are covered, nothing to resubmit.".format(name))
+            return
+        if dry_run: return missing
+        self.gridScan(name=name, batch='condor', points=points, split_points=split_points, point_ranges=missing, **kwargs)
+        return missing
+
     def getBestValues2D(self, name, scan_params=[], params_tracked=[]):
         ### Gets values of parameters for grid scan point with best deltaNLL ###
   
-        bestDeltaNLL=1000000;
-        bestEntry=-1;
-
         fitFile = '../fit_files/higgsCombine'+name+'.MultiDimFit.root'
         print fitFile
 
         if not os.path.isfile(fitFile):
             logging.error("fitFile does not exist!")
             sys.exit()
-        rootFile = ROOT.TFile.Open(fitFile);
-        limitTree = rootFile.Get("limit");
 
-        for entry in range(limitTree.GetEntries()):
-            limitTree.GetEntry(entry)
-            if(bestDeltaNLL > limitTree.GetLeaf("deltaNLL").GetValue(0)):
-              bestDeltaNLL = limitTree.GetLeaf("deltaNLL").GetValue(0)
-              bestEntry=entry
-              #cout << Form("Entry %i deltaNLL=%f, ctW=%f ctZ=%f",bestEntry,bestDeltaNLL,limitTree.GetLeaf("ctW").GetValue(0),limitTree.GetLeaf("ctZ").GetValue(0)) << endl;
+        branches = scan_params + ['trackedParam_'+param for param in params_tracked] + ['deltaNLL']
+        arrs = limit_tree.read_limit_tree(fitFile,branches)
+        bestEntry = limit_tree.get_best_entry(arrs)
 
-        limitTree.GetEntry(bestEntry)
         startValues = []
         for param in scan_params:
-            value = limitTree.GetLeaf(param).GetValue(0)
+            value = arrs[param][bestEntry]
             startValues.append('{}={}'.format(param,value))
         for param in params_tracked:
-            value = limitTree.GetLeaf('trackedParam_'+param).GetValue(0)
+            value = arrs['trackedParam_'+param][bestEntry]
             startValues.append('{}={}'.format(param,value))
         return ','.join(startValues)
 
@@ -487,36 +568,26 @@ class EFTFit(object):
         startValues = []
 
         for wc in wcs:
-  
-            bestDeltaNLL=1000000;
-            bestEntry=-1;
-
             fitFile = '../fit_files/higgsCombine{}.{}.MultiDimFit.root'.format(basename,wc)
             logging.info("Obtaining best value from {}".format(fitFile))
 
             if not os.path.isfile(fitFile):
                 logging.error("fitFile does not exist!")
                 sys.exit()
-            rootFile = ROOT.TFile.Open(fitFile);
-            limitTree = rootFile.Get("limit");
-
-            for entry in range(limitTree.GetEntries()):
-                limitTree.GetEntry(entry)
-                if(bestDeltaNLL > limitTree.GetLeaf("deltaNLL").GetValue(0)):
-                  bestDeltaNLL = limitTree.GetLeaf("deltaNLL").GetValue(0)
-                  bestEntry=entry
-                  #cout << Form("Entry %i deltaNLL=%f, ctW=%f ctZ=%f",bestEntry,bestDeltaNLL,limitTree.GetLeaf("ctW").GetValue(0),limitTree.GetLeaf("ctZ").GetValue(0)) << endl;
 
-            limitTree.GetEntry(bestEntry)
+            arrs = limit_tree.read_limit_tree(fitFile,[wc,'deltaNLL'])
+            bestEntry = limit_tree.get_best_entry(arrs)
 
-            value = limitTree.GetLeaf(wc).GetValue(0)
+            value = arrs[wc][bestEntry]
             startValues.append('{}={}'.format(wc,value))
 
         return ','.join(startValues)
 
 
-    def retrieveGridScan(self, name='.test', batch='crab', user='byates'):#getpass.getuser()):
-        ### Retrieves finished grid jobs, extracts, and hadd's into a single file ###
+    def retrieveGridScan(self, name='.test', batch='crab', user='byates', fresh=False):#getpass.getuser()):
+        ### Retrieves finished grid jobs and merges their limit trees into a single file ###
+        # Only the jobs which weren't merged by a previous call are added (see the .manifest.json next to the output)
+        # Use fresh=True to rebuild the output from scratch
         taskname = name.replace('.','')
         logging.info("Retrieving gridScan files. Task name: "+taskname)
 
@@ -534,42 +605,17 @@ class EFTFit(object):
                 logging.error("No files found in store!")
                 sys.exit()
 
-            # Make a temporary folder to hold the extracted root files
-            if not os.path.isdir(taskname+'tmp'):
-                sp.call(['mkdir',taskname+'tmp'])
-            else:
-                logging.error("Directory {}tmp/ already exists! Please rename this directory.".format(taskname))
-                return
+            # Stream the root files out of the tarballs and merge their limit trees (no temporary directory or hadd)
+            tars = [tarfiles[0]+'/'+tarfile for tarfiles in paths for tarfile in tarfiles[2] if tarfile.endswith('.tar')]
+            incremental_merge(tars,'../fit_files/higgsCombine'+name+'.MultiDimFit.root',fresh=fresh)
 
-            # Extract the root files
-            for tarfiles in paths:
-                for tarfile in tarfiles[2]:
-                    if tarfile.endswith('.tar'):
-                        print tarfiles[0]+'/'+tarfile
-                        sp.call(['tar', '-xf', tarfiles[0]+'/'+tarfile,'-C', taskname+'tmp'])
-            haddargs = ['hadd','-f','../fit_files/higgsCombine'+name+'.MultiDimFit.root']+['{}tmp/{}'.format(taskname,rootfile) for rootfile in os.listdir(taskname+'tmp') if rootfile.endswith('.root')]
-            process = sp.Popen(haddargs, stdout=sp.PIPE, stderr=sp.PIPE)
-            with process.stdout,process.stderr:
-                self.log_subprocess_output(process.stdout,'info')
-                self.log_subprocess_output(process.stderr,'err')
-            process.wait()
-
-            # Remove the temporary directory and split root files
-            sp.call(['rm','-r',taskname+'tmp'])
-            
         elif batch=='condor':
             if not glob.glob('higgsCombine{}.POINTS*.root'.format(name)):
-                logging.info("No files to hadd. Returning.")
+                logging.info("No files to merge. Returning.")
                 return
-            #haddargs = ['hadd','-f','higgsCombine'+name+'.MultiDimFit.root']+sorted(glob.glob('higgsCombine{}.POINTS*.root'.format(name)))
-            haddargs = ['hadd','-f','-k','../fit_files/higgsCombine'+name+'.MultiDimFit.root']+sorted(glob.glob('higgsCombine{}.POINTS*.root'.format(name)))
-            print(['hadd','-f','../../fit_files/higgsCombine'+name+'.MultiDimFit.root']+sorted(glob.glob('higgsCombine{}.POINTS*.root'.format(name))))
-            process = sp.Popen(haddargs, stdout=sp.PIPE, stderr=sp.PIPE)
-            with process.stdout,process.stderr:
-                self.log_subprocess_output(process.stdout,'info')
-                self.log_subprocess_output(process.stderr,'err')
-            process.wait()
-            for rootfile in glob.glob('higgsCombine{}.POINTS*.root'.format(name)):
+            # Merge the limit trees directly, only the files that were read successfully are removed
+            merged = incremental_merge(sorted(glob.glob('higgsCombine{}.POINTS*.root'.format(name))),'../fit_files/higgsCombine'+name+'.MultiDimFit.root',fresh=fresh)
+            for rootfile in merged:
                 os.remove(rootfile)
             if os.path.isfile('condor_{}.sh'.format(name.replace('.',''))):
                 os.rename('condor_{}.sh'.format(name.replace('.','')),'condor{0}/condor_{0}.sh'.format(name))
@@ -614,6 +660,8 @@ class EFTFit(object):
             best = ','.join(['{}=0'.format(key) if key != wc else '{}={}'.format(key,limits[wc][sig]) for key,value in limits.items()])
         '''
         if fixed:
+            # No warm start from a best fit snapshot here: the toys have to be thrown at the WC=0 hypothesis, and each
+            #   toy needs its own initial fit as the reference of the fixed point (same rule as ImpactNuisance)
             args.extend(['--setParameters', ','.join(['{}=0'.format(key) for key in self.wcs])]) # Set all WCs to their best fit values
             args.extend(['--floatOtherPOIs', '1'])
             if wc is not None:
@@ -651,11 +699,7 @@ class EFTFit(object):
             args.extend(['--job-mode','crab3','--task-name',name.replace('.',''),'--custom-crab','custom_crab.py'])
             logging.info(' '.join(args))
             # Run the combineTool.py command
-            process = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE)
-            with process.stdout,process.stderr:
-                self.log_subprocess_output(process.stdout,'info')
-                self.log_subprocess_output(process.stderr,'err')
-            process.wait()
+            run_command(args,stderr_level=logging.ERROR,check=False)
         elif batch=='condor':
             args.extend(['--job-mode','condor','--task-name',name.replace('.',''),'--dry-run'])
             logging.info(' '.join(args))
@@ -668,11 +712,7 @@ class EFTFit(object):
             sp.call(['sed','-i','s/queue/\\n\\nrequestMemory=7000\\n\\nqueue/','condor_{}.sub'.format(name.replace('.',''))]) # Ask for at least 3GB of RAM
             sp.call(['sed','-i','s/cd .*EFTFit.*test/cd \/scratch365\/{}\//'.format(getpass.getuser()),'condor_{}.sh'.format(name.replace('.',''))]) # Run in /scratch365/{user}
             logging.info('Now submitting condor jobs.')
-            condorsub = sp.Popen(['condor_submit','-append','initialdir=condor{}'.format(name),'condor_{}.sub'.format(name.replace('.',''))], stdout=sp.PIPE, stderr=sp.PIPE)
-            with condorsub.stdout,condorsub.stderr:
-                self.log_subprocess_output(condorsub.stdout,'info')
-                self.log_subprocess_output(condorsub.stderr,'err')
-            condorsub.wait()
+            run_command(['condor_submit','-append','initialdir=condor{}'.format(name),'condor_{}.sub'.format(name.replace('.',''))],stderr_level=logging.ERROR,check=False)
 
     def submitEFTWilksWC(self, name='.012023.Wilks.NP', wc='ctp', batch='condor', workspace='EFTWorkspace.root'):
         wcs=['cQq81', 'ctq8', 'ctG', 'ctp', 'cpQM', 'cpt'] #TOP-22-00 linear dominant terms
@@ -713,14 +753,10 @@ class EFTFit(object):
 
     def drawEFTWilks(self, name, best_fit, alt_fit, nll_fit=0, dof=1, asimov=False):
         if not glob.glob('higgsCombine{}.GoodnessOfFit.mH120*.root'.format(name)):
-            logging.info("No files to hadd. Returning.")
+            logging.info("No files to merge. Returning.")
         elif not os.path.exists('../fit_files/higgsCombine'+name+'.GoodnessOfFit.root'):
             haddargs = ['hadd','-f','-k','../fit_files/higgsCombine'+name+'.GoodnessOfFit.root']+sorted(glob.glob('higgsCombine{}.GoodnessOfFit.mH120*.root'.format(name)))
-            process = sp.Popen(haddargs, stdout=sp.PIPE, stderr=sp.PIPE)
-            with process.stdout,process.stderr:
-                self.log_subprocess_output(process.stdout,'info')
-                self.log_subprocess_output(process.stderr,'err')
-            process.wait()
+            run_command(haddargs,stderr_level=logging.ERROR,check=False)
         fin = '../fit_files/higgsCombine{}.GoodnessOfFit.root'.format(name)
         with uproot.open(fin) as limit_tree:
             print('Opening {}'.format(fin))
@@ -819,6 +855,152 @@ class EFTFit(object):
             mask = []
             self.gridScan('{}.{}'.format(basename,wc), batch, freeze, [wc], [wcs for wcs in self.wcs if wcs != wc], points, ['--setParameterRanges {}={},{}'.format(wc,wc_ranges[wc][0],wc_ranges[wc][1])]+zero_ignore+freeze_ignore+other+['--setParameters', params+','+masks], mask, mask_syst, workspace)
 
+    def refine1DScanEFT(self, basename='.test', batch='', freeze=False, scan_wcs=[], points=20, levels=[1,4], nll_max=4, min_width=0., other=[], workspace='EFTWorkspace.root', wc_val=None, wc_ranges=None, refine_pass=1):
+        ### Adaptive 1D scans: submit extra points only around the 2deltaNLL=levels crossings and the local minima of an existing scan ###
+        # Start with a coarse batch1DScanEFT (e.g. 30 points), then call this once per refinement pass
+        # Each region gets 'points' new points, which are fitted with combine's --fromfile under the name {basename}.{wc}.pass{refine_pass}
+        # The scan keeps the full WC range of the coarse scan, so its deltaNLL is relative to the same global minimum
+        # Use mergeRefined1DScanEFT to add the finished passes to ../fit_files/higgsCombine{basename}.{wc}.MultiDimFit.root
+        if not scan_wcs:
+            scan_wcs = self.wcs
+        if wc_ranges is None: wc_ranges = self.wc_ranges_njets
+
+        if wc_val is None:
+            params = ','.join(['{}=0'.format(wc) for wc in self.wcs])
+        else:
+            params = ','.join(['{}=0'.format(wc) if wc not in wc_val.keys() else '{}={}'.format(wc, wc_val[wc]) for wc in self.wcs])
+        for wc in scan_wcs:
+            fitFile = '../fit_files/higgsCombine{}.{}.MultiDimFit.root'.format(basename,wc)
+            if not os.path.isfile(fitFile):
+                logging.error("{} does not exist! Run a coarse scan first.".format(fitFile))
+                continue
+            arrs = limit_tree.drop_best_fit_rows(limit_tree.read_limit_tree(fitFile,[wc,'deltaNLL','quantileExpected'],ignore_missing=True))
+            regions = find_refine_regions(arrs[wc],2*arrs['deltaNLL'],levels=levels,nll_max=nll_max,min_width=min_width)
+            if not regions:
+                logging.info("Nothing left to refine for {}".format(wc))
+                continue
+            logging.info("Refining {} in {} regions: {}".format(wc,len(regions),', '.join(['[{:.4f},{:.4f}]'.format(lo,hi) for lo,hi in regions])))
+
+            # The edges of each region are points of the existing scan, so only the points between them are new
+            wc_points = [[v] for lo,hi in regions for v in np.linspace(lo,hi,points+2)[1:-1]]
+            name = '{}.{}.pass{}'.format(basename,wc,refine_pass)
+            pointsFile = os.path.abspath('points{}.txt'.format(name))
+            write_points_file(pointsFile,[wc],wc_points)
+            self.gridScan(name, batch, freeze, [wc], [wcs for wcs in self.wcs if wcs != wc], len(wc_points), ['--setParameterRanges {}={},{}'.format(wc,wc_ranges[wc][0],wc_ranges[wc][1])]+other+['--fromfile',pointsFile,'--setParameters', params], [], [], workspace)
+
+            pending = self.loadPendingRefinements(fitFile)
+            if name not in pending: pending.append(name)
+            self.savePendingRefinements(fitFile,pending)
+
+            # Without a batch system the scans are already done, so merge them right away
+            if not batch: self.mergeRefined1DScanEFT(basename, scan_wcs=[wc])
+
+    def loadPendingRefinements(self, fitFile):
+        if not os.path.isfile(fitFile+'.refine.json'): return []
+        with open(fitFile+'.refine.json') as f:
+            return json.load(f)
+
+    def savePendingRefinements(self, fitFile, pending):
+        with open(fitFile+'.refine.json','w') as f:
+            json.dump(pending,f,indent=1)
+
+    def mergeRefinedScans(self, fitFile, batch=''):
+        ### Merge the finished refinement passes listed in {fitFile}.refine.json into fitFile ###
+        pending = self.loadPendingRefinements(fitFile)
+        if not pending: return
+        if batch:
+            for name in pending:
+                self.retrieveGridScan(name,batch)
+        done = [name for name in pending if os.path.isfile('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name))]
+        if not done:
+            logging.info("No finished refinement passes for {}".format(fitFile))
+            return
+        refineFiles = ['../fit_files/higgsCombine{}.MultiDimFit.root'.format(name) for name in done]
+        # Only the best fit of the main scan is kept, the ones of the refinement scans would show up as extra minima
+        merge_scan_outputs([fitFile]+refineFiles,fitFile,drop_best_fit=refineFiles)
+        for rootfile in refineFiles:
+            os.remove(rootfile)
+            if os.path.isfile(get_manifest_path(rootfile)): os.remove(get_manifest_path(rootfile))
+        self.savePendingRefinements(fitFile,[name for name in pending if name not in done])
+        logging.info("Merged {} refinement scans into {}".format(len(done),fitFile))
+
+    def mergeRefined1DScanEFT(self, basename='.test', batch='', scan_wcs=[]):
+        ### Merge the finished refine1DScanEFT passes into the main 1D scan files ###
+        # With batch set, the passes are retrieved first (see retrieveGridScan)
+        if not scan_wcs:
+            scan_wcs = self.wcs
+
+        for wc in scan_wcs:
+            self.mergeRefinedScans('../fit_files/higgsCombine{}.{}.MultiDimFit.root'.format(basename,wc),batch)
+
+    def refine2DScanEFT(self, name='.EFT.gridScan.ctZctW', wcs=['ctZ','ctW'], batch='', freeze=False, levels=CONTOUR_LEVELS_2D, max_depth=4, other=[], workspace='EFTWorkspace.root', refine_pass=1):
+        ### Adaptive (quadtree) 2D scans: only fit new points in the grid cells which straddle a contour level ###
+        # Start with a coarse gridScan/batch2DScanEFT (e.g. 30x30 points), then call this once per refinement pass
+        # Every pass splits the cells whose corners straddle one of the levels into four, and fits the new points
+        # with combine's --fromfile, under the name {name}.pass{refine_pass}
+        # Use mergeRefined2DScanEFT to add the finished passes to ../fit_files/higgsCombine{name}.MultiDimFit.root
+        fitFile = '../fit_files/higgsCombine{}.MultiDimFit.root'.format(name)
+        if not os.path.isfile(fitFile):
+            logging.error("{} does not exist! Run a coarse scan first.".format(fitFile))
+            return
+        arrs = limit_tree.read_limit_tree(fitFile,wcs+['deltaNLL'])
+
+        # The quadtree is kept next to the scan, so every pass continues from the previous one
+        treeFile = fitFile+'.quadtree.json'
+        if os.path.isfile(treeFile):
+            quadtree = QuadTree2D.load(treeFile)
+        else:
+            quadtree = QuadTree2D.fromGrid(arrs[wcs[0]],arrs[wcs[1]])
+        nsplit,points = quadtree.refine(arrs[wcs[0]],arrs[wcs[1]],2*arrs['deltaNLL'],levels=levels,max_depth=max_depth)
+        quadtree.save(treeFile)
+        logging.info("Split {} cells, {} new points to fit ({} cells in total)".format(nsplit,len(points),len(quadtree.cells)))
+        if not points:
+            logging.info("Nothing left to refine for {}".format(name))
+            return
+
+        passname = '{}.pass{}'.format(name,refine_pass)
+        pointsFile = os.path.abspath('points{}.txt'.format(passname))
+        write_points_file(pointsFile,wcs,points)
+        params = ','.join(['{}=0'.format(wc) for wc in self.wcs])
+        self.gridScan(passname, batch, freeze, list(wcs), [wc for wc in self.wcs if wc not in wcs], len(points), other+['--fromfile',pointsFile,'--setParameters',params], [], [], workspace)
+
+        pending = self.loadPendingRefinements(fitFile)
+        if passname not in pending: pending.append(passname)
+        self.savePendingRefinements(fitFile,pending)
+
+        # Without a batch system the scan is already done, so merge it right away
+        if not batch: self.mergeRefinedScans(fitFile)
+
+    def mergeRefined2DScanEFT(self, name='.EFT.gridScan.ctZctW', batch=''):
+        ### Merge the finished refine2DScanEFT passes into the main 2D scan file ###
+        self.mergeRefinedScans('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name),batch)
+
+    def pathScan(self, name='.test', scan_params=['ctW','ctZ'], points=400, freeze=False, workspace='EFTWorkspace.root', wc_ranges=None, frozen=[], jump_tol=0.5, warm_start=True, compare_to=None):
+        ### Profiled deltaNLL scan in one or two wcs on the local machine, fitting the points along a serpentine path ###
+        # Each point starts from the profiled values of the neighbouring point fitted before it, and the points next to a
+        # jump in deltaNLL are refitted from their other neighbours (see path_scan.py), which avoids most of the
+        # discontinuities DiscontinuityFinder.py looks for. The output has the same format as a gridScan.
+        # The fits use combine's NLL and minimizer, with the settings of gridScan (see COMBINE_MINIMIZER in path_scan.py).
+        # frozen: Other parameters to freeze
+        # jump_tol: Refit neighbouring points whose 2*deltaNLL differ by more than this
+        # warm_start: Start from the matching best fit snapshot (see bestFit), if there is one
+        # compare_to: Name of a gridScan of the same points (same wc_ranges and points) to check the scan against
+        logging.info("Doing path scan...")
+        if wc_ranges is None: wc_ranges = self.wc_ranges_njets
+        CMSSW_BASE = os.getenv('CMSSW_BASE')
+        ws_file = CMSSW_BASE+'/src/EFTFit/Fitter/test/'+workspace
+        floated = self.wcs if not freeze else scan_params
+        snapshot = None
+        if warm_start:
+            snapshot = self.findSnapshot(ws_file, floated, [wc for wc in self.wcs if wc not in floated] + frozen)
+        out_path = '../fit_files/higgsCombine{}.MultiDimFit.root'.format(name)
+        n_improved = run_path_scan(snapshot or ws_file, scan_params, [wc_ranges[wc] for wc in scan_params], points, out_path,
+            tracked=[wc for wc in self.wcs if wc not in scan_params], float_others=not freeze, frozen=frozen,
+            snapshot=SNAPSHOT_NAME if snapshot else None, jump_tol=jump_tol)
+        logging.info("Done with pathScan, {} points were improved by a refit.".format(n_improved))
+        if compare_to:
+            compare_with_grid(out_path, '../fit_files/higgsCombine{}.MultiDimFit.root'.format(compare_to), scan_params)
+
     '''
     example: `fitter.batch2DScanEFT('.test.ctZ', batch='crab', wcs=['ctZ'], workspace='wps_njet_runII.root')`
     example: `fitter.batch2DScanEFT('.test.ctZ', batch='crab', wcs='ctZ', workspace='wps_njet_runII.root')`
@@ -889,11 +1071,7 @@ class EFTFit(object):
             scan_wcs = self.wcs
 
         for wc in scan_wcs:
-            process = sp.Popen(['crab','resubmit','crab_'+basename.replace('.','')+wc], stdout=sp.PIPE, stderr=sp.PIPE)
-            with process.stdout,process.stderr:
-                self.log_subprocess_output(process.stdout,'info')
-                self.log_subprocess_output(process.stderr,'err')
-            process.wait()
+            run_command(['crab','resubmit','crab_'+basename.replace('.','')+wc],stderr_level=logging.ERROR,check=False)
 
     def batchResubmit2DScansEFT(self, basename='.EFT.gridScan', allPairs=False):
         ### For pairs of wcs, attempt to resubmit failed CRAB jobs ###
@@ -903,22 +1081,14 @@ class EFTFit(object):
             scan_wcs = self.wcs
 
             for wcs in itertools.combinations(scan_wcs,2):
-                process = sp.Popen(['crab','resubmit','crab_'+basename.replace('.','')+wcs[0]+wcs[1]], stdout=sp.PIPE, stderr=sp.PIPE)
-                with process.stdout,process.stderr:
-                    self.log_subprocess_output(process.stdout,'info')
-                    self.log_subprocess_output(process.stderr,'err')
-                process.wait()
+                run_command(['crab','resubmit','crab_'+basename.replace('.','')+wcs[0]+wcs[1]],stderr_level=logging.ERROR,check=False)
 
         # Use each wc only once
         if not allPairs:
             scan_wcs = [('cQlMi','cQei'),('cpQ3','cbW'),('cptb','cQl3i'),('ctG','cpQM'),('ctZ','ctW'),('ctei','ctlTi'),('ctlSi','ctli'),('ctp','cpt')]
 
             for wcs in scan_wcs:
-                process = sp.Popen(['crab','resubmit','crab_'+basename.replace('.','')+wcs[0]+wcs[1]], stdout=sp.PIPE, stderr=sp.PIPE)
-                with process.stdout,process.stderr:
-                    self.log_subprocess_output(process.stdout,'info')
-                    self.log_subprocess_output(process.stderr,'err')
-                process.wait()
+                run_command(['crab','resubmit','crab_'+basename.replace('.','')+wcs[0]+wcs[1]],stderr_level=logging.ERROR,check=False)
 
     def batchRetrieve1DScansEFT(self, basename='.test', batch='crab', scan_wcs=[]):
         ### For each wc, retrieves finished 1D deltaNLL grid jobs, extracts, and hadd's into a single file ###
@@ -955,118 +1125,57 @@ class EFTFit(object):
                 print '{}.{}{}'.format(basename,wcs[0],wcs[1]), batch
                 self.retrieveGridScan('{}.{}{}'.format(basename,wcs[0],wcs[1]),batch)
                 
-    def reductionFitEFT(self, name='.EFT.Private.Unblinded.Nov16.28redo.Float.cptcpQM', wc='cpt', final=True, from_wcs=[], alreadyRun=True):
+    def reductionFitEFT(self, name='.EFT.Private.Unblinded.Nov16.28redo.Float.cptcpQM', wc='cpt', final=True, from_wcs=[], alreadyRun=True, keep=[], step_size=1000000):
         ### Extract a 1D scan from a higher-dimension scan to avoid discontinuities ###
+        ### The limit tree is streamed in blocks of step_size entries, see scan_reduction.py ###
+        ### keep: Other branches (e.g. 'trackedParam_*') to store for the best entry at each WC value ###
         if not wc:
             logging.error("No WC specified!")
             return
-        if final and not alreadyRun:
-            os.system('hadd -f higgsCombine{}.MultiDimFit.mH120.root higgsCombine{}.POINTS*.{}reduced.MultiDimFit.root '.format(name,name,''.join(from_wcs)))
-        if alreadyRun and not os.path.exists('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name)):
-            logging.error("File higgsCombine{}.MultiDimFit.root does not exist!".format(name))
-            return
-        elif not alreadyRun and not os.path.exists('higgsCombine{}.MultiDimFit.mH120.root'.format(name)):
-            logging.error("File higgsCombine{}.MultiDimFit.root does not exist!".format(name))
-            return
-
-        rootFile = []
         if alreadyRun:
-            rootFile = ROOT.TFile.Open('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name))
-        else: rootFile = ROOT.TFile.Open('higgsCombine{}.MultiDimFit.mH120.root'.format(name))
-        limitTree = rootFile.Get('limit')
+            inputs = ['../fit_files/higgsCombine{}.MultiDimFit.root'.format(name)]
+        else:
+            # Partial reductions (e.g. from batchReductionFitEFT) can be reduced again directly, without the hadd
+            inputs = sorted(glob.glob('higgsCombine{}.POINTS*.{}reduced.MultiDimFit.root'.format(name,''.join(from_wcs)))) if final else []
+            if not inputs: inputs = ['higgsCombine{}.MultiDimFit.mH120.root'.format(name)]
+        for fpath in inputs:
+            if not os.path.exists(fpath):
+                logging.error("File {} does not exist!".format(fpath))
+                return
 
-        # First loop through entries and get deltaNLL list for each value of the WC
-        wc_dict = defaultdict(list)
-        for entry in range(limitTree.GetEntries()):
-            limitTree.GetEntry(entry)
-            wc_dict[limitTree.GetLeaf(wc).GetValue(0)].append(limitTree.GetLeaf('deltaNLL').GetValue(0))
-        rootFile.Close()
-        
-        # Next pick the best deltaNLL for each WC value
-        wc_dict_reduced = {}
-        for key in wc_dict:
-            wc_dict_reduced[key] = min(wc_dict[key])
-            
-        # Now make a new .root file with the new TTree
-        # Only the WC and deltaNLL will be branches
-        # These can be directly used by EFTPlotter
-        outFile = []
+        # Only the WC and deltaNLL (plus any kept branches) are written, these can be directly used by EFTPlotter
         if final:
-            outFile = ROOT.TFile.Open('../fit_files/higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,wc),'RECREATE')
+            outFile = '../fit_files/higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,wc)
         else:
-            outFile = ROOT.TFile.Open('higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,wc),'RECREATE')
-        outTree = ROOT.TTree('limit','limit')
-        
-        wc_branch = array.array('f',[0.])
-        deltaNLL_branch = array.array('f',[0.])
-        outTree.Branch(wc,wc_branch,wc+'/F')
-        outTree.Branch('deltaNLL',deltaNLL_branch,'deltaNLL/F')
-        
-        # Fill the branches
-        for event in range(len(wc_dict_reduced.keys())):
-            wc_branch[0] = wc_dict_reduced.keys()[event]
-            deltaNLL_branch[0] = wc_dict_reduced.values()[event]
-            outTree.Fill()
-            
-        # Write the file
-        outFile.Write()
+            outFile = 'higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,wc)
+        reduce_limit_trees(inputs,[wc],outFile,keep=keep,step_size=step_size)
 
-    def reduction2DFitEFT(self, name='.EFT.Private.Unblinded.Nov16.28redo.Float.cptcpQM', wcs=['cpt','ctp'], final=True):
+    def reduction2DFitEFT(self, name='.EFT.Private.Unblinded.Nov16.28redo.Float.cptcpQM', wcs=['cpt','ctp'], final=True, keep=[], step_size=1000000):
         ### Extract a 2D scan from a higher-dimension scan to avoid discontinuities ###
+        ### The limit tree is streamed in blocks of step_size entries, so the full scan can be reduced in one go ###
         if not wcs:
             logging.error("No WC specified!")
             return
+        inputs = []
         if final:
-            os.system('hadd -f higgsCombine{}.MultiDimFit.mH120.root higgsCombine{}.POINTS*.{}reduced.MultiDimFit.root '.format(name,name,''.join(wcs)))
-        if not os.path.exists('higgsCombine{}.MultiDimFit.mH120.root'.format(name)):
-        #if not os.path.exists('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name)):
-            logging.error("File higgsCombine{}.MultiDimFit.root does not exist!".format(name))
-            return
-
-        rootFile = []
-        rootFile = ROOT.TFile.Open('higgsCombine{}.MultiDimFit.mH120.root'.format(name))
-        #rootFile = ROOT.TFile.Open('../fit_files/higgsCombine{}.MultiDimFit.root'.format(name))
-        limitTree = rootFile.Get('limit')
+            # Partial reductions (e.g. from batchReductionFitEFT) can be reduced again directly, without the hadd
+            inputs = sorted(glob.glob('higgsCombine{}.POINTS*.{}reduced.MultiDimFit.root'.format(name,''.join(wcs))))
+        if not inputs:
+            inputs = ['higgsCombine{}.MultiDimFit.mH120.root'.format(name)]
+        for fpath in inputs:
+            if not os.path.exists(fpath):
+                logging.error("File {} does not exist!".format(fpath))
+                return
 
-        # First loop through entries and get deltaNLL list for each value of the WC
-        wc_dict = defaultdict(list)
-        for entry in range(limitTree.GetEntries()):
-            limitTree.GetEntry(entry)
-            wc_dict[limitTree.GetLeaf(wcs[0]).GetValue(0),limitTree.GetLeaf(wcs[1]).GetValue(0)].append(limitTree.GetLeaf('deltaNLL').GetValue(0))
-        rootFile.Close()
-        
-        # Next pick the best deltaNLL for each WC value
-        wc_dict_reduced = {}
-        for key in wc_dict:
-            wc_dict_reduced[key] = min(wc_dict[key])
-            
-        # Now make a new .root file with the new TTree
-        # Only the WC and deltaNLL will be branches
-        # These can be directly used by EFTPlotter
-        outFile = []
+        # Only the WCs and deltaNLL (plus any kept branches) are written, these can be directly used by EFTPlotter
         if final:
-            outFile = ROOT.TFile.Open('../fit_files/higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,''.join(wcs)),'RECREATE')
+            outFile = '../fit_files/higgsCombine{}.{}reduced.MultiDimFit.root'.format(name,''.join(wcs))
         else:
-            outFile = ROOT.TFile.Open('higgsCombine{}.{}{}reduced.MultiDimFit.root'.format(name,wcs[0],wcs[1]),'RECREATE')
-        outTree = ROOT.TTree('limit','limit')
-        
-        wc_branch1 = array.array('f',[0.])
-        wc_branch2 = array.array('f',[0.])
-        deltaNLL_branch = array.array('f',[0.])
-        outTree.Branch(wcs[0],wc_branch1,wcs[0]+'/F')
-        outTree.Branch(wcs[1],wc_branch2,wcs[1]+'/F')
-        outTree.Branch('deltaNLL',deltaNLL_branch,'deltaNLL/F')
-        
-        # Fill the branches
-        for wc1,wc2 in wc_dict_reduced:
-            wc_branch1[0] = wc1
-            wc_branch2[0] = wc2
-            deltaNLL_branch[0] = wc_dict_reduced[(wc1,wc2)]
-            outTree.Fill()
-            
-        # Write the file
-        outFile.Write()
+            outFile = 'higgsCombine{}.{}{}reduced.MultiDimFit.root'.format(name,wcs[0],wcs[1])
+        reduce_limit_trees(inputs,wcs[:2],outFile,keep=keep,step_size=step_size)
 
+    # Splitting the reduction over condor jobs is no longer needed for memory, since reductionFitEFT and
+    #   reduction2DFitEFT stream the limit tree, but it's kept for spreading very large scans over several nodes
     def batchReductionFitEFT(self, name='.EFT.Private.Unblinded.Nov16.28redo.Float.cptcpQM', wc=['cpt'], points=27000000, split=30000):
         JOB_PREFIX = """#!/bin/sh
         ulimit -s unlimited
@@ -1198,31 +1307,26 @@ class EFTFit(object):
 
     def compareFitsEFT(self,basename='.EFT.SM.Float'):
         ### Compare results of different 1D EFT scans ###
-        tfiles = {}
         limits = {}
         bestFits = {} # Nested dict; bestFit of key1 according to key2
         # First get all scan files
         for wc in self.wcs:
-            tfiles[wc] = ROOT.TFile.Open('../fit_files/higgsCombine{}.MultiDimFit.root'.format(basename+'.'+wc))
-            limits[wc] = tfiles[wc].Get('limit')
+            trackedwcs = [x for x in self.wcs if x != wc]
+            branches = [wc,'deltaNLL'] + ['trackedParam_'+x for x in trackedwcs]
+            limits[wc] = limit_tree.read_limit_tree('../fit_files/higgsCombine{}.MultiDimFit.root'.format(basename+'.'+wc),branches)
             bestFits[wc] = {}
         # Get best fits
         for poiwc in self.wcs:
             limit = limits[poiwc]
             # First get POI best fit
-            bestNLL = (-1,1000000)
-            for entry in range(limit.GetEntries()):
-                limit.GetEntry(entry)
-                currentNLL = limit.GetLeaf('deltaNLL').GetValue(0)
-                if bestNLL[1] > currentNLL: bestNLL = (entry,currentNLL)
-            print "Best entry for {} is {}.".format(poiwc,bestNLL[0])
-            limit.GetEntry(bestNLL[0])
-            bestFits[poiwc][poiwc] = limit.GetLeaf(poiwc).GetValue(0)
+            bestEntry = limit_tree.get_best_entry(limit)
+            print "Best entry for {} is {}.".format(poiwc,bestEntry)
+            bestFits[poiwc][poiwc] = limit[poiwc][bestEntry]
             # Second get corresponding fits for the other wcs
             trackedwcs = list(self.wcs)
             trackedwcs.remove(poiwc)
             for trackedwc in trackedwcs:
-                bestFits[trackedwc][poiwc] = limit.GetLeaf('trackedParam_'+wc).GetValue(0)
+                bestFits[trackedwc][poiwc] = limit['trackedParam_'+trackedwc][bestEntry]
 
         # Print full set of results
         for poiwc in self.wcs:
@@ -1427,7 +1531,7 @@ class EFTFit(object):
             os.system('condor_submit %s -batch-name %s_initial' % (target, wc))
             os.system('cd ../')
 
-    def ImpactNuisance(self, workspace='ptz-lj0pt_fullR2_anatest25v01_withAutostats_withSys.root', wcs=[], unblind=False, version=''):
+    def ImpactNuisance(self, workspace='ptz-lj0pt_fullR2_anatest25v01_withAutostats_withSys.root', wcs=[], unblind=False, version='', warm_start=True):
         if not os.path.exists('asimov'):
             os.mkdir('asimov')
             os.system('ln -s {} asimov/'.format(workspace))
@@ -1446,6 +1550,13 @@ class EFTFit(object):
             print 'Submitting', wc
             if unblind:
                 print('Running over ACTUAL DATA!');
+            # When fitting the data, start the fits from the matching best fit snapshot (see bestFit), if there is one
+            #   (the Asimov dataset is generated from the starting point, so the Asimov fits always start from 0)
+            snapshot = None
+            if unblind and warm_start:
+                frozen = [w for w in wcs if w != wc]
+                snapshot = self.findSnapshot(workspace, [w for w in self.wcs if w not in frozen], frozen)
+            fit_input = '%s --snapshotName %s' % (os.path.abspath(snapshot), SNAPSHOT_NAME) if snapshot else '%s --setParameters %s' % (workspace, wcs_start)
             target = 'condor_%s_fit.sh' % wc
             condorFile = open(target,'w')
             condorFile.write('#!/bin/sh\n')
@@ -1461,7 +1572,7 @@ class EFTFit(object):
                 condorFile.write('if [ $1 -eq {} ]; then\n'.format(i))
                 freeze = ','.join([w for w in wcs if w != wc])# + [n for n in self.systematics if n!= np])
                 #condorFile.write('  combineTool.py -M Impacts -n %s --doFits --redefineSignalPOIs %s --floatOtherPOIs 0 --saveInactivePOI 1 --robustFit 1 --setParameters ctW=0,ctZ=0,ctp=0,cpQM=0,ctG,=0,cbW=0,cpQ3=0,cptb=0,cpt=0,cQl3i=0,cQlMi=0,cQei=0,ctli=0,ctei=0,ctlSi=0,ctlTi=0,cQq13=0,cQq83=0,cQq11=0,ctq1=0,cQq81=0,ctq8=0,ctt1=0,cQQ1=0,cQt8=0,cQt1=0 --freezeParameters %s --setParameterRanges ctW=-4,4:ctZ=-5,5:cpt=-40,30:ctp=-35,65:ctli=-10,10:ctlSi=-10,10:cQl3i=-10,10:cptb=-20,20:ctG=-2,2:cpQM=-10,30:ctlTi=-2,2:ctei=-10,10:cQei=-10,10:cQlMi=-10,10:cpQ3=-15,10:cbW=-5,5:cQq13=-1,1:cQq83=-2,2:cQq11=-2,2:ctq1=-2,2:cQq81=-5,5:ctq8=-5,5:ctt1=-5,5:cQQ1=-10,10:cQt8=-20,20:cQt1=-10,10 -m 1 -d %s' % (wc, wc, freeze, workspace))
-                condorFile.write('combine -M MultiDimFit -n _paramFit_%s_%s%s --algo impact --redefineSignalPOIs %s -P %s --floatOtherPOIs 1 --saveInactivePOI 1 --robustFit 1 --freezeParameters %s --setParameterRanges %s -m 1 -d %s --setParameters %s' % (wc, np, version, wc, np, freeze, ranges, workspace, wcs_start))
+                condorFile.write('combine -M MultiDimFit -n _paramFit_%s_%s%s --algo impact --redefineSignalPOIs %s -P %s --floatOtherPOIs 1 --saveInactivePOI 1 --robustFit 1 --freezeParameters %s --setParameterRanges %s -m 1 -d %s' % (wc, np, version, wc, np, freeze, ranges, fit_input))
                 #condorFile.write('combine -M MultiDimFit -n _paramFit_%s_%s --algo impact --redefineSignalPOIs %s -P %s --floatOtherPOIs 1 --saveInactivePOI 1 --robustFit 1 --freezeParameters %s --setParameterRanges %s -m 1 -d %s --setParameters ctW=0,ctZ=0,ctp=0,cpQM=0,ctG,=0,cbW=0,cpQ3=0,cptb=0,cpt=0,cQl3i=0,cQlMi=0,cQei=0,ctli=0,ctei=0,ctlSi=0,ctlTi=0,cQq13=0,cQq83=0,cQq11=0,ctq1=0,cQq81=0,ctq8=0,ctt1=0,cQQ1=0,cQt8=0,cQt1=0' % (wc, np, wc, np, freeze, ranges, workspace))
                 #condorFile.write('  combineTool.py -M Impacts -n paramFit_%s_%s --doFits --redefineSignalPOIs %s --floatOtherPOIs 0 --saveInactivePOI 1 --robustFit 1 --setParameters ctW=0,ctZ=0,ctp=0,cpQM=0,ctG,=0,cbW=0,cpQ3=0,cptb=0,cpt=0,cQl3i=0,cQlMi=0,cQei=0,ctli=0,ctei=0,ctlSi=0,ctlTi=0,cQq13=0,cQq83=0,cQq11=0,ctq1=0,cQq81=0,ctq8=0,ctt1=0,cQQ1=0,cQt8=0,cQt1=0 --freezeParameters %s --setParameterRanges ctW=-4,4:ctZ=-5,5:cpt=-40,30:ctp=-35,65:ctli=-10,10:ctlSi=-10,10:cQl3i=-10,10:cptb=-20,20:ctG=-2,2:cpQM=-10,30:ctlTi=-2,2:ctei=-10,10:cQei=-10,10:cQlMi=-10,10:cpQ3=-15,10:cbW=-5,5:cQq13=-1,1:cQq83=-2,2:cQq11=-2,2:ctq1=-2,2:cQq81=-5,5:ctq8=-5,5:ctt1=-5,5:cQQ1=-10,10:cQt8=-20,20:cQt1=-10,10 -m 1 -d %s' % (wc, np, wc, freeze, workspace))
                 #condorFile.write('  combine -M MultiDimFit -n _paramFit_%s_%s --algo impact --redefineSignalPOIs %s -P %s --floatOtherPOIs 1 --saveInactivePOI 1 --robustFit 1 --setParameters ctW=0,ctZ=0,ctp=0,cpQM=0,%s=0,cbW=0,cpQ3=0,cptb=0,cpt=0,cQl3i=0,cQlMi=0,cQei=0,ctli=0,ctei=0,ctlSi=0,ctlTi=0,cQq13=0,cQq83=0,cQq11=0,ctq1=0,cQq81=0,ctq8=0,ctt1=0,cQQ1=0,cQt8=0,cQt1=0 --freezeParameters ctW,ctZ,cpQM,cbW,cpQ3,cptb,cpt,cQl3i,cQlMi,cQei,ctli,ctei,ctlSi,ctlTi,cQq13,cQq83,cQq11,ctq1,cQq81,ctq8,ctt1,cQQ1,cQt8,cQt1,ctp --setParameterRanges ctW=-4,4:ctZ=-5,5:cpt=-40,30:ctp=-35,65:ctli=-10,10:ctlSi=-10,10:cQl3i=-10,10:cptb=-20,20:%s=-2,2:cpQM=-10,30:ctlTi=-2,2:ctei=-10,10:cQei=-10,10:cQlMi=-10,10:cpQ3=-15,10:cbW=-5,5:cQq13=-1,1:cQq83=-2,2:cQq11=-2,2:ctq1=-2,2:cQq81=-5,5:ctq8=-5,5:ctt1=-5,5:cQQ1=-10,10:cQt8=-20,20:cQt1=-10,10 -m 1 -d %s' % (wc, np, wc, np ,wc, wc, workspace))
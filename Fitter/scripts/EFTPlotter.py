@@ -12,11 +12,15 @@ from scipy.signal import argrelextrema
 import numpy as np
 
 import parse_nll as nlltools
+import EFTFit.Fitter.limit_tree as limit_tree
+from EFTFit.Fitter.scan_cache import ScanCache
 
 class EFTPlot(object):
     def __init__(self,wc_ranges=None):
         self.logger = logging.getLogger(__name__)
         self.ContourHelper = ContourHelper()
+        # Cache of the (wc,deltaNLL) arrays read from the scan files, set to None to always read from the root files
+        self.scan_cache = ScanCache()
 
         self.SMMus = ['mu_ttll','mu_ttlnu','mu_ttH','mu_tllq']
         self.wcs = ['ctW','ctZ','ctp','cpQM','ctG','cbW','cpQ3','cptb','cpt','cQl3i','cQlMi','cQei','ctli','ctei','ctlSi','ctlTi']
@@ -153,36 +157,42 @@ class EFTPlot(object):
 
     # Takes as input the name of a root file (assumed to be in ../fit_files)
     # Retruns [wc vals in the scan, delta nll vals at each point]
-    # Optionally removes duplicate wc points (choosing min nll)
+    # Optionally removes duplicate wc points (choosing min nll), points closer than 'tol' count as duplicates
+    # The arrays are read through self.scan_cache (if set), so replotting doesn't touch the root files
     def GetWCsNLLFromRoot(self,base_name_lst,wc,unique=False,**kwargs):
         dir_path    = kwargs.pop('dir_path','../fit_files')
+        use_cache   = kwargs.pop('use_cache',True)
+        tol         = kwargs.pop('tol',None)     # Tolerance for merging near-duplicate wc points when unique=True
 
         graphwcs = []
         graphnlls = []
+        fpaths = []
         for name in base_name_lst:
-            if not os.path.exists('{}/higgsCombine{}.MultiDimFit.root'.format(dir_path,name)):
+            fpath = '{}/higgsCombine{}.MultiDimFit.root'.format(dir_path,name)
+            if not os.path.exists(fpath):
                 logging.error("File {}/higgsCombine{}.MultiDimFit.root does not exist!".format(dir_path,name))
                 return [graphwcs,graphnlls]
+            fpaths.append(fpath)
 
-            # Get scan tree
-            rootFile = ROOT.TFile.Open('{}/higgsCombine{}.MultiDimFit.root'.format(dir_path,name))
-            limitTree = rootFile.Get('limit')
-
-            # Get coordinates for TGraph
-            for entry in range(limitTree.GetEntries()):
-                limitTree.GetEntry(entry)
-                graphwcs.append(limitTree.GetLeaf(wc).GetValue(0))
-                graphnlls.append(2*limitTree.GetLeaf('deltaNLL').GetValue(0))
-
-            rootFile.Close()
+        # Get coordinates for TGraph
+        if use_cache and self.scan_cache is not None:
+            arrs = self.scan_cache.readMany(fpaths,[wc,'deltaNLL'])
+        else:
+            arrs = limit_tree.read_limit_trees(fpaths,[wc,'deltaNLL'])
+        graphwcs = arrs[wc]
+        graphnlls = 2*arrs['deltaNLL']
 
         # Overwrite the lists with the new lists
         # We should now have unique x values, with y corresponding to the min of the set of different y values for this x point
         if unique:
-            unique_points_dict = nlltools.get_unique_points({"wcvals":graphwcs,"nllvals":graphnlls},scan_var="wcvals",minimize_var="nllvals")
+            unique_points_dict = nlltools.get_unique_points({"wcvals":graphwcs,"nllvals":graphnlls},scan_var="wcvals",minimize_var="nllvals",tol=tol)
             graphwcs = unique_points_dict["wcvals"]
             graphnlls = unique_points_dict["nllvals"]
 
+        # The callers expect plain lists
+        graphwcs = graphwcs.tolist()
+        graphnlls = graphnlls.tolist()
+
         return [graphwcs,graphnlls]
 
 
@@ -1837,11 +1847,8 @@ class EFTPlot(object):
             missing_wc = False
             for basename in basename_lst:
                 logging.debug("Obtaining result of scan: higgsCombine{}.{}.MultiDimFit{}.root".format(basename,param,postfix))
-                fit_file = ROOT.TFile.Open('{}/higgsCombine{}.{}.MultiDimFit{}.root'.format(dir_path,basename,param,postfix))
-                try:
-                    _ = fit_file.Get('limit')
-                    fit_file.Close()
-                except:
+                # Only check that the file is there, the scan itself is read (or taken from the cache) below
+                if not os.path.exists('{}/higgsCombine{}.{}.MultiDimFit{}.root'.format(dir_path,basename,param,postfix)):
                     missing_wc = True
                     if param not in map(itemgetter(0),fit_array):
                         fit_array.append([param,0,[-999 ],[999]])
@@ -4,45 +4,50 @@ import itertools
 import os
 import ROOT
 import sys
+import argparse
+import multiprocessing
 ROOT.gSystem.Load('$CMSSW_BASE/src/EFTFit/Fitter/interface/TH1EFT_h.so')
 
-#Dict that will hold the parameterizations of the cross-sections
-fits = {}
-
-if len(sys.argv) != 2:
-    hist_file = os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/anatest32_MergeLepFl.root'
-    #hist_file = os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/TOP-19-001_unblinded_v1.root'
-else:
-    hist_file = sys.argv[1]
+from EFTFit.Fitter.parameterization import CoefficientTable, write_parameterization
 
 #List of operators to extract parameterizations for
 operators = ['sm']+['ctW','ctp','cpQM','ctG','ctZ','cbW','cpQ3','cptb','cpt','cQl3i','cQlMi','cQei','ctli','ctei','ctlSi','ctlTi']
 #operators = ['sm']+['ctW'] #Debug
 
-#Load file
-print "Loading Root file..."
-readfile = ROOT.TFile.Open(hist_file)
+#Returns the {(op1,op2): coeff} structure constants of a WCFit, for both orderings of each pair
+#   - Reads the names/pairs/coefficients vectors once, instead of a getCoefficient() lookup for each operator pair
+def get_fit_coefficients(fit):
+    names = [str(n) for n in fit.getNames()]
+    coeffs = list(fit.getCoefficients())
+    ret = {}
+    for pair,c in zip(fit.getPairs(),coeffs):
+        ret[(names[pair.first],names[pair.second])] = c
+        ret[(names[pair.second],names[pair.first])] = c
+    return ret
 
-#Crawl through file
-print "Extracting parameterizations..."
-for key in readfile.GetListOfKeys():
-    hist = readfile.Get(key.GetName())
+#Extract the parameterizations from a subset of the histograms in the file
+def extract_fits(job):
+    hist_file,keys = job
+    fits = {}
+    readfile = ROOT.TFile.Open(hist_file)
+    for key in keys:
+        hist = readfile.Get(key)
 
-    #Get categorical information
-    histname = hist.GetName().split('.')
-    category,systematic,process = '','',''
-    if(len(histname)==3): [category,systematic,process] = histname
-    if(len(histname)==2): [category,process] = histname
-    #In case we ever switch to using ttZ,ttW,tZq as process names
-    #process = process.replace('tllq','tZq')
-    #process = process.replace('ttll','ttZ')
-    #process = process.replace('ttlnu','ttW')
+        #Get categorical information
+        histname = hist.GetName().split('.')
+        category,systematic,process = '','',''
+        if(len(histname)==3): [category,systematic,process] = histname
+        if(len(histname)==2): [category,process] = histname
+        #In case we ever switch to using ttZ,ttW,tZq as process names
+        #process = process.replace('tllq','tZq')
+        #process = process.replace('ttll','ttZ')
+        #process = process.replace('ttlnu','ttW')
 
-    #Skip systematic histograms
-    if systematic != '': continue
+        #Skip systematic histograms
+        if systematic != '': continue
 
-    #Only use histograms from WC samples
-    if '16D' in process:
+        #Only use histograms from WC samples
+        if '16D' not in process: continue
         process = process.split('_',1)[0]
 
         #Loop through bins and extract parameterization
@@ -55,34 +60,67 @@ for key in readfile.GetListOfKeys():
             if "4l" in category:
                 category_njet = 'C_{0}_{1}{2}j'.format(category, 'ge' if bin==4 else '', bin)
             fit = hist.GetBinFit(bin)
-            #Debug
-            #if bin==4:
-            #    print category_njet,fit.getCoefficient('sm','sm'),fit.getCoefficient('ctW','sm'),fit.getCoefficient('ctW','ctW')
-            #print category_njet,fit.getCoefficient('sm','sm')
-            names = fit.getNames()
-            if len(names)!=0 and fit.getCoefficient('sm','sm')==0:
+            coeffs = get_fit_coefficients(fit)
+            sm = coeffs.get(('sm','sm'),0.)
+            if len(coeffs)!=0 and sm==0:
                 for op1 in operators:
                     for op2 in operators:
-                        if fit.getCoefficient(op1,op2)!=0:
+                        if coeffs.get((op1,op2),0.)!=0:
                             print "Error! SM yield is 0, but this bin has a nonzero contribution from EFT effects! The parameterization for this bin will be ignored."
                             print "    "+process,category_njet
-                            print "    "+op1,op2," ",round(fit.getCoefficient(op1,op2),8)
-                
-            if len(names)==0 or fit.getCoefficient('sm','sm')==0: continue
-            if (process,category_njet) not in fits.keys(): fits[(process,category_njet)]={}
-#            for pair in itertools.combinations_with_replacement(operators,2):
-#                fits[(process,category_njet)][pair] = round(fit.getCoefficient(pair[0],pair[1])/fit.getCoefficient('sm','sm'),8)
+                            print "    "+op1,op2," ",round(coeffs[(op1,op2)],8)
+
+            if len(coeffs)==0 or sm==0: continue
+            if (process,category_njet) not in fits: fits[(process,category_njet)]={}
             for op1 in operators:
                 for op2 in operators:
-                    #Debug
-                    #if category_njet=='C_2lss_m_ee_2b_ge7j' and op2 == 'sm' and op1 != 'sm': print process,[op1,op2],fit.getCoefficient(op1,op2)
-                    #if category_njet=='C_2lss_m_ee_2b_ge7j' and op2 == 'cbW' and op1 != 'sm': print process,[op1,op2],fit.getCoefficient(op1,op2)
-                    #if category_njet=='C_2lss_m_ee_2b_ge7j' and op2 == 'cbW' and op1 != 'cbW': print process,[op1,op2],fit.getCoefficient(op1,op2)
-                    fits[(process,category_njet)][(op1,op2)] = round(fit.getCoefficient(op1,op2)/fit.getCoefficient('sm','sm'),8)
+                    fits[(process,category_njet)][(op1,op2)] = round(coeffs.get((op1,op2),0.)/sm,8)
+    readfile.Close()
+    return fits
+
+if __name__ == '__main__':
+    default_file = os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/anatest32_MergeLepFl.root'
+    #default_file = os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/TOP-19-001_unblinded_v1.root'
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hist_file", nargs='?', default=default_file, help="root file with the TH1EFT histograms")
+    parser.add_argument("-j", "--nworkers", type=int, default=multiprocessing.cpu_count(), help="number of processes to extract the fits with")
+    args = parser.parse_args()
+
+    #Load file
+    print "Loading Root file..."
+    readfile = ROOT.TFile.Open(args.hist_file)
+    keys = [key.GetName() for key in readfile.GetListOfKeys()]
+    readfile.Close()
+
+    #Shard the histograms across the workers, each worker opens its own copy of the file
+    #   - The shards are contiguous, so merging them in order gives the same result as a serial pass
+    nworkers = max(1,min(args.nworkers,len(keys)))
+    print "Extracting parameterizations from {} histograms with {} workers...".format(len(keys),nworkers)
+    shard_size = max(1,-(-len(keys)//nworkers))
+    jobs = [(args.hist_file,keys[i:i+shard_size]) for i in range(0,len(keys),shard_size)]
+    if nworkers == 1:
+        results = [extract_fits(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes=nworkers)
+        try:
+            results = pool.map(extract_fits,jobs)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    #Dict that will hold the parameterizations of the cross-sections
+    fits = {}
+    for result in results:
+        fits.update(result)
 
-#print fits
-print "Saving numpy file {}...".format("EFT_Parameterization.npy")
-#print "Categories:",[key[1] for key in fits.keys()]
-#print "Processes:",[key[0] for key in fits.keys()]
-#print "Keys:",fits.keys()
-np.save(os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/EFT_Parameterization.npy', fits)
+    #print fits
+    print "Saving numpy file {}...".format("EFT_Parameterization.npy")
+    #print "Categories:",[key[1] for key in fits.keys()]
+    #print "Processes:",[key[0] for key in fits.keys()]
+    #print "Keys:",fits.keys()
+    np.save(os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/EFT_Parameterization.npy', fits)
+    print "Saving binary file {}...".format("EFT_Parameterization.eftp")
+    write_parameterization(os.environ["CMSSW_BASE"]+'/src/EFTFit/Fitter/hist_files/EFT_Parameterization.eftp', CoefficientTable.fromDict(fits))
@@ -264,28 +264,30 @@ def runit(group_directory,dir_name,mode,helper_ops,testing=False,force=False,cop
             frz_up_pois   = ["{poi}={val}".format(poi=k,val=v) for k,v in hi_sm_pois.iteritems()]
             frz_down_pois = ["{poi}={val}".format(poi=k,val=v) for k,v in lo_sm_pois.iteritems()]
             frz_sm_pois   = ["{poi}=1.0".format(poi=k) for k in pois]
-        helper.runCombine(method=CombineMethod.FITDIAGNOSTIC,name='Prefit',minos_arg='all')
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='Postfit')
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='Bestfit',  # Start from Brent's best fit point
+        # None of these fits depend on each other (only on the workspace), so they all run at the same time
+        helper.addStep('Prefit',method=CombineMethod.FITDIAGNOSTIC,minos_arg='all')
+        helper.addStep('Postfit',method=CombineMethod.MULTIDIMFIT)
+        helper.addStep('Bestfit',method=CombineMethod.MULTIDIMFIT,  # Start from Brent's best fit point
             parameter_values=frz_nom_pois,
             algo=FitAlgo.NONE
         )
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='FreezeNom',
+        helper.addStep('FreezeNom',method=CombineMethod.MULTIDIMFIT,
             parameter_values=frz_nom_pois,
             freeze_parameters=pois
         )
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='FreezeUp',
+        helper.addStep('FreezeUp',method=CombineMethod.MULTIDIMFIT,
             parameter_values=frz_up_pois,
             freeze_parameters=pois
         )
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='FreezeDown',
+        helper.addStep('FreezeDown',method=CombineMethod.MULTIDIMFIT,
             parameter_values=frz_down_pois,
             freeze_parameters=pois
         )
-        helper.runCombine(method=CombineMethod.MULTIDIMFIT,name='NuisOnly',
+        helper.addStep('NuisOnly',method=CombineMethod.MULTIDIMFIT,
             parameter_values=frz_sm_pois,
             freeze_parameters=pois
         )
+        helper.runSteps(nworkers=helper.ops.getOption('step_workers'))
 
     # NOTE1: For the batch submission methods, the main thread won't be locked!
     # NOTE2: When using batch submission, the non-scanned PoIs are automatically added to tracked list
@@ -0,0 +1,17 @@
+import argparse
+import os
+
+from EFTFit.Fitter.parameterization import convert_npy
+
+# Convert a pickled .npy WC parameterization (from older FitConversionEFT.py runs) to the binary .eftp format
+#   e.g. python convert_parameterization.py ../hist_files/EFT_Parameterization.npy
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input", help="pickled .npy parameterization file")
+parser.add_argument("-o", "--output", default=None, help="path of the .eftp output, defaults to the input with the extension replaced")
+parser.add_argument("--operator", default=None, help="for 1D parameterizations ({operator: {procbin: (a0,a1,a2)}}), the operator to convert")
+args = parser.parse_args()
+
+out_path = args.output or os.path.splitext(args.input)[0] + '.eftp'
+table = convert_npy(args.input,out_path,operator=args.operator)
+print "Wrote {} proc+bins x {} terms to {}".format(len(table.procbins),len(table.terms),out_path)
@@ -0,0 +1,17 @@
+import argparse
+import logging
+
+from EFTFit.Fitter.scan_merger import merge_scan_outputs, MergeFormat
+
+# Merge the limit trees of split combine jobs (root files and/or crab tarballs) without hadd
+#   e.g. python merge_scan.py -o higgsCombine.test.MultiDimFit.root crab_output/*.tar
+
+parser = argparse.ArgumentParser()
+parser.add_argument("inputs", nargs='+', help="root files and/or tarballs to merge")
+parser.add_argument("-o", "--output", required=True, help="path of the merged output")
+parser.add_argument("--format", default=MergeFormat.ROOT, choices=[MergeFormat.ROOT,MergeFormat.NPZ], help="write a single root file or a set of .npz chunks")
+parser.add_argument("--pattern", default="*.root", help="only merge the tar members matching this pattern")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+merge_scan_outputs(args.inputs,args.output,fmt=args.format,member_pattern=args.pattern)
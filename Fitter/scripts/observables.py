@@ -5,6 +5,8 @@ import sys
 from collections import OrderedDict
 import optparse
 
+from EFTFit.Fitter.parameterization import load_parameterization
+
 usage = 'usage: %prog [options]'
 parser = optparse.OptionParser(usage)
 parser.add_option('-j', '--json',        dest='json'  ,      help='json with list of files',        default='/afs/crc.nd.edu/user/b/byates2/CMSSW_8_1_0/src/EFTFit/Fitter/test/wc.json',              type='string')
@@ -16,9 +18,9 @@ jsonFile = open(opt.json,'r')
 wcs=json.load(jsonFile,encoding='utf-8',object_pairs_hook=OrderedDict)#.items()
 jsonFile.close()
 
-fits = np.load('../hist_files/EFT_Parameterization.npy')[()]
+fits = load_parameterization('../hist_files/EFT_Parameterization.eftp')
 bins = []
-for procbin in fits:
+for procbin in fits.procbins:
     name = 'r_{0}_{1}'.format(procbin[0],procbin[1])
     bins.append((procbin[1],procbin[0]))
 bins.sort()
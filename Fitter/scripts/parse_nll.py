@@ -3,6 +3,8 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 
+import EFTFit.Fitter.limit_tree as limit_tree
+
 # This script has some tools for looking at the best fit point from a set of grid scans
 
 #POI_LST = ['cQq13', 'cQq83', 'cQq11', 'ctq1', 'cQq81', 'ctq8', 'ctt1', 'cQQ1', 'cQt8', 'cQt1', 'ctW','ctZ','ctp','cpQM','ctG','cbW','cpQ3','cptb','cpt','cQl3i','cQlMi','cQei','ctli','ctei','ctlSi','ctlTi']
@@ -66,24 +68,11 @@ def find_root_file_path(base_name,wc):
 # Get the values of params from the root file
 def get_vals_from_root_file(root_file_path,branches_to_get,srip_poi_branch_names=False):
 
-    # Get scan tree
-    ROOT.gROOT.SetBatch(True)
-    rootFile = ROOT.TFile.Open(root_file_path)
-    limitTree = rootFile.Get('limit')
-
-    # Get coordinates for TGraph
+    # Read the requested branches column-wise, skipping any that aren't in the tree
+    arrs = limit_tree.read_limit_tree(root_file_path,branches_to_get,strip_tracked=srip_poi_branch_names,ignore_missing=True)
     ret_dict = {}
-    for entry in range(limitTree.GetEntries()):
-        limitTree.GetEntry(entry)
-        for leaf in limitTree.GetListOfLeaves():
-            lname = leaf.GetName()
-            if lname in branches_to_get:
-                keyname = lname
-                if srip_poi_branch_names and lname.startswith("trackedParam_"):
-                    # Use just the poi name as the key
-                    keyname = lname.replace("trackedParam_","")
-                if keyname not in ret_dict: ret_dict[keyname] = []
-                ret_dict[keyname].append(limitTree.GetLeaf(lname).GetValue(0))
+    for keyname,arr in arrs.items():
+        ret_dict[keyname] = arr.tolist()
 
     return ret_dict
 
@@ -102,8 +91,45 @@ def make_branches_lst(poi_lst,scan_poi):
 
 # Get arrays that have only one copy of each scan point
 #   - Assuming the scan was along scan_var
-#   - In case of multiple scan_var values, choose the one with the min minimize_var value
-def get_unique_points(in_dict,scan_var,minimize_var):
+#   - In case of multiple scan_var values, choose the one with the min minimize_var value (the first one in case of ties)
+#   - The points that are kept stay in their original order
+#   - tol: If set, scan_var values that round to the same multiple of tol are treated as the same point
+#   - Returns a dict of numpy arrays
+def get_unique_points(in_dict,scan_var,minimize_var,tol=None):
+
+    arrs = {}
+    for var_name,var_vals in in_dict.items():
+        arrs[var_name] = np.asarray(var_vals)
+
+    # Make sure all of the lists have the same lenght
+    ref_len = len(arrs[scan_var])
+    for var_name in arrs.keys():
+        if len(arrs[var_name]) != ref_len:
+            print ref_len, len(arrs[var_name])
+            raise Exception("Error: Something is wrong , not all lists are the same len")
+    if ref_len == 0:
+        return arrs
+
+    keys = arrs[scan_var]
+    if tol:
+        keys = np.round(keys/float(tol))
+
+    # Sort by scan value, then by the value to minimize; lexsort is stable so ties keep the earliest index
+    order = np.lexsort((arrs[minimize_var],keys))
+    # The first entry of each group of equal scan values is then the one we want to keep
+    _,group_starts = np.unique(keys[order],return_index=True)
+    idx_to_keep = np.sort(order[group_starts])
+
+    out_dict = {}
+    for var_name,var_val_arr in arrs.items():
+        out_dict[var_name] = var_val_arr[idx_to_keep]
+
+    return out_dict
+
+
+# Original (pure python) implementation of get_unique_points(), kept around for cross checks
+#   - Returns lists instead of arrays
+def get_unique_points_legacy(in_dict,scan_var,minimize_var):
 
     # Make sure all of the lists have the same lenght
     ref_len = len(in_dict[scan_var])
@@ -201,7 +227,7 @@ def plotter_wrapper(lst_of_bestfit_dicts):
 # Find the best points in EFT space
 def get_best_nll_eft_point(in_dict,poi_lst):
     best_point_dict = {}
-    best_nll_idx = in_dict["deltaNLL"].index(min(in_dict["deltaNLL"]))
+    best_nll_idx = int(np.argmin(in_dict["deltaNLL"]))
     for poi_name in poi_lst + ["deltaNLL"]:
         poi_val = in_dict[poi_name]
         best_point_dict[poi_name] = in_dict[poi_name][best_nll_idx]
@@ -64,7 +64,7 @@ fi
 
 message="You may find ${USER}'s files in"
 
-echo "Extracting tar files: this will take some time"
+echo "Merging tar files: this will take some time"
 for dir in $dirs
 do
   if [[ ! "$dir[$1]" =~ "$dir" ]]; then
@@ -85,15 +85,9 @@ do
   fi
   message+="\n"
   files=`find -L . -name "*.tar" -type f -not -name "*tmp*"`
-  eval `mkdir -p tmp`
-  echo "Unpacking tar files"
-  for file in $files
-  do
-    tar xvf $file --skip-old-files -C tmp/
-  done
+  # Stream the limit trees straight out of the tar files (no tmp/ directory or hadd needed)
   echo "Creating ${eos}/${name}"
-  hadd -f -j $dir.root $dir/tmp/*POINTS*.root
-  rm -rf tmp
+  python ${CMSSW_BASE}/src/EFTFit/Fitter/scripts/merge_scan.py -o $dir.root --pattern "*POINTS*.root" $files
   message+=`ls -lrth $dir.root`
 done
 